@@ -1,14 +1,18 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
+import time
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
 from db.database import get_db
 from db.models import User
+from services.metrics import timed
 import os
 from dotenv import load_dotenv
 
@@ -20,12 +24,17 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-# OAuth2密码Bearer流程
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token")
+# 认证缓存配置
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "30"))  # 用户信息缓存时间（秒），0表示不缓存
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))  # 令牌和用户缓存的最大条目数
 
+# 已验证的令牌 -> (用户名, 过期时间戳)
+_token_cache = OrderedDict()
+# 用户名 -> (缓存过期时间, 脱离会话的用户快照)
+_user_cache = OrderedDict()
 
-class TokenData(BaseModel):
-    username: Optional[str] = None
+# OAuth2密码Bearer流程
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token")
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -39,24 +48,68 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+def decode_access_token(token: str) -> Optional[str]:
+    """解码JWT获取用户名，验证结果按令牌缓存到令牌过期，重复请求无需再验证签名"""
+    now = time.time()
+    cached = _token_cache.get(token)
+    if cached is not None:
+        username, expire = cached
+        if expire > now:
+            return username
+        del _token_cache[token]
+    
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    username: str = payload.get("sub")
+    if username is None:
+        return None
+    _token_cache[token] = (username, payload.get("exp", now))
+    if len(_token_cache) > AUTH_CACHE_MAX_SIZE:
+        _token_cache.popitem(last=False)
+    return username
+
+
+def cache_user(user: User):
+    """缓存用户的列数据快照，快照脱离会话，可在多个请求间共享"""
+    if AUTH_USER_CACHE_TTL <= 0:
+        return
+    snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(snapshot)
+    _user_cache[user.username] = (time.time() + AUTH_USER_CACHE_TTL, snapshot)
+    _user_cache.move_to_end(user.username)
+    if len(_user_cache) > AUTH_CACHE_MAX_SIZE:
+        _user_cache.popitem(last=False)
+
+
+def invalidate_user_cache(username: str):
+    """用户状态或余额变化后清除缓存"""
+    _user_cache.pop(username, None)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    # 令牌解码、缓存查询和用户加载计入auth阶段耗时
+    with timed("auth"):
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        try:
+            username = decode_access_token(token)
+            if username is None:
+                raise credentials_exception
+        except JWTError:
+            raise credentials_exception
+        
+        # 命中缓存时把快照并入当前会话，不查询数据库
+        cached = _user_cache.get(username)
+        if cached is not None and cached[0] > time.time():
+            return await db.merge(cached[1], load=False)
+        
+        user = await db.scalar(select(User).where(User.username == username))
+        if user is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        cache_user(user)
+        return user
 
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -65,6 +118,20 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     return current_user
 
 
+async def get_current_paying_user(current_user: User = Depends(get_current_active_user), db: AsyncSession = Depends(get_db)):
+    """扣费接口使用的当前用户：余额、启用状态和等级从数据库重新读取
+
+    用户缓存只能清除本进程中的条目，其他worker或后台任务进程修改的余额和启用状态最多要等
+    AUTH_USER_CACHE_TTL 秒才会生效，扣费和余额判断不能使用这样的快照。
+    """
+    if AUTH_USER_CACHE_TTL > 0:
+        with timed("auth"):
+            await db.refresh(current_user, ["balance", "is_active", "tier"])
+        if not current_user.is_active:
+            raise HTTPException(status_code=400, detail="Inactive user")
+    return current_user
+
+
 async def get_admin_user(current_user: User = Depends(get_current_active_user)):
     if not current_user.is_admin:
         raise HTTPException(
@@ -0,0 +1,67 @@
+import asyncio
+from typing import Awaitable, Optional, TypeVar
+
+from fastapi import Header, HTTPException, Request, status
+
+from services.deadline import DEADLINE_MIN_UPSTREAM, REQUEST_DEADLINE, ClientDisconnected, DeadlineExceeded, expired, remaining, set_deadline
+
+T = TypeVar("T")
+
+
+async def request_deadline(x_request_timeout: Optional[float] = Header(None, description="本次请求最多等待的秒数，只能缩短服务端的默认值")):
+    """设置本次请求的截止时间的依赖"""
+    timeout = REQUEST_DEADLINE or None
+    if x_request_timeout is not None and x_request_timeout > 0:
+        timeout = min(timeout, x_request_timeout) if timeout else x_request_timeout
+    set_deadline(timeout)
+
+
+def deadline_exceeded_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail="Request deadline exceeded. Please try again later."
+    )
+
+
+def client_closed_error() -> HTTPException:
+    # 客户端已经断开，响应不会被收到，状态码沿用nginx的499便于在指标中区分
+    return HTTPException(status_code=499, detail="Client closed request")
+
+
+def ensure_time_for_upstream():
+    """剩余时间不足以完成一次上游调用时，在冻结费用和选择密钥之前返回504"""
+    if expired(DEADLINE_MIN_UPSTREAM):
+        raise deadline_exceeded_error()
+
+
+async def _wait_disconnect(request: Request):
+    # 请求体已经读完，之后收到的消息只会是断开连接
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def until_disconnect_or_deadline(request: Request, awaitable: Awaitable[T]) -> T:
+    """等待awaitable完成；客户端先断开或超过截止时间时取消它，分别抛出ClientDisconnected和DeadlineExceeded
+
+    普通（非流式）响应在返回前不会感知客户端断开，需要用它包住等待上游的部分，才能及时释放上游调用和冻结的费用。
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_disconnect(request))
+    try:
+        await asyncio.wait((task, watcher), timeout=remaining(), return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if task.done():
+        return task.result()
+    task.cancel()
+    # 等待取消完成，让上游调用先释放密钥等资源
+    await asyncio.wait((task,))
+    if watcher.done() and not watcher.cancelled():
+        raise ClientDisconnected()
+    raise DeadlineExceeded()
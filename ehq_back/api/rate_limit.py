@@ -0,0 +1,33 @@
+import math
+
+from fastapi import Depends, HTTPException, status
+
+from db.models import User
+from api.auth import get_current_active_user
+from services.rate_limit import RATE_LIMIT_ENABLED, endpoint_limit, get_rate_limiter
+
+
+async def enforce_rate_limit(endpoint: str, user: User, cost: float = 1):
+    """按用户和全局令牌桶扣除cost个令牌，被限流时返回429并附带Retry-After"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    # 两个桶都有余量时才一起扣除，任一维度被限流的请求不消耗另一维度的配额
+    retry_after = await get_rate_limiter().check(endpoint, [
+        ("user", str(user.id), endpoint_limit(endpoint, "user")),
+        ("global", "all", endpoint_limit(endpoint, "global")),
+    ], cost)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests. Please slow down.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def rate_limit(endpoint: str):
+    """生成按用户和全局令牌桶限流的依赖"""
+
+    async def check_rate_limit(current_user: User = Depends(get_current_active_user)):
+        await enforce_rate_limit(endpoint, current_user)
+
+    return check_rate_limit
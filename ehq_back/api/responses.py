@@ -0,0 +1,131 @@
+import gzip
+import os
+from decimal import Decimal
+from typing import Iterable, List, Type
+
+import orjson
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from services.metrics import timed
+
+try:
+    import brotli
+except ImportError:  # 未安装brotli时只使用gzip
+    brotli = None
+
+# 加载环境变量
+load_dotenv()
+
+# 响应压缩配置：只压缩非流式响应，SSE不压缩以免缓冲
+RESPONSE_COMPRESSION_ENABLED = os.getenv("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "1024"))  # 小于该字节数的响应不压缩
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+# 不压缩的内容类型
+_UNCOMPRESSED_TYPES = (b"text/event-stream", b"image/", b"application/zip", b"application/gzip")
+
+
+def _default(value):
+    # 金额定点数按数字输出，与Pydantic模型中的float字段一致
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """用orjson序列化为JSON字节串"""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """用orjson序列化的JSON响应，并统计序列化耗时"""
+
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return dumps(content)
+
+
+def schema_columns(schema: Type[BaseModel], model) -> List:
+    """响应模型中各字段对应的ORM列，只查询这些列即可直接构造响应"""
+    return [getattr(model, name) for name in schema.model_fields if hasattr(model, name)]
+
+
+def rows_response(rows: Iterable) -> FastJSONResponse:
+    """把查询结果的行直接转换为JSON响应，跳过逐行的模型校验，用于只读的列表接口"""
+    return FastJSONResponse([dict(row._mapping) for row in rows])
+
+
+def _accepted_encoding(headers) -> str:
+    for name, value in headers:
+        if name == b"accept-encoding":
+            encodings = {item.split(b";")[0].strip() for item in value.lower().split(b",")}
+            if brotli is not None and b"br" in encodings:
+                return "br"
+            if b"gzip" in encodings:
+                return "gzip"
+    return ""
+
+
+class CompressionMiddleware:
+    """ASGI中间件：客户端支持时用brotli或gzip压缩较大的非流式响应
+
+    只处理一次性发送完的响应体；流式响应（包括SSE）原样转发，不会被缓冲。
+    """
+
+    def __init__(self, app, min_size: int = RESPONSE_COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = _accepted_encoding(scope["headers"]) if scope["type"] == "http" and RESPONSE_COMPRESSION_ENABLED else ""
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                content_type = headers.get(b"content-type", b"")
+                if b"content-encoding" in headers or content_type.startswith(_UNCOMPRESSED_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.min_size:
+                # 流式响应或较小的响应原样发送
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            with timed("compress"):
+                if encoding == "br":
+                    body = brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+                else:
+                    body = gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+            headers = [(name, value) for name, value in start_message.get("headers", []) if name != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send(dict(start_message, headers=headers))
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,18 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
-from db.database import get_db
-from db.models import User, ApiKey, QuestionRecord, Transaction
-from api.schemas import ApiKeyCreate, ApiKey as ApiKeySchema, ApiKeyUpdate, User as UserSchema, QuestionRecord as QuestionRecordSchema
-from api.auth import get_admin_user
+from db.database import get_db, pool_stats
+from db.models import User, ApiKey, QuestionRecord, Transaction, QUESTION_STATUS_QUEUED, QUESTION_STATUS_RUNNING
+from api.schemas import ApiKeyCreate, ApiKey as ApiKeySchema, ApiKeyUpdate, User as UserSchema, UserTierUpdate, QuestionRecord as QuestionRecordSchema
+from api.responses import rows_response, schema_columns
+from api.auth import get_admin_user, invalidate_user_cache
+from services.answer_cache import get_answer_cache
+from services.key_pool import get_key_pool
+from services.hedging import UPSTREAM_HEDGE_ENABLED, get_hedge_budget
+from services.upstream_scheduler import get_upstream_scheduler
+from services.question_types import get_question_type_stats
+from services.idempotency import IDEMPOTENCY_ENABLED, get_idempotency_store
+from services.rate_limit import get_rate_limiter
+from services.write_behind import get_write_behind
+from services.single_flight import get_single_flight, get_stream_flights
+from services.job_queue import get_job_queue
 
 router = APIRouter()
 
 
 # API密钥管理
 @router.post("/api-keys", response_model=ApiKeySchema)
-async def create_api_key(api_key: ApiKeyCreate, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def create_api_key(api_key: ApiKeyCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """创建新的API密钥"""
     db_api_key = ApiKey(
         key_name=api_key.key_name,
@@ -24,23 +36,33 @@ async def create_api_key(api_key: ApiKeyCreate, db: Session = Depends(get_db), c
     )
     
     db.add(db_api_key)
-    db.commit()
-    db.refresh(db_api_key)
+    await db.commit()
+    await db.refresh(db_api_key)
+    
+    # 刷新内存中的密钥池
+    await get_key_pool().load_async(db)
     
     return db_api_key
 
 
 @router.get("/api-keys", response_model=List[ApiKeySchema])
-async def get_api_keys(db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def get_api_keys(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """获取所有API密钥"""
-    api_keys = db.query(ApiKey).all()
-    return api_keys
+    # 只读列表直接按响应字段查询列并序列化，不为每一行构造ORM对象和做模型校验
+    result = await db.execute(select(*schema_columns(ApiKeySchema, ApiKey)).order_by(ApiKey.id))
+    return rows_response(result)
+
+
+@router.get("/api-keys/stats")
+async def get_api_key_stats(current_user: User = Depends(get_admin_user)):
+    """获取密钥池中各密钥的选择次数、错误率、限流率、延迟和熔断状态"""
+    return get_key_pool().stats()
 
 
 @router.get("/api-keys/{api_key_id}", response_model=ApiKeySchema)
-async def get_api_key(api_key_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def get_api_key(api_key_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """获取特定API密钥"""
-    api_key = db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
+    api_key = await db.scalar(select(ApiKey).where(ApiKey.id == api_key_id))
     if not api_key:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -50,9 +72,9 @@ async def get_api_key(api_key_id: int, db: Session = Depends(get_db), current_us
 
 
 @router.put("/api-keys/{api_key_id}", response_model=ApiKeySchema)
-async def update_api_key(api_key_id: int, api_key_update: ApiKeyUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def update_api_key(api_key_id: int, api_key_update: ApiKeyUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """更新API密钥信息"""
-    db_api_key = db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
+    db_api_key = await db.scalar(select(ApiKey).where(ApiKey.id == api_key_id))
     if not db_api_key:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -64,40 +86,126 @@ async def update_api_key(api_key_id: int, api_key_update: ApiKeyUpdate, db: Sess
     for key, value in update_data.items():
         setattr(db_api_key, key, value)
     
-    db.commit()
-    db.refresh(db_api_key)
+    await db.commit()
+    await db.refresh(db_api_key)
+    
+    # 刷新内存中的密钥池
+    await get_key_pool().load_async(db)
     
     return db_api_key
 
 
 @router.delete("/api-keys/{api_key_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_api_key(api_key_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def delete_api_key(api_key_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """删除API密钥"""
-    db_api_key = db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
+    db_api_key = await db.scalar(select(ApiKey).where(ApiKey.id == api_key_id))
     if not db_api_key:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="API key not found"
         )
     
-    db.delete(db_api_key)
-    db.commit()
+    await db.delete(db_api_key)
+    await db.commit()
+    
+    # 刷新内存中的密钥池
+    await get_key_pool().load_async(db)
     
     return {"status": "success"}
 
 
+# 答案缓存统计
+@router.get("/answer-cache/stats")
+async def get_answer_cache_stats(current_user: User = Depends(get_admin_user)):
+    """获取答案缓存命中统计"""
+    return get_answer_cache().stats()
+
+
+# 限流统计
+@router.get("/rate-limits/stats")
+async def get_rate_limit_stats(current_user: User = Depends(get_admin_user)):
+    """获取各维度被限流的请求次数"""
+    return get_rate_limiter().stats()
+
+
+# 数据库连接池统计
+@router.get("/db-pool/stats")
+async def get_db_pool_stats(current_user: User = Depends(get_admin_user)):
+    """获取数据库连接池使用情况和取出连接的等待时间"""
+    return pool_stats()
+
+
+# 合并请求统计
+@router.get("/single-flight/stats")
+async def get_single_flight_stats(current_user: User = Depends(get_admin_user)):
+    """获取相同题目的并发请求被合并为一次上游调用的次数"""
+    return {
+        "ask": get_single_flight().stats(),
+        "stream": get_stream_flights().stats(),
+    }
+
+
+@router.get("/upstream-queue/stats")
+async def get_upstream_queue_stats(current_user: User = Depends(get_admin_user)):
+    """获取上游并发的占用、排队和丢弃情况"""
+    return get_upstream_scheduler().stats()
+
+
+@router.get("/question-types/stats")
+async def get_question_type_stats_view(current_user: User = Depends(get_admin_user)):
+    """获取各题型的调用配置，以及上游调用的次数、平均token数和费用、截断次数和耗时"""
+    return get_question_type_stats().stats()
+
+
+@router.get("/idempotency/stats")
+async def get_idempotency_stats(current_user: User = Depends(get_admin_user)):
+    """获取幂等键的登记、重放、等待和冲突次数"""
+    return dict(get_idempotency_store().stats(), enabled=IDEMPOTENCY_ENABLED)
+
+
+@router.get("/hedging/stats")
+async def get_hedging_stats(current_user: User = Depends(get_admin_user)):
+    """获取对冲调用的发起次数、胜出次数和预算使用情况"""
+    return dict(get_hedge_budget().stats(), enabled=UPSTREAM_HEDGE_ENABLED)
+
+
+# 写后落库统计
+@router.get("/write-behind/stats")
+async def get_write_behind_stats(current_user: User = Depends(get_admin_user)):
+    """获取写后落库队列的积压、批量写入和重放情况"""
+    write_behind = get_write_behind()
+    if write_behind is None:
+        return {"enabled": False}
+    return write_behind.stats()
+
+
+# 后台任务统计
+@router.get("/jobs/stats")
+async def get_job_stats(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
+    """获取排队和执行中的后台任务数，以及本进程worker的执行统计"""
+    rows = await db.execute(
+        select(QuestionRecord.status, QuestionRecord.priority, func.count())
+        .where(QuestionRecord.status.in_((QUESTION_STATUS_QUEUED, QUESTION_STATUS_RUNNING)))
+        .group_by(QuestionRecord.status, QuestionRecord.priority)
+    )
+    backlog = {}
+    for job_status, priority, count in rows.all():
+        backlog.setdefault(job_status, {})[priority] = count
+    return {"backlog": backlog, "worker": get_job_queue().stats()}
+
+
 # 用户管理
 @router.get("/users", response_model=List[UserSchema])
-async def get_users(db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def get_users(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """获取所有用户"""
-    users = db.query(User).all()
-    return users
+    result = await db.execute(select(*schema_columns(UserSchema, User)).order_by(User.id))
+    return rows_response(result)
 
 
 @router.get("/users/{user_id}", response_model=UserSchema)
-async def get_user(user_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def get_user(user_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """获取特定用户"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -107,9 +215,9 @@ async def get_user(user_id: int, db: Session = Depends(get_db), current_user: Us
 
 
 @router.put("/users/{user_id}/activate", response_model=UserSchema)
-async def activate_user(user_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def activate_user(user_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """激活用户"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -117,15 +225,44 @@ async def activate_user(user_id: int, db: Session = Depends(get_db), current_use
         )
     
     user.is_active = True
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_user_cache(user.username)
     
     return user
 
 
 @router.put("/users/{user_id}/deactivate", response_model=UserSchema)
-async def deactivate_user(user_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+async def deactivate_user(user_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
     """停用用户"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
-        raise
\ No newline at end of file
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    user.is_active = False
+    await db.commit()
+    await db.refresh(user)
+    invalidate_user_cache(user.username)
+    
+    return user
+
+
+@router.put("/users/{user_id}/tier", response_model=UserSchema)
+async def update_user_tier(user_id: int, tier_update: UserTierUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_admin_user)):
+    """修改用户等级，之后提交的后台任务按新等级的优先级排队"""
+    user = await db.scalar(select(User).where(User.id == user_id))
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    user.tier = tier_update.tier
+    await db.commit()
+    await db.refresh(user)
+    invalidate_user_cache(user.username)
+    
+    return user
@@ -0,0 +1,86 @@
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from db.database import pool_stats
+from services.answer_cache import get_answer_cache
+from services.key_pool import get_key_pool
+from services.hedging import get_hedge_budget
+from services.single_flight import get_single_flight, get_stream_flights
+from services.write_behind import get_write_behind
+from services.job_queue import get_job_queue
+from services.upstream_scheduler import get_upstream_scheduler
+from services.metrics import METRICS_TOKEN, registry
+
+router = APIRouter()
+
+
+def collect_db_pool():
+    stats = pool_stats()
+    for key in ("size", "checked_out", "overflow"):
+        if key in stats:
+            yield f"ehq_db_pool_{key}", "gauge", "数据库连接池状态", {}, stats[key]
+    yield "ehq_db_pool_checkouts_total", "counter", "从连接池取出连接的次数", {}, stats["checkouts"]
+    yield "ehq_db_pool_timeouts_total", "counter", "等待连接超时的次数", {}, stats["timeouts"]
+    for quantile in ("p50", "p99"):
+        yield "ehq_db_pool_wait_seconds", "gauge", "最近取出连接的等待时间", {"quantile": quantile}, stats[f"wait_{quantile}_ms"] / 1000
+
+
+def collect_answer_cache():
+    stats = get_answer_cache().stats()
+    for tier in ("memory_hits", "shared_hits", "misses"):
+        yield "ehq_answer_cache_lookups_total", "counter", "答案缓存查询次数", {"result": tier}, stats[tier]
+    yield "ehq_answer_cache_hit_ratio", "gauge", "答案缓存命中率", {}, stats["hit_ratio"]
+    yield "ehq_answer_cache_entries", "gauge", "内存答案缓存的条目数", {}, stats["entries"]
+
+
+def collect_key_pool():
+    for key in get_key_pool().stats():
+        labels = {"api_key": key["key_name"]}
+        yield "ehq_api_key_in_flight", "gauge", "各API密钥正在进行的调用数", labels, key["in_flight"]
+        yield "ehq_api_key_circuit_open", "gauge", "API密钥是否处于熔断状态", labels, int(key["circuit_open"])
+        if key["latency_p90"] is not None:
+            yield "ehq_api_key_latency_p90_seconds", "gauge", "各API密钥最近非流式调用耗时的p90", labels, key["latency_p90"]
+    stats = get_hedge_budget().stats()
+    for outcome, value in (("sent", stats["hedges"]), ("won", stats["hedge_wins"]), ("denied", stats["denied"])):
+        yield "ehq_upstream_hedges_total", "counter", "对冲调用次数：发起、胜出、因预算用尽未发起", {"outcome": outcome}, value
+
+
+def collect_coalescing():
+    for kind, stats in (("ask", get_single_flight().stats()), ("stream", get_stream_flights().stats())):
+        labels = {"kind": kind}
+        yield "ehq_single_flight_upstream_calls_total", "counter", "合并后实际发起的上游调用次数", labels, stats["upstream_calls"]
+        yield "ehq_single_flight_coalesced_total", "counter", "被合并到进行中调用的请求数", labels, stats["coalesced"]
+        yield "ehq_single_flight_cancelled_total", "counter", "所有等待的请求都已结束而取消的上游调用次数", labels, stats["cancelled"]
+
+
+def collect_queues():
+    write_behind = get_write_behind()
+    if write_behind is not None:
+        stats = write_behind.stats()
+        yield "ehq_write_behind_pending", "gauge", "写后落库队列中待写入的条目数", {}, stats["pending"]
+        yield "ehq_write_behind_failures_total", "counter", "写后落库批量写入失败的次数", {}, stats["failures"]
+    stats = get_job_queue().stats()
+    yield "ehq_jobs_running", "gauge", "本进程正在执行的后台任务数", {}, stats["running"]
+    for outcome in ("completed", "failed", "retried", "recovered"):
+        yield "ehq_jobs_total", "counter", "本进程后台任务的执行结果", {"outcome": outcome}, stats[outcome]
+    stats = get_upstream_scheduler().stats()
+    if stats["enabled"]:
+        yield "ehq_upstream_active", "gauge", "正在进行的上游调用数", {}, stats["active"]
+        yield "ehq_upstream_queued", "gauge", "等待上游并发的调用数", {}, stats["queued"]
+        yield "ehq_upstream_queued_users", "gauge", "有调用在排队的用户数", {}, stats["queued_users"]
+
+
+for _collector in (collect_db_pool, collect_answer_cache, collect_key_pool, collect_coalescing, collect_queues):
+    registry.add_collector(_collector)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """以Prometheus文本格式输出本进程的指标"""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token"
+        )
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,61 +1,114 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-import requests
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import List, Optional
+import asyncio
 import json
+import math
 import os
+import re
+import time
+from anyio import CancelScope
 from dotenv import load_dotenv
 
-from db.database import get_db
-from db.models import User, ApiKey, QuestionRecord
-from api.schemas import QuestionRecordCreate, QuestionResponse, QuestionRecord as QuestionRecordSchema
-from api.auth import get_current_active_user
+from db.database import get_db, db_session
+from db.models import (
+    User, QuestionRecord, QUESTION_STATUS_COMPLETED, QUESTION_STATUS_QUEUED,
+    FINISH_REASON_STOP, FINISH_REASON_LENGTH, FINISH_REASON_INCOMPLETE
+)
+from api.schemas import QuestionRecordCreate, QuestionBatchCreate, QuestionResponse, QuestionRecord as QuestionRecordSchema, QuestionJob, QuestionHistoryPage
+from api.auth import get_current_active_user, get_current_paying_user, invalidate_user_cache
+from api.rate_limit import enforce_rate_limit, rate_limit
+from api.responses import FastJSONResponse, dumps
+from api.deadline import client_closed_error, deadline_exceeded_error, ensure_time_for_upstream, request_deadline, until_disconnect_or_deadline
+from services.doubao_client import DoubaoClient, DoubaoAPIError, get_doubao_client
+from services.answer_cache import AnswerCache, ANSWER_CACHE_ENABLED, cache_charge_ratio, get_answer_cache, make_cache_key
+from services.similarity_index import SimilarityIndex, SIMILARITY_INDEX_ENABLED, get_similarity_index
+from services.write_behind import get_write_behind
+from services.single_flight import SingleFlight, StreamFlight, StreamFlightGroup, get_single_flight, get_stream_flights
+from services.key_pool import ApiKeyPool, KEY_POOL_MAX_ATTEMPTS, get_key_pool, is_retryable
+from services.rate_limit import KeysThrottled, get_rate_limiter
+from services.token_estimator import TOKEN_ESTIMATE_MARGIN, get_token_estimator
+from services.question_types import SYSTEM_PROMPT, get_question_type_stats, question_profile
+from services.hedging import UPSTREAM_HEDGE_ENABLED, get_hedge_budget, hedge_delay
+from services.upstream_scheduler import UPSTREAM_QUEUE_NOTIFY_INTERVAL, UPSTREAM_RETRY_AFTER, SchedulerOverloaded, get_upstream_scheduler, set_upstream_owner
+from services.idempotency import IDEMPOTENCY_ENABLED, IdempotencyConflict, IdempotencyInProgress, get_idempotency_store, request_fingerprint
+from services.deadline import DEADLINE_MIN_UPSTREAM, ClientDisconnected, DeadlineExceeded, charge_cancelled, expired, remaining
+from services.metrics import record_cancelled, record_upstream_call, timed
+from services.job_queue import JobError, JobQueue, FINISHED_STATUSES, JOB_POLL_INTERVAL, get_job_queue, tier_priority
+from services import ledger
+from services.ledger import Hold, to_money
 
 # 加载环境变量
 load_dotenv()
 
 router = APIRouter()
 
+# 余额不足以支付完整的max_tokens时降低max_tokens，但至少保留该数量（题型的max_tokens更小时以题型为准），否则直接返回402
+MIN_ANSWER_TOKENS = int(os.getenv("MIN_ANSWER_TOKENS", "500"))
 
-# 豆包API调用函数
-def call_doubao_api(api_key: str, question: str):
-    """调用豆包API处理英语题目"""
-    # 这里是豆包API的调用实现
-    # 根据实际的豆包API文档进行调用
-    # 示例实现
-    url = "https://api.doubao.com/v1/chat/completions"  # 替换为实际的豆包API地址
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    # 构建提示词，引导AI解答英语题目
-    prompt = f"""请你作为一位专业的英语教师，解答以下英语题目。请提供详细的解析，包括语法分析、词汇解释和答案推导过程。
+# 每1000个token的价格（元）
+PRICE_PER_1K_TOKENS = Decimal("0.5")
+
+# 历史记录列表中题目预览的最大字符数
+HISTORY_QUESTION_PREVIEW_LENGTH = 100
+
+# 批量提问配置
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))  # 每批最多题目数（去重后）
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # 每批同时调用上游的题目数
 
-题目：{question}
+# 查询后台任务时最长等待的秒数，应小于反向代理的空闲超时
+JOB_LONG_POLL_MAX = float(os.getenv("JOB_LONG_POLL_MAX", "25"))
 
-请按照以下格式回答：
-1. 题目分析
-2. 解题思路
-3. 详细解答
-4. 正确答案
-5. 相关知识点扩展"""
+# 题号：行首的 "1." "2、" "3)" "(4)" "（5）" 等
+_question_number_re = re.compile(r"^\s*(?:\d{1,3}\s*[.、．:：)）]|[（(]\d{1,3}[)）])\s*")
+
+
+# 构建豆包API请求体
+def build_doubao_payload(question: str, max_tokens: Optional[int] = None):
+    """按题型选择提示词模板和模型，构建解答英语题目的请求体；max_tokens为空时使用题型的max_tokens"""
+    profile = question_profile(question)
+    # 构建提示词，引导AI解答英语题目
+    prompt = profile.template.format(question=question)
     
-    payload = {
-        "model": "doubao-model",  # 替换为实际的豆包模型名称
+    return {
+        "model": profile.model,
         "messages": [
-            {"role": "system", "content": "你是一位专业的英语教师，擅长解答各类英语题目并提供详细解析。"},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.7,
-        "max_tokens": 2000
+        "max_tokens": max_tokens or profile.max_tokens
     }
+
+
+# 提示词中固定部分的token数
+@lru_cache(maxsize=None)
+def fixed_prompt_tokens(template: str) -> int:
+    """系统提示词、模板（不含题目）和消息格式开销的token数，每个模板只计算一次"""
+    estimator = get_token_estimator()
+    before, after = template.split("{question}")
+    # 题目与模板拼接处的切分可能与分别切分时不同，各多算1个token
+    return estimator.count_messages([SYSTEM_PROMPT, before + after]) + 2
+
+
+# 估算提示词的token数
+def estimate_prompt_tokens(question: str) -> int:
+    """估算题目对应提示词的token数：固定部分只计算一次，每次只对题目分词，并乘以安全系数"""
+    return math.ceil((fixed_prompt_tokens(question_profile(question).template) + get_token_estimator().count(question)) * TOKEN_ESTIMATE_MARGIN)
+
+
+# 豆包API调用函数
+async def call_doubao_api(client: DoubaoClient, api_key: str, question: str, max_tokens: Optional[int] = None):
+    """调用豆包API处理英语题目"""
+    payload = build_doubao_payload(question, max_tokens)
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
+        result = await client.chat_completion(api_key, payload)
         
         # 解析响应获取回答内容和token使用量
         answer = result["choices"][0]["message"]["content"]
@@ -64,36 +117,593 @@ def call_doubao_api(api_key: str, question: str):
         return {
             "answer": answer,
             "tokens_used": tokens_used,
+            # 达到max_tokens被截断的解答不完整
+            "truncated": result["choices"][0].get("finish_reason") == "length",
             "success": True
         }
+    except DoubaoAPIError as e:
+        return {
+            "answer": f"API调用失败: {str(e)}",
+            "tokens_used": 0,
+            "success": False,
+            "status_code": e.status_code
+        }
     except Exception as e:
         return {
             "answer": f"API调用失败: {str(e)}",
             "tokens_used": 0,
-            "success": False
+            "success": False,
+            "status_code": None
         }
 
 
 # 获取可用的API密钥
-def get_available_api_key(db: Session):
-    """获取可用的API密钥，按优先级排序"""
-    api_keys = db.query(ApiKey).filter(ApiKey.is_active == True).order_by(ApiKey.priority).all()
-    if not api_keys:
-        return None
-    return api_keys[0]
+async def get_available_api_key(pool: ApiKeyPool, exclude=()):
+    """从密钥池中选择可用的API密钥，同优先级的密钥按余额和延迟加权分配，跳过RPM/TPM配额已用尽的密钥
+
+    没有可用的密钥时返回None；剩下的密钥都只是配额用尽时抛出KeysThrottled，带最早恢复配额的等待秒数。
+    """
+    limiter = get_rate_limiter()
+    exclude = set(exclude)
+    retry_after = None
+    with timed("key_select"):
+        while True:
+            api_key = pool.select(exclude)
+            if api_key is None:
+                if retry_after is not None:
+                    raise KeysThrottled(retry_after)
+                return None
+            wait = await limiter.acquire_key(api_key.id)
+            if not wait:
+                return api_key
+            retry_after = wait if retry_after is None else min(retry_after, wait)
+            exclude.add(api_key.id)
+
+
+# 所有密钥都被限流时的等待时间
+async def keys_retry_after(pool: ApiKeyPool) -> float:
+    """只检查不消耗配额：有密钥还有RPM/TPM余量时返回0，否则返回最早恢复配额的等待秒数"""
+    limiter = get_rate_limiter()
+    exclude = set()
+    retry_after = 0.0
+    while True:
+        api_key = pool.select(exclude)
+        if api_key is None:
+            return retry_after
+        wait = await limiter.key_retry_after(api_key.id)
+        if not wait:
+            return 0.0
+        retry_after = wait if not retry_after else min(retry_after, wait)
+        exclude.add(api_key.id)
+
+
+# 用指定密钥调用一次豆包API
+async def call_with_key(client: DoubaoClient, pool: ApiKeyPool, api_key, question: str, max_tokens: Optional[int] = None):
+    """调用一次豆包API并更新密钥池统计；调用被取消（客户端断开或对冲落败）时只归还在途计数"""
+    pool.begin(api_key)
+    start = time.perf_counter()
+    try:
+        result = await call_doubao_api(client, api_key.api_key, question, max_tokens)
+    except asyncio.CancelledError:
+        pool.release(api_key)
+        raise
+    
+    latency = time.perf_counter() - start
+    record_upstream_call(api_key.key_name, latency, result["success"], result["tokens_used"])
+    if result["success"]:
+        pool.report_success(api_key, latency)
+        pool.observe_latency(api_key, latency)
+        await get_rate_limiter().consume_key_tokens(api_key.id, result["tokens_used"])
+        get_question_type_stats().record(question_profile(question).question_type, latency, result["tokens_used"], calculate_cost(result["tokens_used"]), result["truncated"])
+    else:
+        pool.report_failure(api_key, result.get("status_code"))
+    return result
+
+
+# 带故障转移的豆包API调用
+async def call_doubao_with_failover(client: DoubaoClient, pool: ApiKeyPool, question: str, max_tokens: Optional[int] = None):
+    """依次尝试密钥池中的密钥，失败时自动换下一个密钥重试，返回 (调用结果, 使用的密钥ID)
+
+    启用对冲时，调用超过该密钥最近的分位耗时仍未返回，就在对冲预算内用另一个密钥发起相同的调用（每次提问最多一次），
+    先成功返回的调用胜出，另一个被取消。
+    """
+    budget = get_hedge_budget()
+    scheduler = get_upstream_scheduler()
+    tried = set()
+    result = None
+    # 进行中的调用任务 -> 使用的密钥
+    calls = {}
+    hedged = False
+    hedge_task = None
+    try:
+        while True:
+            if not calls:
+                # 剩余时间不够再完成一次调用时不再换密钥重试
+                if len(tried) >= KEY_POOL_MAX_ATTEMPTS or (tried and expired(DEADLINE_MIN_UPSTREAM)):
+                    break
+                api_key = await get_available_api_key(pool, tried)
+                if api_key is None:
+                    break
+                tried.add(api_key.id)
+                budget.record_primary()
+                calls[asyncio.ensure_future(call_with_key(client, pool, api_key, question, max_tokens))] = api_key
+            
+            delay = None
+            if UPSTREAM_HEDGE_ENABLED and not hedged and len(tried) < KEY_POOL_MAX_ATTEMPTS and not expired(DEADLINE_MIN_UPSTREAM):
+                delay = hedge_delay(next(iter(calls.values())))
+            done, _ = await asyncio.wait(calls, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            
+            if not done:
+                # 主调用超过分位耗时仍未返回，预算允许时用另一个密钥对冲；预算用尽或没有其他密钥时继续等待主调用
+                hedged = True
+                hedge_key = None
+                # 对冲只使用空闲的上游并发，不和排队的调用争抢
+                if scheduler.try_acquire():
+                    if budget.try_spend():
+                        try:
+                            hedge_key = await get_available_api_key(pool, tried)
+                        except KeysThrottled:
+                            # 其他密钥配额用尽时不对冲，继续等待主调用
+                            hedge_key = None
+                        if hedge_key is None:
+                            budget.refund()
+                    if hedge_key is None:
+                        scheduler.release()
+                if hedge_key is None:
+                    continue
+                tried.add(hedge_key.id)
+                hedge_task = asyncio.ensure_future(call_with_key(client, pool, hedge_key, question, max_tokens))
+                hedge_task.add_done_callback(lambda task: scheduler.release())
+                calls[hedge_task] = hedge_key
+                continue
+            
+            # 主调用和对冲调用可能同时完成，先在所有已完成的调用中找成功的结果，再处理失败
+            finished = [(task, calls.pop(task)) for task in done]
+            for task, api_key in finished:
+                if task.result()["success"]:
+                    if task is hedge_task:
+                        budget.hedge_wins += 1
+                    return task.result(), api_key.id
+            for task, api_key in finished:
+                result = task.result()
+                if not is_retryable(result.get("status_code")):
+                    return result, None
+            # 失败的调用之外还有进行中的调用时继续等待它，否则换下一个密钥
+    finally:
+        # 取消落败或不再需要的调用
+        for task in calls:
+            task.cancel()
+    return result, None
+
+
+# 调用上游获取答案
+async def fetch_answer(client: DoubaoClient, pool: ApiKeyPool, cache: AnswerCache, question: str, max_tokens: Optional[int] = None):
+    """调用豆包API，失败时自动换密钥重试；得到完整解答时写入答案缓存，返回 (调用结果, 使用的密钥ID)
+
+    上游并发已满时先按用户公平排队，排队已满时抛出SchedulerOverloaded。
+    """
+    async with get_upstream_scheduler().slot():
+        result, api_key_id = await call_doubao_with_failover(client, pool, question, max_tokens)
+    if result is not None and result["success"] and not result["truncated"]:
+        await cache.set(answer_cache_key(question), result["answer"], result["tokens_used"])
+    return result, api_key_id
 
 
 # 计算费用
-def calculate_cost(tokens_used: int):
+def calculate_cost(tokens_used: int) -> Decimal:
     """根据使用的token数量计算费用"""
     # 这里可以根据实际的计费标准进行调整
     # 示例：每1000个token收费0.5元
-    return (tokens_used / 1000) * 0.5
+    return to_money(Decimal(tokens_used) * PRICE_PER_1K_TOKENS / 1000)
+
+
+# 预估最高费用
+def estimate_hold_cost(question: str, max_tokens: Optional[int] = None) -> Decimal:
+    """按估算的提示词token数加上max_tokens（为空时为题型的max_tokens）计算本次调用的最高费用，用于调用上游前冻结余额"""
+    return calculate_cost(estimate_prompt_tokens(question) + (max_tokens or question_profile(question).max_tokens))
+
+
+# 最短解答的token数
+def min_answer_tokens(question: str) -> int:
+    return min(MIN_ANSWER_TOKENS, question_profile(question).max_tokens)
+
+
+# 按余额确定max_tokens
+def affordable_max_tokens(balance, question: str) -> Optional[int]:
+    """余额足够时返回题型的max_tokens，不足时降低到余额能支付的数量；连最短解答都付不起时返回None"""
+    affordable = int(to_money(balance) * 1000 / PRICE_PER_1K_TOKENS) - estimate_prompt_tokens(question)
+    max_tokens = min(question_profile(question).max_tokens, affordable)
+    return max_tokens if max_tokens >= min_answer_tokens(question) else None
+
+
+# 合并请求的键
+def flight_key(question: str, max_tokens: int) -> str:
+    """max_tokens被降低的调用只与相同max_tokens的请求合并"""
+    key = answer_cache_key(question)
+    return key if max_tokens == question_profile(question).max_tokens else f"{key}:{max_tokens}"
+
+
+# 答案缓存键
+def answer_cache_key(question: str):
+    """按规范化题目、题型的提示词版本和模型生成答案缓存键"""
+    profile = question_profile(question)
+    return make_cache_key(question, profile.template_version, profile.model)
+
+
+# 查询答案缓存
+async def lookup_cached_answer(db: AsyncSession, cache: AnswerCache, index: SimilarityIndex, question: str):
+    """先精确匹配答案缓存，再查找近似重复的历史题目，命中时返回答案、token数和按计费策略折算后的费用"""
+    cached = None
+    if ANSWER_CACHE_ENABLED:
+        cached = await cache.get(answer_cache_key(question))
+    if cached is None and SIMILARITY_INDEX_ENABLED:
+        match = index.lookup(question)
+        if match:
+            record = await db.get(QuestionRecord, match[0])
+            # 只复用完整且由题目当前提示词模板生成的解答
+            if (
+                record is not None and record.answer and record.finish_reason == FINISH_REASON_STOP
+                and record.prompt_version == question_profile(question).template_version
+            ):
+                cached = {"answer": record.answer, "tokens_used": record.tokens_used}
+    if cached is None:
+        return None
+    return {
+        "answer": cached["answer"],
+        "tokens_used": cached["tokens_used"],
+        "cost": shared_answer_cost(cached["tokens_used"])
+    }
+
+
+# 复用答案的费用
+def shared_answer_cost(tokens_used: int) -> Decimal:
+    """命中缓存或与其他请求合并调用时，按缓存计费策略折算费用"""
+    return to_money(calculate_cost(tokens_used) * Decimal(str(cache_charge_ratio())))
+
+
+# 上游调用结果的完成情况
+def result_finish_reason(result: dict) -> str:
+    """达到max_tokens被截断的解答为length，否则为stop"""
+    return FINISH_REASON_LENGTH if result["truncated"] else FINISH_REASON_STOP
+
+
+# 扣费并保存问题记录
+async def save_question_record(db: AsyncSession, user: User, question: str, answer: str, tokens_used: int, api_key_id: Optional[int], cost: Optional[Decimal] = None, hold: Optional[Hold] = None, allow_overdraft: bool = False, index_answer: bool = False, finish_reason: str = FINISH_REASON_STOP):
+    """扣费并保存问题记录，返回接口响应；未指定费用时按token数计算，有冻结时按实际费用结算冻结
+
+    余额变更在请求中同步提交，余额不足时回滚并返回402。启用写后落库时问题记录和消费流水交给后台批量写入，
+    响应中的id为空；否则与余额变更在同一事务中提交。index_answer为True时记录落库后加入相似题目索引。
+    finish_reason记录解答是否完整，prompt_version记录题目当前使用的提示词模板版本，
+    只有完整且模板版本与当前一致的解答会在启动时用于预热答案缓存。
+    """
+    if cost is None:
+        cost = calculate_cost(tokens_used)
+    write_behind = get_write_behind()
+    # 结束查询缓存等操作开启的只读事务，扣费在新事务中以写操作开始
+    await db.commit()
+    
+    # 问题记录
+    row = {
+        "user_id": user.id,
+        "question": question,
+        "answer": answer,
+        "tokens_used": tokens_used,
+        "cost": cost,
+        "api_key_id": api_key_id,
+        "finish_reason": finish_reason,
+        "prompt_version": question_profile(question).template_version
+    }
+    question_record = None
+    if write_behind is None:
+        question_record = QuestionRecord(**row)
+        db.add(question_record)
+    
+    if hold is not None:
+        await ledger.settle(db, hold, cost)
+    elif not await ledger.charge(db, user.id, cost, allow_overdraft=allow_overdraft, record=write_behind is None):
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Insufficient balance. Required: {cost}"
+        )
+    
+    await db.commit()
+    invalidate_user_cache(user.username)
+    
+    if write_behind is None:
+        await db.refresh(question_record)
+        if index_answer:
+            get_similarity_index().add(question_record.id, question_record.question)
+        return question_response(question_record)
+    
+    # 余额已经扣除，审计数据不必等待落库
+    transactions = [] if hold is not None else [ledger.consumption_row(user.id, cost)]
+    await write_behind.enqueue(row, transactions, index=index_answer and SIMILARITY_INDEX_ENABLED)
+    return {
+        "id": None,
+        "question": question,
+        "answer": answer,
+        "tokens_used": tokens_used,
+        "cost": cost,
+        "created_at": datetime.utcnow()
+    }
+
+
+# 冻结预估费用
+async def reserve_for_question(db: AsyncSession, user: User, question: str, allow_cap: bool = True):
+    """调用上游前按最高费用检查余额，返回 (冻结, 本次调用的max_tokens)
+
+    余额不足以支付完整的max_tokens时，allow_cap为True则降低max_tokens，否则与连最短解答都付不起时一样返回402。
+    reserve模式下冻结最高费用，charge模式下不冻结，返回的冻结为None。
+    """
+    # 先结束只读事务：SQLite下读锁升级为写锁时遇到并发写入会直接报错而不是等待
+    await db.commit()
+    # 回滚后会话中的对象已过期，提前取出余额
+    available = user.balance
+    max_tokens = affordable_max_tokens(available, question)
+    if max_tokens is None or (max_tokens < question_profile(question).max_tokens and not allow_cap):
+        required = estimate_hold_cost(question, min_answer_tokens(question) if allow_cap else None)
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Insufficient balance. Required: {required}, Available: {available}"
+        )
+    if ledger.LEDGER_MODE != "reserve":
+        return None, max_tokens
+    amount = estimate_hold_cost(question, max_tokens)
+    hold = await ledger.reserve(db, user.id, amount)
+    if hold is None:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Insufficient balance. Required: {amount}, Available: {available}"
+        )
+    return hold, max_tokens
+
+
+# 取消冻结
+async def release_hold(hold: Optional[Hold]):
+    """上游调用失败或没有生成内容时全额退回冻结的费用"""
+    if hold is None:
+        return
+    async with db_session() as db:
+        await ledger.release(db, hold)
+        await db.commit()
+
+
+# 问题记录转换为响应
+def question_response(question_record: QuestionRecord) -> dict:
+    return {
+        "id": question_record.id,
+        "question": question_record.question,
+        "answer": question_record.answer,
+        "tokens_used": question_record.tokens_used,
+        "cost": question_record.cost,
+        "created_at": question_record.created_at
+    }
+
+
+# 拆分整张练习题
+def split_questions(text: str) -> List[str]:
+    """按行首题号拆分为单独的题目并去掉题号，题号之前的说明文字忽略；没有题号时按空行拆分"""
+    lines = text.splitlines()
+    if not any(_question_number_re.match(line) for line in lines):
+        return [block.strip() for block in re.split(r"\n\s*\n", text) if block.strip()]
+    
+    questions = []
+    current = None
+    for line in lines:
+        match = _question_number_re.match(line)
+        if match:
+            if current:
+                questions.append("\n".join(current).strip())
+            current = [line[match.end():]]
+        elif current is not None:
+            current.append(line)
+    if current:
+        questions.append("\n".join(current).strip())
+    return [question for question in questions if question]
+
+
+# 批量题目去重
+def dedupe_questions(questions: List[str]) -> List[str]:
+    """按答案缓存键去掉重复题目，保留第一次出现的顺序"""
+    seen = set()
+    unique = []
+    for question in questions:
+        question = question.strip()
+        key = answer_cache_key(question)
+        if question and key not in seen:
+            seen.add(key)
+            unique.append(question)
+    return unique
+
+
+# 保存批量提问的记录
+async def save_batch_records(user_id: int, username: str, questions: List[str], results: dict, hold: Hold):
+    """在一个事务中写入整批问题记录，并按实际总费用结算整批冻结，返回汇总"""
+    answered = [(questions[i], results[i]) for i in sorted(results) if "answer" in results[i]]
+    total = to_money(sum((result["cost"] for _, result in answered), Decimal(0)))
+    records = [
+        QuestionRecord(
+            user_id=user_id,
+            question=question,
+            answer=result["answer"],
+            tokens_used=result["tokens_used"],
+            cost=result["cost"],
+            api_key_id=result["api_key_id"],
+            finish_reason=result["finish_reason"],
+            prompt_version=question_profile(question).template_version
+        )
+        for question, result in answered
+    ]
+    
+    async with db_session() as db:
+        for record in records:
+            db.add(record)
+        if records:
+            await ledger.settle(db, hold, total, "批量提问消费")
+        else:
+            await ledger.release(db, hold)
+        await db.commit()
+    invalidate_user_cache(username)
+    
+    # 自己调用上游得到的完整解答加入相似题目索引
+    if SIMILARITY_INDEX_ENABLED:
+        for record, (_, result) in zip(records, answered):
+            if result["index"]:
+                get_similarity_index().add(record.id, record.question)
+    
+    return {
+        "succeeded": len(records),
+        "failed": sum(1 for result in results.values() if "error" in result),
+        "cancelled": len(questions) - len(results),
+        "cost": total,
+        "record_ids": [record.id for record in records]
+    }
 
 
-@router.post("/ask", response_model=QuestionResponse)
-async def ask_question(question: QuestionRecordCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
-    """处理用户提交的英语题目"""
+# 流式调用豆包API
+async def stream_answer(flight: StreamFlight, client: DoubaoClient, pool: ApiKeyPool, cache: AnswerCache, question: str, payload: dict, prompt_tokens: int):
+    """调用上游流式接口，把增量内容发布给订阅同一题目的所有请求；推送内容前失败时自动换密钥重试"""
+    scheduler = get_upstream_scheduler()
+    try:
+        await scheduler.acquire()
+    except SchedulerOverloaded as e:
+        flight.error = str(e)
+        return
+    try:
+        tried = set()
+        finish_reason = None
+        while True:
+            try:
+                api_key = await get_available_api_key(pool, tried)
+            except KeysThrottled as e:
+                flight.error = flight.error or str(e)
+                return
+            if api_key is None:
+                flight.error = flight.error or "No available API key"
+                return
+            tried.add(api_key.id)
+            flight.api_key_id = api_key.id
+            
+            pool.begin(api_key)
+            start = time.perf_counter()
+            try:
+                async for chunk in client.stream_chat_completion(api_key.api_key, payload):
+                    # 部分上游会在最后一个数据块中返回usage
+                    if chunk.get("usage"):
+                        flight.usage_tokens = chunk["usage"].get("total_tokens")
+                    choices = chunk.get("choices") or []
+                    content = choices[0].get("delta", {}).get("content") if choices else None
+                    if choices and choices[0].get("finish_reason"):
+                        finish_reason = choices[0]["finish_reason"]
+                    if content:
+                        await flight.publish(content)
+            except DoubaoAPIError as e:
+                record_upstream_call(api_key.key_name, time.perf_counter() - start, False)
+                pool.report_failure(api_key, e.status_code)
+                flight.error = str(e)
+                # 已经推送内容后不能再换密钥重试，剩余时间不够再完成一次调用时也不再重试
+                if flight.parts or len(tried) >= KEY_POOL_MAX_ATTEMPTS or not is_retryable(e.status_code) or expired(DEADLINE_MIN_UPSTREAM):
+                    return
+                continue
+            except BaseException:
+                pool.release(api_key)
+                raise
+            
+            # 每个增量数据块按一个token计数
+            tokens_used = flight.usage_tokens or prompt_tokens + len(flight.parts)
+            record_upstream_call(api_key.key_name, time.perf_counter() - start, True, tokens_used)
+            pool.report_success(api_key, time.perf_counter() - start)
+            await get_rate_limiter().consume_key_tokens(api_key.id, tokens_used)
+            get_question_type_stats().record(question_profile(question).question_type, time.perf_counter() - start, tokens_used, calculate_cost(tokens_used), finish_reason == "length")
+            flight.error = None
+            flight.finish_reason = finish_reason
+            # 完整生成的解答写入缓存，达到max_tokens被截断的解答不写入
+            flight.completed = bool(flight.parts) and finish_reason != "length"
+            if flight.completed:
+                await cache.set(answer_cache_key(question), "".join(flight.parts), tokens_used)
+            return
+    finally:
+        scheduler.release()
+
+
+# 执行后台提问任务
+async def process_question_job(job: QuestionRecord) -> dict:
+    """后台任务的处理函数：先查答案缓存，未命中时调用上游（与相同题目的并发请求合并），返回解答和费用"""
+    cache = get_answer_cache()
+    async with db_session() as db:
+        cached = await lookup_cached_answer(db, cache, get_similarity_index(), job.question)
+        if not cached:
+            set_upstream_owner(job.user_id, await db.scalar(select(User.tier).where(User.id == job.user_id)))
+    if cached:
+        return dict(cached, api_key_id=None, index=False, finish_reason=FINISH_REASON_STOP, prompt_version=question_profile(job.question).template_version)
+    
+    (result, api_key_id), shared = await get_single_flight().do(
+        answer_cache_key(job.question),
+        lambda: fetch_answer(get_doubao_client(), get_key_pool(), cache, job.question)
+    )
+    if result is None:
+        raise JobError("No available API key")
+    if not result["success"]:
+        # 请求本身有问题（如参数错误）时重试也不会成功
+        raise JobError(result["answer"], retryable=is_retryable(result.get("status_code")))
+    tokens_used = result["tokens_used"]
+    return {
+        "answer": result["answer"],
+        "tokens_used": tokens_used,
+        "cost": shared_answer_cost(tokens_used) if shared else calculate_cost(tokens_used),
+        "api_key_id": None if shared else api_key_id,
+        "index": not shared and not result["truncated"],
+        "finish_reason": result_finish_reason(result),
+        "prompt_version": question_profile(job.question).template_version
+    }
+
+
+# 后台提问任务完成
+async def finish_question_job(job: QuestionRecord, result: dict):
+    """任务结果保存后清除用户缓存（余额已变化），自己调用上游得到的解答加入相似题目索引"""
+    async with db_session() as db:
+        username = await db.scalar(select(User.username).where(User.id == job.user_id))
+    if username:
+        invalidate_user_cache(username)
+    if result["index"] and SIMILARITY_INDEX_ENABLED:
+        get_similarity_index().add(job.id, job.question)
+
+
+# SSE数据的JSON序列化，金额按数字输出
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+# 格式化SSE事件
+def format_sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=_json_default)}\n\n"
+
+
+# 上游排队已满
+def upstream_busy_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy. Please try again later.",
+        headers={"Retry-After": str(UPSTREAM_RETRY_AFTER)}
+    )
+
+
+# 所有API密钥都被限流
+def keys_throttled_error(retry_after: float) -> HTTPException:
+    get_rate_limiter().record_keys_throttled()
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="All API keys are rate limited. Please try again later.",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+# 解答单个题目
+async def answer_question(question_text: str, request: Request, db: AsyncSession, current_user: User, client: DoubaoClient, cache: AnswerCache, index: SimilarityIndex, pool: ApiKeyPool, flights: SingleFlight) -> dict:
+    """查缓存或调用上游解答题目，扣费并保存问题记录，返回接口响应"""
     # 检查用户余额
     if current_user.balance <= 0:
         raise HTTPException(
@@ -101,73 +711,473 @@ async def ask_question(question: QuestionRecordCreate, db: Session = Depends(get
             detail="Insufficient balance. Please recharge your account."
         )
     
-    # 获取可用的API密钥
-    api_key = get_available_api_key(db)
-    if not api_key:
+    # 命中答案缓存时直接返回，无需调用上游
+    cached = await lookup_cached_answer(db, cache, index, question_text)
+    if cached:
+        return await save_question_record(db, current_user, question_text, cached["answer"], cached["tokens_used"], None, cost=cached["cost"])
+    
+    # 冻结预估费用后结束事务并归还数据库连接，避免等待上游响应期间占用连接池
+    # 余额只够部分解答时降低max_tokens，连最短解答都付不起时在调用上游前返回402
+    ensure_time_for_upstream()
+    set_upstream_owner(current_user.id, current_user.tier)
+    hold, max_tokens = await reserve_for_question(db, current_user, question_text)
+    
+    # 相同题目正在调用上游时等待并共享其结果；客户端断开或超过截止时间时不再等待，
+    # 没有其他请求在等待同一调用时取消上游调用，并全额退回冻结的费用
+    try:
+        (result, api_key_id), shared = await until_disconnect_or_deadline(request, flights.do(
+            flight_key(question_text, max_tokens),
+            lambda: fetch_answer(client, pool, cache, question_text, max_tokens)
+        ))
+    except BaseException as e:
+        with CancelScope(shield=True):
+            await release_hold(hold)
+        if isinstance(e, ClientDisconnected):
+            record_cancelled("ask", "disconnect")
+            raise client_closed_error() from None
+        if isinstance(e, DeadlineExceeded):
+            record_cancelled("ask", "deadline")
+            raise deadline_exceeded_error() from None
+        if isinstance(e, SchedulerOverloaded):
+            raise upstream_busy_error() from None
+        if isinstance(e, KeysThrottled):
+            raise keys_throttled_error(e.retry_after) from None
+        raise
+    if result is None or not result["success"]:
+        await release_hold(hold)
+    if result is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="No available API key. Please try again later."
         )
     
-    # 调用豆包API
-    result = call_doubao_api(api_key.api_key, question.question)
-    
     if not result["success"]:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Failed to call API: {result['answer']}"
         )
     
-    # 计算费用
-    cost = calculate_cost(result["tokens_used"])
+    # 按实际费用结算冻结（charge模式下余额不足返回402）并创建问题记录；共享结果按缓存计费策略计费
+    if shared:
+        return await save_question_record(db, current_user, question_text, result["answer"], result["tokens_used"], None, cost=shared_answer_cost(result["tokens_used"]), hold=hold, finish_reason=result_finish_reason(result))
+    return await save_question_record(db, current_user, question_text, result["answer"], result["tokens_used"], api_key_id, hold=hold, index_answer=not result["truncated"], finish_reason=result_finish_reason(result))
+
+
+@router.post("/ask", response_model=QuestionResponse, dependencies=[Depends(request_deadline), Depends(rate_limit("ask"))])
+async def ask_question(
+    question: QuestionRecordCreate,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255, description="客户端为每道题生成的唯一键，重试时携带相同的键不会重复调用上游和扣费"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_paying_user),
+    client: DoubaoClient = Depends(get_doubao_client),
+    cache: AnswerCache = Depends(get_answer_cache),
+    index: SimilarityIndex = Depends(get_similarity_index),
+    pool: ApiKeyPool = Depends(get_key_pool),
+    flights: SingleFlight = Depends(get_single_flight)
+):
+    """处理用户提交的英语题目
+
+    携带 Idempotency-Key 时，同一用户相同键的重复请求等待第一次请求结束，并返回它保存的响应，不再调用上游和扣费；
+    第一次请求失败时不保存结果，重试会重新执行。
+    """
+    if not idempotency_key or not IDEMPOTENCY_ENABLED:
+        return await answer_question(question.question, request, db, current_user, client, cache, index, pool, flights)
     
-    # 检查用户余额是否足够
-    if current_user.balance < cost:
+    store = get_idempotency_store()
+    user_id = current_user.id
+    try:
+        replay = await store.begin(user_id, idempotency_key, request_fingerprint(question.question), remaining())
+    except IdempotencyConflict:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key has already been used for a different question."
+        )
+    except IdempotencyInProgress:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still in progress.",
+            headers={"Retry-After": "1"}
+        )
+    if replay is not None:
+        return Response(content=replay, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+    
+    try:
+        response = await answer_question(question.question, request, db, current_user, client, cache, index, pool, flights)
+    except BaseException:
+        # 失败的请求已全额退回冻结的费用，删除幂等键让重试重新执行
+        with CancelScope(shield=True):
+            await store.abandon(user_id, idempotency_key)
+        raise
+    # 已经扣费，客户端断开也要保存响应，之后的重试直接返回它
+    body = dumps(response)
+    with CancelScope(shield=True):
+        await store.complete(user_id, idempotency_key, body.decode("utf-8"))
+    return Response(content=body, media_type="application/json")
+
+
+@router.post("/ask/stream", dependencies=[Depends(request_deadline), Depends(rate_limit("ask"))])
+async def ask_question_stream(question: QuestionRecordCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_paying_user), client: DoubaoClient = Depends(get_doubao_client), cache: AnswerCache = Depends(get_answer_cache), index: SimilarityIndex = Depends(get_similarity_index), pool: ApiKeyPool = Depends(get_key_pool), flights: StreamFlightGroup = Depends(get_stream_flights)):
+    """以SSE流式返回英语题目的解答"""
+    # 检查用户余额
+    if current_user.balance <= 0:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail=f"Insufficient balance. Required: {cost}, Available: {current_user.balance}"
+            detail="Insufficient balance. Please recharge your account."
         )
     
-    # 扣除用户余额
-    current_user.balance -= cost
-    db.commit()
+    # 命中答案缓存时一次性推送完整解答
+    cached = await lookup_cached_answer(db, cache, index, question.question)
+    if cached:
+        done = await save_question_record(db, current_user, question.question, cached["answer"], cached["tokens_used"], None, cost=cached["cost"])
+        done.pop("question")
+        done.pop("answer")
+        
+        async def cached_stream():
+            yield format_sse("delta", {"content": cached["answer"], "tokens": cached["tokens_used"]})
+            yield format_sse("done", done)
+        
+        return StreamingResponse(cached_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
     
-    # 创建问题记录
-    question_record = QuestionRecord(
-        user_id=current_user.id,
-        question=question.question,
-        answer=result["answer"],
-        tokens_used=result["tokens_used"],
-        cost=cost,
-        api_key_id=api_key.id
+    # 确认有可用的API密钥，避免开始推送后才发现无法调用；密钥都只是配额用尽时返回429
+    if pool.select() is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="No available API key. Please try again later."
+        )
+    retry_after = await keys_retry_after(pool)
+    if retry_after:
+        raise keys_throttled_error(retry_after)
+    
+    user_id = current_user.id
+    ensure_time_for_upstream()
+    set_upstream_owner(user_id, current_user.tier)
+    hold, max_tokens = await reserve_for_question(db, current_user, question.question)
+    payload = build_doubao_payload(question.question, max_tokens)
+    payload["stream_options"] = {"include_usage": True}
+    prompt_tokens = estimate_prompt_tokens(question.question)
+    
+    # 订阅相同题目正在进行的流式调用，没有时发起新的调用
+    scheduler = get_upstream_scheduler()
+    flight, shared = flights.join(
+        flight_key(question.question, max_tokens),
+        lambda flight: stream_answer(flight, client, pool, cache, question.question, payload, prompt_tokens)
     )
     
-    db.add(question_record)
-    db.commit()
-    db.refresh(question_record)
+    async def event_stream():
+        received = 0
+        question_record = None
+        cancelled = None
+        try:
+            # 上游并发已满、调用还在排队时，定期推送排队位置
+            while not flight.parts and not flight.done:
+                position = scheduler.position(user_id)
+                if position is None:
+                    break
+                yield format_sse("queued", {"position": position})
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded()
+                await flight.wait_started(UPSTREAM_QUEUE_NOTIFY_INTERVAL if left is None else min(left, UPSTREAM_QUEUE_NOTIFY_INTERVAL))
+            async for content in flight.follow():
+                received += 1
+                yield format_sse("delta", {"content": content, "tokens": received})
+        except DeadlineExceeded:
+            cancelled = "deadline"
+        except asyncio.CancelledError:
+            cancelled = "disconnect"
+            raise
+        finally:
+            # 最后一个订阅者离开时取消上游调用
+            flights.leave(flight)
+            if cancelled:
+                record_cancelled("ask_stream", cancelled)
+            # 流结束、超时或客户端断开时，按已收到的内容结算并保存记录，没有收到内容时退回冻结；
+            # 客户端断开时请求已被取消，需屏蔽取消完成写入
+            if not received:
+                with CancelScope(shield=True):
+                    await release_hold(hold)
+            else:
+                completed = flight.done and flight.completed and received == len(flight.parts)
+                if completed:
+                    finish_reason = FINISH_REASON_STOP
+                elif flight.done and received == len(flight.parts) and flight.finish_reason == "length":
+                    finish_reason = FINISH_REASON_LENGTH
+                else:
+                    finish_reason = FINISH_REASON_INCOMPLETE
+                tokens_used = (completed and flight.usage_tokens) or prompt_tokens + received
+                cost = shared_answer_cost(tokens_used) if shared else None
+                # 未完整推送的解答按 CANCEL_CHARGE_POLICY 决定是否计费
+                if cancelled and not completed and not charge_cancelled():
+                    cost = Decimal("0")
+                with CancelScope(shield=True):
+                    async with db_session() as record_db:
+                        user = await record_db.get(User, user_id)
+                        # 内容已经推送给用户，charge模式下照常扣费；共享调用按缓存计费策略计费；
+                        # 完整的解答只由第一个保存的请求加入相似题目索引
+                        question_record = await save_question_record(
+                            record_db, user, question.question, "".join(flight.parts[:received]), tokens_used,
+                            None if shared else flight.api_key_id,
+                            cost=cost,
+                            hold=hold, allow_overdraft=True, index_answer=completed and flight.claim_index(),
+                            finish_reason=finish_reason
+                        )
+                        question_record.pop("question")
+                        question_record.pop("answer")
+        
+        if cancelled == "deadline":
+            yield format_sse("error", {"detail": deadline_exceeded_error().detail})
+        elif flight.error:
+            yield format_sse("error", {"detail": f"Failed to call API: API调用失败: {flight.error}"})
+        if question_record:
+            yield format_sse("done", question_record)
     
-    # 返回结果
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/ask/batch")
+async def ask_question_batch(batch: QuestionBatchCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_paying_user), client: DoubaoClient = Depends(get_doubao_client), cache: AnswerCache = Depends(get_answer_cache), index: SimilarityIndex = Depends(get_similarity_index), pool: ApiKeyPool = Depends(get_key_pool), flights: SingleFlight = Depends(get_single_flight)):
+    """批量提交题目：拆分去重后并发解答，以SSE按完成顺序逐题返回，结束后一次性写入所有记录"""
+    questions = list(batch.questions)
+    if batch.text:
+        questions.extend(split_questions(batch.text))
+    questions = dedupe_questions(questions)
+    if not questions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No questions found"
+        )
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many questions. At most {BATCH_MAX_QUESTIONS} questions per batch."
+        )
+    
+    # 按题目数消耗限流令牌
+    await enforce_rate_limit("ask_batch", current_user, cost=len(questions))
+    
+    # 检查用户余额
+    if current_user.balance <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail="Insufficient balance. Please recharge your account."
+        )
+    
+    # 一次冻结整批的预估费用，结束后按实际总费用结算
+    await db.commit()
+    amount = sum(estimate_hold_cost(question_text) for question_text in questions)
+    available = current_user.balance
+    hold = await ledger.reserve(db, current_user.id, amount, "批量提问预扣")
+    if hold is None:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Insufficient balance. Required: {amount}, Available: {available}"
+        )
+    user_id = current_user.id
+    username = current_user.username
+    # 整批题目在该用户自己的队列中排队，不会挤占其他用户的上游并发
+    set_upstream_owner(user_id, current_user.tier)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def answer_one(i: int, question_text: str):
+        async with semaphore:
+            try:
+                async with db_session() as lookup_db:
+                    cached = await lookup_cached_answer(lookup_db, cache, index, question_text)
+                if cached:
+                    return i, dict(cached, api_key_id=None, index=False, finish_reason=FINISH_REASON_STOP)
+                
+                (result, api_key_id), shared = await flights.do(
+                    answer_cache_key(question_text),
+                    lambda: fetch_answer(client, pool, cache, question_text)
+                )
+                if result is None:
+                    return i, {"error": "No available API key"}
+                if not result["success"]:
+                    return i, {"error": result["answer"]}
+                tokens_used = result["tokens_used"]
+                return i, {
+                    "answer": result["answer"],
+                    "tokens_used": tokens_used,
+                    "cost": shared_answer_cost(tokens_used) if shared else calculate_cost(tokens_used),
+                    "api_key_id": None if shared else api_key_id,
+                    "index": not shared and not result["truncated"],
+                    "finish_reason": result_finish_reason(result)
+                }
+            except Exception as e:
+                return i, {"error": str(e)}
+    
+    async def event_stream():
+        results = {}
+        tasks = [asyncio.create_task(answer_one(i, question_text)) for i, question_text in enumerate(questions)]
+        summary = None
+        try:
+            yield format_sse("start", {"questions": questions, "reserved": hold.amount})
+            for next_result in asyncio.as_completed(tasks):
+                i, result = await next_result
+                results[i] = result
+                event = {"index": i, "question": questions[i]}
+                if "error" in result:
+                    event["error"] = f"Failed to call API: {result['error']}"
+                else:
+                    event.update(answer=result["answer"], tokens_used=result["tokens_used"], cost=result["cost"])
+                yield format_sse("result", event)
+        finally:
+            # 客户端断开时取消未完成的题目，已完成的照常保存并结算；需屏蔽取消完成写入
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    i, result = task.result()
+                    results.setdefault(i, result)
+                task.cancel()
+            with CancelScope(shield=True):
+                summary = await save_batch_records(user_id, username, questions, results, hold)
+        
+        yield format_sse("done", summary)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/jobs", response_model=QuestionJob, status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(rate_limit("ask"))])
+async def submit_question_job(question: QuestionRecordCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_paying_user), queue: JobQueue = Depends(get_job_queue)):
+    """提交后台提问任务并立即返回任务ID，通过 GET /jobs/{job_id} 查询或长轮询结果"""
+    # 检查用户余额
+    if current_user.balance <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail="Insufficient balance. Please recharge your account."
+        )
+    
+    # 提交时冻结预估费用，任务完成后按实际费用结算，最终失败时退回
+    user_id = current_user.id
+    priority = tier_priority(current_user.tier)
+    # 任务在后台以题型的max_tokens执行，余额需足够支付最高费用
+    hold, _ = await reserve_for_question(db, current_user, question.question, allow_cap=False)
+    job = QuestionRecord(
+        user_id=user_id,
+        question=question.question,
+        status=QUESTION_STATUS_QUEUED,
+        priority=priority,
+        hold_transaction_id=hold.transaction_id if hold is not None else None
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    if hold is not None:
+        invalidate_user_cache(current_user.username)
+    queue.notify()
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=QuestionJob)
+async def get_question_job(
+    job_id: int,
+    wait: float = Query(0, ge=0, le=JOB_LONG_POLL_MAX, description="任务未结束时最长等待的秒数，0为立即返回"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+    queue: JobQueue = Depends(get_job_queue)
+):
+    """查询后台提问任务的状态和结果，指定wait时等到任务结束或超时再返回"""
+    deadline = time.monotonic() + wait
+    while True:
+        job = await db.scalar(
+            select(QuestionRecord)
+            .where(QuestionRecord.id == job_id, QuestionRecord.user_id == current_user.id)
+            .execution_options(populate_existing=True)
+        )
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Question job not found"
+            )
+        wait_left = deadline - time.monotonic()
+        if job.status in FINISHED_STATUSES or wait_left <= 0:
+            return job
+        # 等待期间结束事务，不占用数据库连接；任务在其他进程执行时按轮询间隔重新查询
+        await db.commit()
+        await queue.wait(job_id, min(wait_left, JOB_POLL_INTERVAL))
+
+
+@router.get("/queue")
+async def get_queue_position(current_user: User = Depends(get_current_active_user)):
+    """获取当前用户排队中的上游调用数，以及最靠前的一个前面还有多少个调用（没有排队时为null）"""
+    scheduler = get_upstream_scheduler()
     return {
-        "id": question_record.id,
-        "question": question_record.question,
-        "answer": question_record.answer,
-        "tokens_used": question_record.tokens_used,
-        "cost": question_record.cost,
-        "created_at": question_record.created_at
+        "position": scheduler.position(current_user.id),
+        "queued": scheduler.user_queued(current_user.id),
+        "queue_length": scheduler.queued,
+        "active": scheduler.active,
+        "capacity": scheduler.capacity
     }
 
 
-@router.get("/history", response_model=List[QuestionRecordSchema])
-async def get_question_history(db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
-    """获取用户的问题历史记录"""
-    records = db.query(QuestionRecord).filter(QuestionRecord.user_id == current_user.id).order_by(QuestionRecord.created_at.desc()).all()
-    return records
+@router.get("/history", response_model=QuestionHistoryPage)
+async def get_question_history(
+    cursor: Optional[int] = Query(None, description="上一页返回的next_cursor"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """按时间倒序分页获取用户已完成的问题历史摘要，完整解答通过 /record/{record_id} 获取"""
+    # 只查询摘要列，题目在数据库端截断，不读取answer列
+    query = select(
+        QuestionRecord.id,
+        func.substr(QuestionRecord.question, 1, HISTORY_QUESTION_PREVIEW_LENGTH + 1).label("question"),
+        QuestionRecord.cost,
+        QuestionRecord.created_at
+    ).where(QuestionRecord.user_id == current_user.id, QuestionRecord.status == QUESTION_STATUS_COMPLETED)
+    
+    # 按 (created_at, id) 做键集分页：取排在游标记录之后的记录，游标记录的创建时间由数据库自己比较
+    if cursor is not None:
+        cursor_created_at = (
+            select(QuestionRecord.created_at)
+            .where(QuestionRecord.id == cursor, QuestionRecord.user_id == current_user.id)
+            .scalar_subquery()
+        )
+        # 单独的 created_at <= 条件让数据库可以在 (user_id, created_at, id) 索引上直接定位起点
+        query = query.where(
+            QuestionRecord.created_at <= cursor_created_at,
+            or_(QuestionRecord.created_at < cursor_created_at, QuestionRecord.id < cursor)
+        )
+    
+    result = await db.execute(
+        query.order_by(QuestionRecord.created_at.desc(), QuestionRecord.id.desc()).limit(limit + 1)
+    )
+    rows = result.all()
+    
+    items = []
+    for row in rows[:limit]:
+        question_text = row.question or ""
+        if len(question_text) > HISTORY_QUESTION_PREVIEW_LENGTH:
+            question_text = question_text[:HISTORY_QUESTION_PREVIEW_LENGTH] + "…"
+        items.append({
+            "id": row.id,
+            "question": question_text,
+            "cost": row.cost,
+            "created_at": row.created_at
+        })
+    
+    # 多取一条用于判断是否还有下一页
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+    # 字段已与 QuestionHistoryPage 一致，直接序列化，跳过逐条的模型校验
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
 
 
 @router.get("/record/{record_id}", response_model=QuestionRecordSchema)
-async def get_question_record(record_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
+async def get_question_record(record_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_active_user)):
     """获取特定问题记录的详细信息"""
-    record = db.query(QuestionRecord).filter(QuestionRecord.id == record_id, QuestionRecord.user_id == current_user.id).first()
+    record = await db.scalar(select(QuestionRecord).where(
+        QuestionRecord.id == record_id,
+        QuestionRecord.user_id == current_user.id,
+        QuestionRecord.status == QUESTION_STATUS_COMPLETED
+    ))
     if not record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from datetime import timedelta
 from pydantic import BaseModel
@@ -8,16 +9,18 @@ from pydantic import BaseModel
 from db.database import get_db
 from db.models import User, Transaction
 from api.schemas import UserCreate, User as UserSchema, Transaction as TransactionSchema, UserLogin, Token, RechargeRequest
-from api.auth import create_access_token, get_current_active_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from api.auth import create_access_token, get_current_active_user, get_current_paying_user, invalidate_user_cache, ACCESS_TOKEN_EXPIRE_MINUTES
+from services.password_hasher import hash_password, verify_password
+from services import ledger
 
 router = APIRouter()
 
 
 @router.post("/register", response_model=UserSchema)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """注册新用户"""
     # 检查用户名是否已存在
-    db_user = db.query(User).filter(User.username == user.username).first()
+    db_user = await db.scalar(select(User).where(User.username == user.username))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -25,7 +28,7 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # 检查邮箱是否已存在
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -33,7 +36,7 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # 创建新用户
-    hashed_password = User.get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -44,10 +47,58 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 
-@router.post("/token", response_model=Token)
\ No newline at end of file
+@router.post("/token", response_model=Token)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    """用户登录获取访问令牌"""
+    user = await db.scalar(select(User).where(User.username == form_data.username))
+    verified, new_hash = False, None
+    if user:
+        # bcrypt在线程池中执行，不阻塞事件循环
+        verified, new_hash = await verify_password(form_data.password, user.hashed_password)
+    if not verified:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    # bcrypt成本配置变化后，按新成本更新密码哈希
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.username}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.get("/me", response_model=UserSchema)
+async def read_users_me(current_user: User = Depends(get_current_active_user)):
+    """获取当前用户信息"""
+    return current_user
+
+
+@router.post("/recharge", response_model=UserSchema)
+async def recharge(recharge_request: RechargeRequest, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_active_user)):
+    """用户充值"""
+    # 在数据库中原子地增加余额并记录充值交易
+    await ledger.deposit(db, current_user.id, recharge_request.amount, recharge_request.description or "用户充值")
+    await db.commit()
+    await db.refresh(current_user)
+    invalidate_user_cache(current_user.username)
+    
+    return current_user
+
+
+@router.get("/balance")
+async def get_balance(current_user: User = Depends(get_current_paying_user)):
+    """获取用户余额"""
+    return {"balance": current_user.balance}
\ No newline at end of file
@@ -23,6 +23,7 @@ class User(UserBase):
     balance: float
     is_active: bool
     is_admin: bool
+    tier: str = "standard"
     created_at: datetime
     updated_at: Optional[datetime] = None
 
@@ -30,6 +31,10 @@ class User(UserBase):
         orm_mode = True
 
 
+class UserTierUpdate(BaseModel):
+    tier: str = Field(..., min_length=1, max_length=20)
+
+
 # 令牌相关模式
 class Token(BaseModel):
     access_token: str
@@ -95,8 +100,13 @@ class QuestionRecordCreate(BaseModel):
     question: str
 
 
+class QuestionBatchCreate(BaseModel):
+    questions: List[str] = Field(default_factory=list)  # 逐条提交的题目
+    text: Optional[str] = None  # 整张练习题的文本，按题号或空行拆分
+
+
 class QuestionResponse(BaseModel):
-    id: int
+    id: Optional[int] = None  # 启用写后落库时记录尚未写入数据库，id为空
     question: str
     answer: str
     tokens_used: int
@@ -105,7 +115,36 @@ class QuestionResponse(BaseModel):
 
 
 class QuestionRecord(QuestionResponse):
+    id: int
     user_id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+class QuestionJob(BaseModel):
+    id: int
+    status: str  # queued、running、completed 或 failed
+    question: str
+    answer: Optional[str] = None
+    tokens_used: Optional[int] = None
+    cost: Optional[float] = None
+    error: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+class QuestionSummary(BaseModel):
+    id: int
+    question: str  # 截断后的题目
+    cost: float
+    created_at: datetime
+
+
+class QuestionHistoryPage(BaseModel):
+    items: List[QuestionSummary]
+    next_cursor: Optional[int] = None  # 下一页游标，为空表示没有更多记录
\ No newline at end of file
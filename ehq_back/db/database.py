@@ -1,8 +1,16 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+from collections import deque
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
+import threading
+import time
 
 # 加载环境变量
 load_dotenv()
@@ -10,20 +18,192 @@ load_dotenv()
 # 获取数据库URL
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# 连接池配置
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))  # 常驻连接数
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))  # 高峰时允许额外创建的连接数
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # 等待空闲连接的超时时间（秒）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))  # 连接最长使用时间（秒），应小于MySQL的wait_timeout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # 取出连接前检测是否存活
+
+# 异步数据库配置，关闭时使用同步引擎并在线程池中执行数据库操作
+DB_ASYNC_ENABLED = os.getenv("DB_ASYNC_ENABLED", "true").lower() == "true"
+# 异步驱动与同步驱动的对应关系，也可以通过 ASYNC_DATABASE_URL 直接指定（如 mysql+asyncmy://...）
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    """把同步驱动的数据库URL转换为对应的异步驱动"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername)).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+
+class PoolWaitStats:
+    """记录从连接池取出连接的等待时间"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self.timeouts += timed_out
+            self._recent.append(seconds)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent)
+        return {
+            "checkouts": self.count,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "wait_max_ms": self.max * 1000,
+            "wait_p50_ms": recent[len(recent) // 2] * 1000 if recent else 0.0,
+            "wait_p99_ms": recent[min(len(recent) - 1, int(len(recent) * 0.99))] * 1000 if recent else 0.0,
+        }
+
+
+pool_wait_stats = PoolWaitStats()
+
+
+class _TimedPoolMixin:
+    """统计取出连接的等待时间，包括池满时排队和新建连接的耗时"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            pool_wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_wait_stats.record(time.perf_counter() - start)
+        return conn
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _engine_options(url: str, poolclass) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    # 内存SQLite数据库只能使用单连接池
+    if make_url(url).database not in (None, "", ":memory:"):
+        options.update(
+            poolclass=poolclass,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return options
+
+
 # 创建SQLAlchemy引擎
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL, TimedQueuePool))
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步引擎和会话工厂；提交后不过期对象，避免在异步上下文中隐式加载属性
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC_ENABLED:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, TimedAsyncAdaptedQueuePool))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # 创建基类
 Base = declarative_base()
 
 
-# 获取数据库会话
-def get_db():
-    db = SessionLocal()
+class SyncSessionAdapter:
+    """用异步接口包装同步会话，每次数据库操作在线程池中执行，供未启用异步驱动时使用"""
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    async def execute(self, statement, params=None, **kwargs):
+        # 在工作线程中取完所有结果行，与AsyncSession.execute的行为一致
+        kwargs["execution_options"] = dict(kwargs.get("execution_options") or {}, prebuffer_rows=True)
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def merge(self, instance, load: bool = True):
+        return await run_in_threadpool(self.sync_session.merge, instance, load=load)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+@asynccontextmanager
+async def db_session():
+    """创建数据库会话，启用异步驱动时为AsyncSession，否则为包装后的同步会话"""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    db = SyncSessionAdapter(SessionLocal(expire_on_commit=False))
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
+
+
+# 获取数据库会话
+async def get_db():
+    async with db_session() as db:
+        yield db
+
+
+def pool_stats() -> dict:
+    """连接池状态和取出连接的等待时间"""
+    pool = (async_engine or engine).pool
+    stats = {"mode": "async" if async_engine is not None else "sync"}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=DB_MAX_OVERFLOW,
+        )
+    stats.update(pool_wait_stats.to_dict())
+    return stats
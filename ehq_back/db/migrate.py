@@ -0,0 +1,31 @@
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+import os
+
+from .database import engine
+
+# alembic.ini 位于 ehq_back 目录下
+ALEMBIC_INI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+# 引入迁移工具前由 create_all 建好的表结构对应的版本
+BASELINE_REVISION = "0001"
+
+
+def alembic_config() -> Config:
+    config = Config(ALEMBIC_INI_PATH)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI_PATH), "db", "migrations"))
+    # 程序内调用时保留应用自己的日志配置
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def upgrade_database(revision: str = "head"):
+    """把数据库升级到最新版本；已有表但没有版本记录的旧数据库先标记为基线版本"""
+    config = alembic_config()
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        tables = inspect(connection).get_table_names()
+        if "users" in tables and "alembic_version" not in tables:
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, revision)
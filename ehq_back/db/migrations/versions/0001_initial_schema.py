@@ -0,0 +1,77 @@
+"""初始表结构，与此前 Base.metadata.create_all 创建的表一致
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(50)),
+        sa.Column("email", sa.String(100)),
+        sa.Column("hashed_password", sa.String(100)),
+        sa.Column("balance", sa.Float()),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("is_admin", sa.Boolean()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "api_keys",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("key_name", sa.String(50)),
+        sa.Column("api_key", sa.String(200)),
+        sa.Column("provider", sa.String(50)),
+        sa.Column("balance", sa.Float()),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("priority", sa.Integer()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_api_keys_id", "api_keys", ["id"])
+
+    op.create_table(
+        "transactions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("amount", sa.Float()),
+        sa.Column("transaction_type", sa.String(20)),
+        sa.Column("description", sa.String(200), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_transactions_id", "transactions", ["id"])
+
+    op.create_table(
+        "question_records",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("question", sa.Text()),
+        sa.Column("answer", sa.Text()),
+        sa.Column("tokens_used", sa.Integer()),
+        sa.Column("cost", sa.Float()),
+        sa.Column("api_key_id", sa.Integer(), sa.ForeignKey("api_keys.id")),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_question_records_id", "question_records", ["id"])
+
+
+def downgrade():
+    op.drop_table("question_records")
+    op.drop_table("transactions")
+    op.drop_table("api_keys")
+    op.drop_table("users")
@@ -0,0 +1,25 @@
+"""问题记录和交易表的复合索引
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_question_records_user_created", "question_records", ["user_id", "created_at", "id"])
+    op.create_index("ix_question_records_api_key_created", "question_records", ["api_key_id", "created_at"])
+    op.create_index("ix_transactions_user_created", "transactions", ["user_id", "created_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_transactions_user_created", table_name="transactions")
+    op.drop_index("ix_question_records_api_key_created", table_name="question_records")
+    op.drop_index("ix_question_records_user_created", table_name="question_records")
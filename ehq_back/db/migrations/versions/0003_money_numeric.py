@@ -0,0 +1,34 @@
+"""金额列由Float改为Numeric(12, 4)定点数
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# (表名, 列名)
+MONEY_COLUMNS = [
+    ("users", "balance"),
+    ("api_keys", "balance"),
+    ("transactions", "amount"),
+    ("question_records", "cost"),
+]
+
+
+def upgrade():
+    for table, column in MONEY_COLUMNS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, type_=sa.Numeric(12, 4), existing_type=sa.Float())
+
+
+def downgrade():
+    for table, column in MONEY_COLUMNS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, type_=sa.Float(), existing_type=sa.Numeric(12, 4))
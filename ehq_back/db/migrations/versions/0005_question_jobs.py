@@ -0,0 +1,42 @@
+"""问题记录增加后台任务状态列，用户增加等级列
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("tier", sa.String(20), nullable=False, server_default="standard"))
+
+    # 已有记录都是同步提问保存的完整解答
+    with op.batch_alter_table("question_records") as batch_op:
+        batch_op.add_column(sa.Column("status", sa.String(20), nullable=False, server_default="completed"))
+        batch_op.add_column(sa.Column("priority", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("error", sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column("hold_transaction_id", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("run_after", sa.DateTime(timezone=True), nullable=True))
+        batch_op.add_column(sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True))
+        batch_op.create_foreign_key("fk_question_records_hold_transaction", "transactions", ["hold_transaction_id"], ["id"])
+        batch_op.create_index("ix_question_records_status_priority", ["status", "priority", "id"])
+
+
+def downgrade():
+    with op.batch_alter_table("question_records") as batch_op:
+        batch_op.drop_index("ix_question_records_status_priority")
+        batch_op.drop_constraint("fk_question_records_hold_transaction", type_="foreignkey")
+        for column in ("updated_at", "run_after", "hold_transaction_id", "error", "attempts", "priority", "status"):
+            batch_op.drop_column(column)
+
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("tier")
@@ -0,0 +1,25 @@
+"""问题记录增加解答完成情况列
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 已有记录无法区分完整和被截断的解答，保持为空，不参与缓存预热和相似题目索引
+    with op.batch_alter_table("question_records") as batch_op:
+        batch_op.add_column(sa.Column("finish_reason", sa.String(20), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("question_records") as batch_op:
+        batch_op.drop_column("finish_reason")
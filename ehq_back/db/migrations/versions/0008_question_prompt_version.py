@@ -0,0 +1,25 @@
+"""问题记录增加提示词模板版本列
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 已有记录无法确定使用的模板，保持为空，不参与缓存预热和相似题目复用
+    with op.batch_alter_table("question_records") as batch_op:
+        batch_op.add_column(sa.Column("prompt_version", sa.String(40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("question_records") as batch_op:
+        batch_op.drop_column("prompt_version")
@@ -1,11 +1,31 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Numeric, Boolean, DateTime, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 from passlib.context import CryptContext
+import os
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# bcrypt计算成本，每加1耗时翻倍；修改后旧密码仍可验证，并在用户下次登录时按新成本重新哈希
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
 
 # 密码哈希工具
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_BCRYPT_ROUNDS)
+
+# 问题记录状态：同步提问直接保存为completed，后台任务依次经过queued、running，最终为completed或failed
+QUESTION_STATUS_QUEUED = "queued"
+QUESTION_STATUS_RUNNING = "running"
+QUESTION_STATUS_COMPLETED = "completed"
+QUESTION_STATUS_FAILED = "failed"
+
+# 解答的完成情况：stop 为完整解答（包括复用缓存或相似题目的解答），length 为达到max_tokens被截断，
+# incomplete 为流式推送中途超时、断开或上游出错；旧记录为空。只有完整解答可以用于预热缓存和相似题目索引
+FINISH_REASON_STOP = "stop"
+FINISH_REASON_LENGTH = "length"
+FINISH_REASON_INCOMPLETE = "incomplete"
 
 
 class User(Base):
@@ -15,9 +35,10 @@ class User(Base):
     username = Column(String(50), unique=True, index=True)
     email = Column(String(100), unique=True, index=True)
     hashed_password = Column(String(100))
-    balance = Column(Float, default=0.0)  # 用户余额
+    balance = Column(Numeric(12, 4), default=0)  # 用户余额，定点数避免浮点误差
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)  # 管理员标志
+    tier = Column(String(20), nullable=False, default="standard", server_default="standard")  # 用户等级，决定后台任务的优先级
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -39,14 +60,19 @@ class Transaction(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    amount = Column(Float)  # 交易金额
-    transaction_type = Column(String(20))  # 'deposit' 或 'consumption'
+    amount = Column(Numeric(12, 4))  # 交易金额，充值为正，消费和冻结为负
+    transaction_type = Column(String(20))  # 'deposit'、'consumption' 或 'hold'（已冻结待结算）
     description = Column(String(200), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # 关系
     user = relationship("User", back_populates="transactions")
 
+    __table_args__ = (
+        # 按用户查询交易流水并按时间排序
+        Index("ix_transactions_user_created", "user_id", "created_at", "id"),
+    )
+
 
 class ApiKey(Base):
     __tablename__ = "api_keys"
@@ -55,7 +81,7 @@ class ApiKey(Base):
     key_name = Column(String(50))  # API密钥名称
     api_key = Column(String(200))  # 实际API密钥
     provider = Column(String(50))  # API提供商，如'doubao'
-    balance = Column(Float, default=0.0)  # API余额
+    balance = Column(Numeric(12, 4), default=0)  # API余额
     is_active = Column(Boolean, default=True)
     priority = Column(Integer, default=1)  # 优先级，数字越小优先级越高
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -70,10 +96,61 @@ class QuestionRecord(Base):
     question = Column(Text)  # 用户提问的英语题目
     answer = Column(Text)  # AI回答内容
     tokens_used = Column(Integer)  # 使用的token数量
-    cost = Column(Float)  # 消费金额
+    cost = Column(Numeric(12, 4))  # 消费金额
     api_key_id = Column(Integer, ForeignKey("api_keys.id"))
+    status = Column(String(20), nullable=False, default=QUESTION_STATUS_COMPLETED, server_default=QUESTION_STATUS_COMPLETED)
+    finish_reason = Column(String(20), nullable=True)  # 解答的完成情况，见 FINISH_REASON_*
+    prompt_version = Column(String(40), nullable=True)  # 生成解答时题型提示词模板的版本，如 v1、choice-v1
+    # 以下为后台任务的执行信息
+    priority = Column(Integer, nullable=False, default=0, server_default="0")  # 数字越大越先执行
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")  # 已执行次数
+    error = Column(Text, nullable=True)  # 最近一次失败的原因
+    hold_transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=True)  # 提交时冻结费用的流水
+    run_after = Column(DateTime(timezone=True), nullable=True)  # 失败重试前的退避时间
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     # 关系
     user = relationship("User", back_populates="question_records")
-    api_key = relationship("ApiKey")
\ No newline at end of file
+    api_key = relationship("ApiKey")
+
+    __table_args__ = (
+        # 历史记录按 (created_at, id) 键集分页，记录详情按 (id, user_id) 查询
+        Index("ix_question_records_user_created", "user_id", "created_at", "id"),
+        # 管理后台按API密钥统计用量
+        Index("ix_question_records_api_key_created", "api_key_id", "created_at"),
+        # worker按优先级和提交顺序领取排队中的任务
+        Index("ix_question_records_status_priority", "status", "priority", "id"),
+    )
+
+
+class WriteBehindCheckpoint(Base):
+    __tablename__ = "write_behind_checkpoints"
+
+    journal = Column(String(100), primary_key=True)  # 写后日志文件名
+    last_seq = Column(BigInteger, nullable=False, default=0)  # 已落库的最大日志序号，与批量写入在同一事务中更新
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# 幂等键状态：请求进行中为pending，成功后保存响应并标记为completed；失败的请求删除幂等键，重试时重新执行
+IDEMPOTENCY_STATUS_PENDING = "pending"
+IDEMPOTENCY_STATUS_COMPLETED = "completed"
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String(255), nullable=False)  # 客户端在 Idempotency-Key 请求头中提供的键，按用户隔离
+    fingerprint = Column(String(64), nullable=False)  # 请求体的哈希，同一个键用于不同的请求时拒绝
+    status = Column(String(20), nullable=False, default=IDEMPOTENCY_STATUS_PENDING)
+    response = Column(Text, nullable=True)  # 成功响应的JSON，重复请求直接返回
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)  # 进行中的键到期视为原请求已异常退出，完成的键到期后删除
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+        # 定期删除过期的键
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
@@ -0,0 +1,56 @@
+"""独立的后台提问任务worker进程，JOB_WORKER_MODE=external 时使用
+
+用法（在 ehq_back 目录下运行，可以同时启动多个进程）：
+    python job_worker.py
+API进程只负责提交任务和查询结果，worker进程从数据库领取排队中的任务并调用上游。
+收到 SIGTERM/SIGINT 时停止领取新任务，等待执行中的任务结束，超时的任务重新排队。
+"""
+import asyncio
+import logging
+import signal
+
+from db.database import async_engine, db_session
+from api.routers.questions import process_question_job, finish_question_job
+from services.doubao_client import init_doubao_client, close_doubao_client
+from services.key_pool import KEY_POOL_REFRESH_INTERVAL, get_key_pool
+from services.job_queue import get_job_queue
+
+logger = logging.getLogger("job_worker")
+
+
+async def run():
+    init_doubao_client()
+    async with db_session() as db:
+        await get_key_pool().load_async(db)
+    
+    job_queue = get_job_queue()
+    job_queue.handler = process_question_job
+    job_queue.on_complete = finish_question_job
+    await job_queue.start()
+    logger.info("后台任务worker已启动，并发数 %d", job_queue.workers)
+    
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    
+    # 定期从数据库刷新密钥池，使管理后台的修改生效
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), KEY_POOL_REFRESH_INTERVAL)
+        except asyncio.TimeoutError:
+            try:
+                async with db_session() as db:
+                    await get_key_pool().load_async(db)
+            except Exception:
+                logger.exception("刷新API密钥池失败")
+    
+    await job_queue.stop()
+    await close_doubao_client()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(run())
@@ -1,17 +1,44 @@
 from fastapi import FastAPI, Depends
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
-from api.routers import users, admin, questions
-from db.database import engine, Base
+from api.routers import users, admin, questions, metrics
+from db.database import engine, async_engine, SessionLocal, db_session
+from db.migrate import upgrade_database
+from api.routers.questions import answer_cache_key, process_question_job, finish_question_job
+from services.doubao_client import init_doubao_client, close_doubao_client
+from services.answer_cache import ANSWER_CACHE_ENABLED, ANSWER_CACHE_SEED_LIMIT, get_answer_cache
+from services.similarity_index import SIMILARITY_INDEX_ENABLED, get_similarity_index
+from services.question_types import question_profile
+from services.key_pool import KEY_POOL_REFRESH_INTERVAL, get_key_pool
+from services.password_hasher import shutdown_password_hasher
+from services.ledger import release_stale_holds
+from services.write_behind import get_write_behind
+from services.job_queue import JOB_WORKER_MODE, get_job_queue
+from api.responses import CompressionMiddleware, FastJSONResponse
+from services.metrics import METRICS_ENABLED, MetricsMiddleware, instrument_engine, monitor_event_loop_lag
+from dotenv import load_dotenv
+import logging
+import os
 import uvicorn
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 启动时自动执行数据库迁移；多worker部署时应关闭，改为发布前手动执行 alembic upgrade head
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+
+# 创建或升级数据库表
+if DB_AUTO_MIGRATE:
+    upgrade_database()
 
 # 创建FastAPI应用
 app = FastAPI(
     title="English High Q API",
     description="API for English question answering system",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # 配置CORS
@@ -21,12 +48,99 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 允许浏览器的开发者工具读取Server-Timing
+    expose_headers=["Server-Timing"],
 )
 
+# 压缩较大的非流式响应
+app.add_middleware(CompressionMiddleware)
+
+# 请求耗时指标，放在最外层以包含其他中间件的耗时
+app.add_middleware(MetricsMiddleware)
+
+# 统计SQL语句的执行耗时
+if METRICS_ENABLED:
+    instrument_engine(engine)
+    if async_engine is not None:
+        instrument_engine(async_engine.sync_engine)
+
 # 包含路由
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 app.include_router(questions.router, prefix="/api/questions", tags=["questions"])
+app.include_router(metrics.router, tags=["metrics"])
+
+
+async def refresh_key_pool_periodically():
+    """定期从数据库刷新密钥池，使其他worker上的管理操作也能生效"""
+    while True:
+        await asyncio.sleep(KEY_POOL_REFRESH_INTERVAL)
+        try:
+            async with db_session() as db:
+                await get_key_pool().load_async(db)
+        except Exception:
+            logger.exception("刷新API密钥池失败")
+
+
+@app.on_event("startup")
+async def startup():
+    # 创建共享的豆包API客户端（长连接池）
+    init_doubao_client()
+    
+    db = SessionLocal()
+    try:
+        # 加载API密钥池
+        get_key_pool().load(db)
+        
+        # 用历史问题记录预热答案缓存
+        if ANSWER_CACHE_ENABLED and ANSWER_CACHE_SEED_LIMIT > 0:
+            get_answer_cache().seed_from_db(db, answer_cache_key, lambda question: question_profile(question).template_version)
+        
+        # 加载相似题目索引，并补齐离线索引文件之后新增的记录
+        if SIMILARITY_INDEX_ENABLED:
+            get_similarity_index().build_from_db(db)
+    finally:
+        db.close()
+    
+    # 重放写后落库日志中尚未写入数据库的记录，并启动后台批量写入
+    write_behind = get_write_behind()
+    if write_behind is not None:
+        await write_behind.start()
+        if write_behind.replayed:
+            logger.warning("重放 %d 条未落库的写后日志", write_behind.replayed)
+    
+    # 退回进程异常退出时遗留的冻结费用
+    async with db_session() as db:
+        released = await release_stale_holds(db)
+        if released:
+            logger.warning("已退回 %d 笔超时未结算的冻结费用", released)
+    
+    # 在API进程内启动后台提问任务的worker，并重新排队上次退出时中断的任务
+    if JOB_WORKER_MODE == "inprocess":
+        job_queue = get_job_queue()
+        job_queue.handler = process_question_job
+        job_queue.on_complete = finish_question_job
+        await job_queue.start()
+    
+    app.state.key_pool_refresher = asyncio.create_task(refresh_key_pool_periodically())
+    app.state.loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag()) if METRICS_ENABLED else None
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.key_pool_refresher.cancel()
+    if app.state.loop_lag_monitor is not None:
+        app.state.loop_lag_monitor.cancel()
+    # 等待执行中的后台任务结束后再关闭上游客户端
+    if JOB_WORKER_MODE == "inprocess":
+        await get_job_queue().stop()
+    await close_doubao_client()
+    # 写完队列中的记录后再关闭数据库连接
+    if get_write_behind() is not None:
+        await get_write_behind().stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    shutdown_password_hasher()
 
 
 @app.get("/")
@@ -0,0 +1 @@
+# 脚本包初始化文件
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""登录风暴压测：大量并发登录期间，测量无关接口的响应延迟
+
+用法（服务已启动，在 ehq_back 目录下运行）：
+    python -m scripts.bench_login_storm --base-url http://127.0.0.1:8000 --logins 200 --concurrency 32
+
+脚本会先注册一个压测用户（已存在则直接使用），然后并发发起登录请求，
+同时以固定间隔请求 --probe-path，输出探测请求和登录请求的延迟分位数。
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summary(name, latencies):
+    return (
+        f"{name}: n={len(latencies)} "
+        f"p50={percentile(latencies, 50) * 1000:.1f}ms "
+        f"p99={percentile(latencies, 99) * 1000:.1f}ms "
+        f"max={max(latencies, default=0) * 1000:.1f}ms"
+    )
+
+
+async def probe(client, path, interval, stop, latencies):
+    """以固定间隔请求无关接口，记录每次的延迟"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(path)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+async def login_worker(client, queue, username, password, latencies, statuses):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        response = await client.post("/api/users/token", data={"username": username, "password": password})
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client, \
+            httpx.AsyncClient(base_url=args.base_url, timeout=60) as probe_client:
+        await client.post("/api/users/register", json={
+            "username": args.username,
+            "email": f"{args.username}@example.com",
+            "password": args.password,
+        })
+
+        # 空闲时的基线延迟
+        stop = asyncio.Event()
+        idle = []
+        task = asyncio.create_task(probe(probe_client, args.probe_path, args.probe_interval, stop, idle))
+        await asyncio.sleep(2)
+        stop.set()
+        await task
+
+        queue = asyncio.Queue()
+        for _ in range(args.logins):
+            queue.put_nowait(None)
+        stop = asyncio.Event()
+        storm, logins, statuses = [], [], {}
+        task = asyncio.create_task(probe(probe_client, args.probe_path, args.probe_interval, stop, storm))
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            login_worker(client, queue, args.username, args.password, logins, statuses)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+
+    print(summary(f"{args.probe_path} 空闲", idle))
+    print(summary(f"{args.probe_path} 登录期间", storm))
+    print(summary("登录", logins) + f" 吞吐={len(logins) / elapsed:.1f}/s 状态码={statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量登录风暴期间无关接口的延迟")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="服务地址")
+    parser.add_argument("--username", default="bench_login_user", help="压测用户名")
+    parser.add_argument("--password", default="bench-password", help="压测用户密码")
+    parser.add_argument("--logins", type=int, default=200, help="登录请求总数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发登录数")
+    parser.add_argument("--probe-path", default="/", help="用于测量延迟的无关接口")
+    parser.add_argument("--probe-interval", type=float, default=0.02, help="探测请求间隔（秒）")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""题型识别的准确率和耗时，以及按题型路由后每道题冻结的最高费用
+
+用法（在 ehq_back 目录下运行）：
+    python -m scripts.bench_question_types --repeat 2000
+    python -m scripts.bench_question_types --file questions.txt   # 每道题之间用空行分隔，只统计题型分布
+
+不带 --file 时使用内置的带标注样例，输出识别错误的样例。
+"""
+import argparse
+import math
+import statistics
+import time
+from collections import Counter
+
+from api.routers.questions import calculate_cost, estimate_hold_cost, fixed_prompt_tokens
+from services.question_types import DOUBAO_MAX_TOKENS, PROFILES, QUESTION_TYPES, classify_question
+from services.token_estimator import TOKEN_ESTIMATE_MARGIN, get_token_estimator
+
+
+PASSAGE = (
+    "Tom lives in a small town near the sea. Every morning he gets up early and walks along the beach with his dog. "
+    "One day he found a bottle with a letter inside. The letter was written by a girl from another country, "
+    "who hoped to make friends with anyone who found it. Tom decided to write back. Since then they have written "
+    "to each other for ten years, and last summer they finally met in person. They talked about their schools, "
+    "their families and the books they liked, and they promised to keep in touch for the rest of their lives. "
+)
+
+# (题目, 标注的题型)
+SAMPLES = [
+    ("She ___ to school every day.\nA. go  B. goes  C. going  D. gone", "choice"),
+    ("—Would you mind opening the window? —______.\nA. Yes, please B. Not at all C. Of course D. Good idea", "choice"),
+    ("I have lived here ______ 2010. (A) for (B) since (C) in (D) at", "choice"),
+    ("The boy is too young ___ (go) to school.", "choice"),
+    ("He asked me where I ( ) the day before.\nA.went B.had gone C.go D.have gone", "choice"),
+    ("单项选择：It's no use ___ over spilt milk. A. cry B. to cry C. crying D. cried", "choice"),
+    ("完形填空\n" + PASSAGE + "\n1. A. town B. city C. village D. country\n2. A. bottle B. box C. bag D. book", "cloze"),
+    ("语法填空：阅读下面短文，在空白处填入1个适当的单词或括号内单词的正确形式。\nTom __1__ (live) in a small town. He __2__ (get) up early.", "cloze"),
+    ("Last summer I __1__ (visit) my grandparents. They __2__ (live) on a farm. I __3__ (help) them feed the animals.", "cloze"),
+    ("Fill in the blanks with the proper form of the given words.\n1. He is ____ (care) with his homework.", "cloze"),
+    ("短文改错：假定英语课上老师要求同桌之间交换修改作文，请你修改你同桌写的以下作文。文中共有10处语言错误。\nI goes to school by bike yesterday.", "correction"),
+    ("Find and correct the mistakes in the following sentences.\n1. She don't like apples.\n2. He have two brother.", "correction"),
+    ("下面句子有一处错误，请找出并改正：Everyone of the students have a dictionary.", "correction"),
+    ("阅读理解\n" + PASSAGE + "\n1. Where does Tom live?\nA. Near the sea. B. In a big city. C. On a farm. D. In another country.", "reading"),
+    ("Read the passage and answer the questions.\n" + PASSAGE + "\nWhat is the main idea of the passage?", "reading"),
+    (PASSAGE + "\nWhat can we learn from the passage?\nA. Tom hates writing. B. They met last summer. C. The girl lives in the town. D. Tom has no dog.", "reading"),
+    ("书面表达：假定你是李华，请给你的英国朋友Chris写一封信，介绍你的暑假计划。词数80左右。", "writing"),
+    ("Write a letter to your pen pal about your school life. You should write at least 100 words.", "writing"),
+    ("以\"My Hobby\"为题写一篇英语短文，不少于80词。", "writing"),
+    ("请翻译：我每天早上七点起床。", "general"),
+    ("What is the difference between \"affect\" and \"effect\"?", "general"),
+    ("解释一下虚拟语气的用法", "general"),
+]
+
+
+def measure(questions, repeat: int) -> float:
+    """每道题的平均识别耗时（微秒），不计识别结果缓存"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for question in questions:
+            classify_question.__wrapped__(question)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) / len(questions) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="题型识别的准确率、耗时和按题型冻结的费用")
+    parser.add_argument("--file", help="待识别的题目文件，题目之间用空行分隔；不指定时使用内置的带标注样例")
+    parser.add_argument("--repeat", type=int, default=200, help="测量耗时的运行次数")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            questions = [block.strip() for block in f.read().split("\n\n") if block.strip()]
+        labels = None
+    else:
+        questions = [question for question, _ in SAMPLES]
+        labels = [label for _, label in SAMPLES]
+
+    predicted = [classify_question.__wrapped__(question) for question in questions]
+    print(f"{len(questions)} 道题，平均每道识别耗时 {measure(questions, args.repeat):.1f} 微秒")
+    if labels is not None:
+        correct = sum(p == label for p, label in zip(predicted, labels))
+        print(f"准确率 {correct}/{len(labels)}")
+        for question, p, label in zip(questions, predicted, labels):
+            if p != label:
+                print(f"  识别为 {p}，应为 {label}：{question[:60]!r}")
+
+    # 与所有题目都用通用模板和DOUBAO_MAX_TOKENS相比，按题型路由后冻结的最高费用
+    estimator = get_token_estimator()
+    general = PROFILES["general"]
+    counts = Counter(predicted)
+    print(f"{'题型':<12}{'题数':>6}{'max_tokens':>12}{'模型':>20}{'平均冻结(元)':>16}{'通用模板冻结(元)':>18}")
+    for question_type in QUESTION_TYPES:
+        if not counts[question_type]:
+            continue
+        profile = PROFILES[question_type]
+        chosen = [question for question, p in zip(questions, predicted) if p == question_type]
+        routed = statistics.mean(float(estimate_hold_cost(question)) for question in chosen)
+        baseline = statistics.mean(
+            float(calculate_cost(math.ceil((fixed_prompt_tokens(general.template) + estimator.count(question)) * TOKEN_ESTIMATE_MARGIN) + DOUBAO_MAX_TOKENS))
+            for question in chosen
+        )
+        print(f"{question_type:<12}{counts[question_type]:>6}{profile.max_tokens:>12}{profile.model:>20}{routed:>16.4f}{baseline:>18.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""列表接口响应序列化的微基准：比较逐行模型校验 + 标准库json 与 直接投影 + orjson 的开销，以及压缩的耗时和体积
+
+用法（在 ehq_back 目录下运行）：
+    python -m scripts.bench_serialization --records 1000 --answer-length 2000 --repeat 20
+
+结果按每1000条记录折算，各项取多次运行的中位数。
+"""
+import argparse
+import gzip
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from api.responses import RESPONSE_BROTLI_QUALITY, RESPONSE_GZIP_LEVEL, brotli, dumps
+from api.schemas import QuestionRecord as QuestionRecordSchema
+from db.models import QuestionRecord
+
+
+# 构造文本用的词，比随机字符更接近真实解答的压缩率
+WORDS = (
+    "the answer is B because the subject is third person singular so the verb takes s "
+    "解析 选项 正确答案 主语 谓语 时态 虚拟语气 现在完成时 翻译 例句 固定搭配 注意"
+).split()
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def make_records(count: int, answer_length: int, rng: random.Random):
+    """构造ORM对象和等价的行字典，字段与 QuestionRecord 响应模型一致"""
+    now = datetime.utcnow()
+    objects, rows = [], []
+    for i in range(count):
+        values = {
+            "id": i + 1,
+            "user_id": 1,
+            "question": random_text(rng, 120),
+            "answer": random_text(rng, answer_length),
+            "tokens_used": rng.randint(200, 2000),
+            "cost": Decimal(rng.randint(1, 5000)) / Decimal(10000),
+            "created_at": now - timedelta(seconds=i),
+        }
+        objects.append(QuestionRecord(**values))
+        rows.append(values)
+    return objects, rows
+
+
+def measure(func, repeat: int) -> float:
+    """多次运行取中位数（秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列表接口响应序列化的微基准")
+    parser.add_argument("--records", type=int, default=1000, help="每次序列化的记录数")
+    parser.add_argument("--answer-length", type=int, default=2000, help="每条记录解答的字符数")
+    parser.add_argument("--repeat", type=int, default=20, help="每项测量的运行次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    objects, rows = make_records(args.records, args.answer_length, random.Random(args.seed))
+    adapter = TypeAdapter(List[QuestionRecordSchema])
+    scale = 1000 / args.records
+
+    def validated_json() -> bytes:
+        # 与FastAPI按response_model返回时相同：逐行校验、转换为可JSON化的对象、标准库json序列化
+        models = adapter.validate_python(objects, from_attributes=True)
+        content = jsonable_encoder(models)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+    def projected_orjson() -> bytes:
+        return dumps([dict(row) for row in rows])
+
+    body = projected_orjson()
+    results = [
+        ("模型校验 + json", measure(validated_json, args.repeat), len(validated_json())),
+        ("直接投影 + orjson", measure(projected_orjson, args.repeat), len(body)),
+        (f"gzip 压缩（级别{RESPONSE_GZIP_LEVEL}）", measure(lambda: gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL), args.repeat),
+         len(gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL))),
+    ]
+    if brotli is not None:
+        results.append((
+            f"brotli 压缩（质量{RESPONSE_BROTLI_QUALITY}）",
+            measure(lambda: brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY), args.repeat),
+            len(brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY))
+        ))
+    else:
+        print("未安装brotli，跳过brotli压缩")
+
+    print(f"{args.records} 条记录，解答 {args.answer_length} 字符，每项运行 {args.repeat} 次取中位数，按每1000条折算：")
+    for name, seconds, size in results:
+        print(f"  {name:<20} {seconds * scale * 1000:9.2f} ms  {size * scale / 1024:10.1f} KiB")
+    baseline, fast = results[0][1], results[1][1]
+    if fast:
+        print(f"直接投影 + orjson 比模型校验 + json 快 {baseline / fast:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
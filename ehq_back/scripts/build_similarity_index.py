@@ -0,0 +1,33 @@
+"""离线构建相似题目索引
+
+用法（在 ehq_back 目录下运行）：
+    python -m scripts.build_similarity_index --output similarity_index.pkl
+
+服务启动时若 SIMILARITY_INDEX_PATH 指向该文件，会直接加载并只补齐之后新增的记录。
+"""
+import argparse
+import time
+
+from db.database import SessionLocal
+from services.similarity_index import SIMILARITY_INDEX_PATH, SimilarityIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从数据库重建相似题目索引")
+    parser.add_argument("--output", default=SIMILARITY_INDEX_PATH or "similarity_index.pkl", help="索引文件输出路径")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批读取的记录数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = SimilarityIndex()
+    db = SessionLocal()
+    try:
+        added = index.build_from_db(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    index.save(args.output)
+    print(f"已索引 {len(index)}/{added} 条记录，max_id={index.max_id}，耗时 {time.perf_counter() - start:.1f} 秒，输出 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
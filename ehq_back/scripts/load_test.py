@@ -0,0 +1,250 @@
+"""端到端压测：模拟用户依次注册、登录、充值、提问、查看历史，输出可比较的机器可读结果
+
+用法（服务已启动，在 ehq_back 目录下运行）：
+    python -m scripts.mock_doubao --port 9000 &
+    DOUBAO_API_BASE_URL=http://127.0.0.1:9000/v1 RATE_LIMIT_ENABLED=false uvicorn main:app --port 8000 &
+    python -m scripts.load_test --users 200 --concurrency 50 --asks-per-user 5 --output result.json
+    python -m scripts.load_test --users 200 --concurrency 50 --baseline result.json --max-regression 0.1
+
+每个模拟用户：register -> token -> recharge -> (ask 或 ask_stream -> history) x asks-per-user。
+--repeat-ratio 控制提问中重复题目的比例，用于覆盖答案缓存和合并请求的路径。
+结果包括总吞吐、各步骤的吞吐、p50/p95/p99延迟和错误率；指定 --baseline 时与上一次的结果比较，
+吞吐下降或p95延迟上升超过 --max-regression 时以退出码1结束，便于在CI中跟踪性能回退。
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+# 重复提问时使用的固定题目
+COMMON_QUESTIONS = [
+    "Choose the correct answer: She ___ to school every day. A. go B. goes C. going D. gone",
+    "What is the difference between 'affect' and 'effect'?",
+    "Fill in the blank: If I ___ you, I would study harder. A. am B. was C. were D. be",
+    "Translate into English: 他已经在这里住了十年了。",
+    "Which sentence is correct? A. He don't like apples. B. He doesn't like apples.",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class StepStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, latency: float, status):
+        self.latencies.append(latency)
+        key = str(status)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def to_dict(self, elapsed: float) -> dict:
+        count = len(self.latencies)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "throughput_rps": count / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p95_ms": percentile(self.latencies, 95) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "max_ms": max(self.latencies, default=0) * 1000,
+            "statuses": self.statuses,
+        }
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self.steps = {}
+        self.rng = random.Random(args.seed)
+
+    async def request(self, step: str, call):
+        """执行一个请求并记录延迟和状态码，网络错误按异常类型名记录"""
+        stats = self.steps.setdefault(step, StepStats())
+        start = time.perf_counter()
+        try:
+            response = await call()
+        except httpx.HTTPError as e:
+            stats.record(time.perf_counter() - start, type(e).__name__)
+            return None
+        stats.record(time.perf_counter() - start, response.status_code)
+        return response
+
+    def question(self) -> str:
+        if self.rng.random() < self.args.repeat_ratio:
+            return self.rng.choice(COMMON_QUESTIONS)
+        return f"{self.rng.choice(COMMON_QUESTIONS)} (variant {uuid.uuid4().hex[:12]})"
+
+    async def ask_stream(self, client: httpx.AsyncClient, headers: dict, question: str):
+        """流式提问：ask_stream 记录读完整个响应的时间，ask_stream_ttfb 记录收到第一个数据块的时间"""
+        ttfb = self.steps.setdefault("ask_stream_ttfb", StepStats())
+        start = time.perf_counter()
+
+        async def call():
+            async with client.stream("POST", "/api/questions/ask/stream", json={"question": question}, headers=headers) as response:
+                first = True
+                async for _ in response.aiter_bytes():
+                    if first:
+                        ttfb.record(time.perf_counter() - start, response.status_code)
+                        first = False
+                return response
+
+        await self.request("ask_stream", call)
+
+    async def user_flow(self, client: httpx.AsyncClient, index: int):
+        username = f"load_{self.run_id}_{index}"
+        password = "load-test-password"
+        response = await self.request("register", lambda: client.post("/api/users/register", json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": password,
+        }))
+        if response is None or response.status_code >= 400:
+            return
+        response = await self.request("token", lambda: client.post("/api/users/token", data={"username": username, "password": password}))
+        if response is None or response.status_code >= 400:
+            return
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        await self.request("recharge", lambda: client.post("/api/users/recharge", json={"amount": self.args.recharge}, headers=headers))
+
+        for _ in range(self.args.asks_per_user):
+            question = self.question()
+            if self.rng.random() < self.args.stream_ratio:
+                await self.ask_stream(client, headers, question)
+            else:
+                await self.request("ask", lambda: client.post("/api/questions/ask", json={"question": question}, headers=headers))
+            await self.request("history", lambda: client.get("/api/questions/history", params={"limit": 20}, headers=headers))
+            if self.args.think_time:
+                await asyncio.sleep(self.rng.uniform(0, self.args.think_time))
+
+    async def run(self) -> dict:
+        args = self.args
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(client, index):
+            async with semaphore:
+                await self.user_flow(client, index)
+
+        started_at = datetime.utcnow().isoformat() + "Z"
+        start = time.perf_counter()
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+            await asyncio.gather(*[limited(client, i) for i in range(args.users)])
+        elapsed = time.perf_counter() - start
+
+        total = sum(len(stats.latencies) for name, stats in self.steps.items() if name != "ask_stream_ttfb")
+        errors = sum(stats.errors for name, stats in self.steps.items() if name != "ask_stream_ttfb")
+        return {
+            "label": args.label,
+            "base_url": args.base_url,
+            "started_at": started_at,
+            "duration_s": elapsed,
+            "config": {
+                "users": args.users,
+                "concurrency": args.concurrency,
+                "asks_per_user": args.asks_per_user,
+                "stream_ratio": args.stream_ratio,
+                "repeat_ratio": args.repeat_ratio,
+                "think_time": args.think_time,
+                "seed": args.seed,
+            },
+            "overall": {
+                "requests": total,
+                "errors": errors,
+                "error_rate": errors / total if total else 0.0,
+                "throughput_rps": total / elapsed if elapsed else 0.0,
+            },
+            "steps": {name: stats.to_dict(elapsed) for name, stats in sorted(self.steps.items())},
+        }
+
+
+def print_summary(result: dict, out=sys.stdout):
+    overall = result["overall"]
+    print(
+        f"{result['config']['users']} 个用户，并发 {result['config']['concurrency']}，耗时 {result['duration_s']:.1f} 秒，"
+        f"{overall['requests']} 个请求，{overall['throughput_rps']:.1f} 请求/秒，错误率 {overall['error_rate']:.2%}",
+        file=out
+    )
+    for name, step in result["steps"].items():
+        print(
+            f"  {name:<16} n={step['count']:<6} {step['throughput_rps']:7.1f}/s "
+            f"p50={step['p50_ms']:8.1f}ms p95={step['p95_ms']:8.1f}ms p99={step['p99_ms']:8.1f}ms "
+            f"错误率={step['error_rate']:.2%} 状态码={step['statuses']}",
+            file=out
+        )
+
+
+def compare(result: dict, baseline: dict, max_regression: float, out=sys.stdout) -> bool:
+    """与基线结果比较各步骤的吞吐和p95延迟，返回是否在允许的回退范围内"""
+    ok = True
+    print(f"与基线 {baseline.get('label') or baseline.get('started_at')} 比较：", file=out)
+    for name, step in result["steps"].items():
+        base = baseline.get("steps", {}).get(name)
+        if not base or not base["count"]:
+            continue
+        throughput_change = step["throughput_rps"] / base["throughput_rps"] - 1 if base["throughput_rps"] else 0.0
+        p95_change = step["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0.0
+        regressed = max_regression is not None and (throughput_change < -max_regression or p95_change > max_regression)
+        ok = ok and not regressed
+        print(
+            f"  {name:<16} 吞吐 {throughput_change:+.1%}  p95 {p95_change:+.1%}  "
+            f"错误率 {base['error_rate']:.2%} -> {step['error_rate']:.2%}{'  回退' if regressed else ''}",
+            file=out
+        )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟注册、登录、提问、查看历史的端到端压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="服务地址")
+    parser.add_argument("--users", type=int, default=100, help="模拟用户总数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同时进行的用户数")
+    parser.add_argument("--asks-per-user", type=int, default=3, help="每个用户的提问次数，每次提问后查看一次历史")
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="使用流式接口提问的比例")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="提问重复题目的比例")
+    parser.add_argument("--think-time", type=float, default=0.0, help="两次提问之间的最长随机间隔（秒）")
+    parser.add_argument("--recharge", type=float, default=100, help="每个用户的充值金额")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求的超时时间（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--label", default="", help="本次结果的标签，如版本号")
+    parser.add_argument("--output", help="把结果写入JSON文件，- 表示输出到标准输出")
+    parser.add_argument("--baseline", help="用于比较的上一次结果JSON文件")
+    parser.add_argument("--max-regression", type=float, default=None, help="允许的吞吐下降或p95上升比例，超出时退出码为1")
+    args = parser.parse_args()
+
+    result = asyncio.run(LoadTest(args).run())
+    # JSON输出到标准输出时，摘要改为输出到标准错误
+    summary_out = sys.stderr if args.output == "-" else sys.stdout
+    print_summary(result, summary_out)
+    if args.output == "-":
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.max_regression, summary_out):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
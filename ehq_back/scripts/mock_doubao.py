@@ -0,0 +1,130 @@
+"""本地模拟的豆包对话补全服务，用于压测时代替付费的上游API
+
+用法（在 ehq_back 目录下运行）：
+    python -m scripts.mock_doubao --port 9000 --latency 1.5 --latency-sigma 0.5 --error-rate 0.01 --rate-limit-rate 0.02
+然后以 DOUBAO_API_BASE_URL=http://127.0.0.1:9000/v1 启动后端服务。
+
+- 非流式请求按对数正态分布的延迟返回（中位数 --latency 秒，--latency-sigma 控制长尾），
+  生成的token数在 --min-tokens 和 --max-tokens 之间均匀分布，不超过请求的max_tokens（超过时finish_reason为length）
+- 流式请求先等待 --first-token-latency 秒，之后每 --chunk-interval 秒推送一个数据块（每块1个token），
+  请求带 stream_options.include_usage 时在最后一个数据块中返回usage
+- 按 --error-rate 返回500，按 --rate-limit-rate 返回429；Authorization为 "Bearer bad" 的请求总是返回429
+- GET /stats 返回各类响应的次数
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Mock Doubao API")
+config = argparse.Namespace()
+counts = {}
+
+
+def count(outcome: str):
+    counts[outcome] = counts.get(outcome, 0) + 1
+
+
+def approximate_prompt_tokens(payload: dict) -> int:
+    return sum(math.ceil(len(message.get("content", "")) / 2) for message in payload.get("messages", []))
+
+
+def injected_error(request: Request):
+    """按配置的比例模拟上游错误，没有注入错误时返回None"""
+    if request.headers.get("authorization") == "Bearer bad" or random.random() < config.rate_limit_rate:
+        count("429")
+        return JSONResponse({"error": {"message": "Rate limit exceeded"}}, status_code=429)
+    if random.random() < config.error_rate:
+        count("500")
+        return JSONResponse({"error": {"message": "Internal server error"}}, status_code=500)
+    return None
+
+
+def completion_tokens(payload: dict):
+    """返回 (生成的token数, finish_reason)"""
+    tokens = random.randint(config.min_tokens, config.max_tokens)
+    limit = payload.get("max_tokens")
+    if limit is not None and tokens > limit:
+        return limit, "length"
+    return tokens, "stop"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    error = injected_error(request)
+    if error is not None:
+        return error
+
+    prompt_tokens = approximate_prompt_tokens(payload)
+    tokens, finish_reason = completion_tokens(payload)
+    created = int(time.time())
+
+    if payload.get("stream"):
+        count("stream")
+        include_usage = (payload.get("stream_options") or {}).get("include_usage", False)
+
+        async def stream():
+            await asyncio.sleep(config.first_token_latency)
+            for i in range(tokens):
+                if i:
+                    await asyncio.sleep(config.chunk_interval)
+                choice = {"index": 0, "delta": {"content": f"token{i} "}}
+                if i == tokens - 1:
+                    choice["finish_reason"] = finish_reason
+                yield "data: " + json.dumps({"id": "mock", "created": created, "choices": [choice]}) + "\n\n"
+            if include_usage:
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+                yield "data: " + json.dumps({"id": "mock", "created": created, "choices": [], "usage": usage}) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    count("completion")
+    await asyncio.sleep(random.lognormvariate(math.log(config.latency), config.latency_sigma) if config.latency > 0 else 0)
+    return {
+        "id": "mock",
+        "object": "chat.completion",
+        "created": created,
+        "model": payload.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "模拟解答：" + "token " * tokens},
+            "finish_reason": finish_reason,
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens},
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的豆包对话补全服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=9000, help="监听端口")
+    parser.add_argument("--latency", type=float, default=1.0, help="非流式请求延迟的中位数（秒），0为不等待")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="延迟对数正态分布的sigma，越大长尾越重")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="流式请求第一个数据块前的等待时间（秒）")
+    parser.add_argument("--chunk-interval", type=float, default=0.02, help="流式数据块的间隔（秒）")
+    parser.add_argument("--min-tokens", type=int, default=200, help="生成token数的下限")
+    parser.add_argument("--max-tokens", type=int, default=800, help="生成token数的上限")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+    vars(config).update(vars(args))
+    random.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
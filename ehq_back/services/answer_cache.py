@@ -0,0 +1,232 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+# 加载环境变量
+load_dotenv()
+
+# 答案缓存配置
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "604800"))  # 缓存有效期（秒），默认7天
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))  # 内存缓存最大条目数
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 内存缓存最大字节数
+ANSWER_CACHE_SQLITE_PATH = os.getenv("ANSWER_CACHE_SQLITE_PATH", "")  # 共享缓存SQLite文件路径，为空则不启用
+ANSWER_CACHE_SEED_LIMIT = int(os.getenv("ANSWER_CACHE_SEED_LIMIT", "5000"))  # 启动时从历史记录预热的条数
+# 命中缓存时的计费策略：full 按原价计费，free 不计费，ratio 按 ANSWER_CACHE_CHARGE_RATIO 比例计费
+ANSWER_CACHE_CHARGE_POLICY = os.getenv("ANSWER_CACHE_CHARGE_POLICY", "full").lower()
+ANSWER_CACHE_CHARGE_RATIO = float(os.getenv("ANSWER_CACHE_CHARGE_RATIO", "0.5"))
+
+_whitespace_re = re.compile(r"\s+")
+
+# 基本多文种平面内所有标点字符替换为空格的转换表，导入时构建一次
+_punctuation_table = {
+    code: " " for code in range(0x10000)
+    if unicodedata.category(chr(code)).startswith("P")
+}
+
+
+def normalize_question(question: str) -> str:
+    """规范化题目文本：统一全半角、忽略大小写、去除标点并合并空白"""
+    text = unicodedata.normalize("NFKC", question).casefold().translate(_punctuation_table)
+    return _whitespace_re.sub(" ", text).strip()
+
+
+def make_cache_key(question: str, prompt_version: str, model: str) -> str:
+    """由规范化题目、提示词模板版本和模型名生成缓存键"""
+    raw = f"{prompt_version}\x1f{model}\x1f{normalize_question(question)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_charge_ratio() -> float:
+    """命中缓存时相对原价的计费比例"""
+    if ANSWER_CACHE_CHARGE_POLICY == "free":
+        return 0.0
+    if ANSWER_CACHE_CHARGE_POLICY == "ratio":
+        return ANSWER_CACHE_CHARGE_RATIO
+    return 1.0
+
+
+class MemoryCacheTier:
+    """进程内LRU缓存，按TTL过期，按条目数和字节数淘汰"""
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value, size = item
+            if expires_at < time.time():
+                del self._data[key]
+                self._bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict, expires_at: Optional[float] = None):
+        size = len(key) + len(value["answer"].encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (expires_at or time.time() + self.ttl, value, size)
+            self._bytes += size
+            # 淘汰最久未使用的条目
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+class SQLiteCacheTier:
+    """基于SQLite文件的共享缓存，供同一主机上的多个worker进程共用；读写在线程池中执行，不阻塞事件循环"""
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answer_cache ("
+            "key TEXT PRIMARY KEY, answer TEXT NOT NULL, tokens_used INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._writes = 0
+
+    async def get(self, key: str):
+        return await run_in_threadpool(self._get, key)
+
+    async def set(self, key: str, value: dict):
+        await run_in_threadpool(self._set, key, value)
+
+    def _get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, tokens_used, expires_at FROM answer_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return {"answer": row[0], "tokens_used": row[1]}, row[2]
+
+    def _set(self, key: str, value: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache (key, answer, tokens_used, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value["answer"], value["tokens_used"], time.time() + self.ttl)
+            )
+            # 定期清理过期条目
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._conn.execute("DELETE FROM answer_cache WHERE expires_at <= ?", (time.time(),))
+
+
+class AnswerCache:
+    """题目答案缓存：内存LRU层 + 可选的SQLite共享层"""
+
+    def __init__(self, memory: MemoryCacheTier, shared: Optional[SQLiteCacheTier] = None):
+        self.memory = memory
+        self.shared = shared
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.shared is not None:
+            found = await self.shared.get(key)
+            if found is not None:
+                value, expires_at = found
+                self.memory.set(key, value, expires_at)
+                self.shared_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, answer: str, tokens_used: int):
+        value = {"answer": answer, "tokens_used": tokens_used}
+        self.memory.set(key, value)
+        if self.shared is not None:
+            await self.shared.set(key, value)
+
+    def seed_from_db(self, db, key_func: Callable[[str], str], version_func: Callable[[str], str], limit: int = ANSWER_CACHE_SEED_LIMIT):
+        """用最近的完整解答预热缓存，返回写入的条目数；被截断、中途断开的解答和没有完成情况的旧记录不参与预热，
+        提示词模板版本与version_func给出的当前版本不同的记录（如题型路由前用通用模板生成的解答）也不参与预热"""
+        from db.models import QuestionRecord, FINISH_REASON_STOP
+
+        records = (
+            db.query(QuestionRecord.question, QuestionRecord.answer, QuestionRecord.tokens_used, QuestionRecord.prompt_version)
+            .filter(
+                QuestionRecord.finish_reason == FINISH_REASON_STOP,
+                QuestionRecord.answer.isnot(None),
+                QuestionRecord.tokens_used > 0
+            )
+            .order_by(QuestionRecord.id.desc())
+            .limit(limit)
+            .all()
+        )
+        seeded = 0
+        # 从旧到新写入，使最新的记录最后进入LRU
+        for question, answer, tokens_used, prompt_version in reversed(records):
+            if prompt_version != version_func(question):
+                continue
+            self.memory.set(key_func(question), {"answer": answer, "tokens_used": tokens_used})
+            seeded += 1
+        return seeded
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.shared_hits
+        total = hits + self.misses
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "memory_hits": self.memory_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / total if total else 0.0,
+            "entries": len(self.memory),
+            "size_bytes": self.memory.size_bytes,
+            "shared_enabled": self.shared is not None,
+            "charge_policy": ANSWER_CACHE_CHARGE_POLICY,
+        }
+
+
+# 全局缓存实例
+_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """获取全局答案缓存"""
+    global _cache
+    if _cache is None:
+        shared = SQLiteCacheTier(ANSWER_CACHE_SQLITE_PATH, ANSWER_CACHE_TTL) if ANSWER_CACHE_SQLITE_PATH else None
+        _cache = AnswerCache(
+            MemoryCacheTier(ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_MAX_BYTES),
+            shared
+        )
+    return _cache
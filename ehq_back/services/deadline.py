@@ -0,0 +1,49 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 提问请求的截止时间配置
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "90"))  # 默认截止时间（秒），0为不限制；客户端可以通过 X-Request-Timeout 缩短
+DEADLINE_MIN_UPSTREAM = float(os.getenv("DEADLINE_MIN_UPSTREAM", "2"))  # 剩余时间少于该值（秒）时不再发起或重试上游调用
+# 客户端断开或超过截止时间时的计费策略：delivered 按已推送给客户端的内容计费，none 不计费
+CANCEL_CHARGE_POLICY = os.getenv("CANCEL_CHARGE_POLICY", "delivered").lower()
+
+# 当前请求的截止时间（time.monotonic()），没有截止时间时为None；
+# 在请求中创建的任务（如合并调用的上游任务）会继承发起请求的截止时间
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """请求超过截止时间"""
+
+
+class ClientDisconnected(Exception):
+    """客户端已断开连接"""
+
+
+def set_deadline(timeout: Optional[float]):
+    """设置当前请求的截止时间为timeout秒后，None或0为不限制"""
+    _deadline.set(time.monotonic() + timeout if timeout else None)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的时间（秒），没有截止时间时为None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired(margin: float = 0.0) -> bool:
+    """剩余时间不超过margin秒时返回True"""
+    left = remaining()
+    return left is not None and left <= margin
+
+
+def charge_cancelled() -> bool:
+    """客户端断开或超时的请求是否按已推送的内容计费"""
+    return CANCEL_CHARGE_POLICY != "none"
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 豆包API地址，压测时可以指向本地的模拟服务（见 scripts/mock_doubao.py）
+DOUBAO_API_BASE_URL = os.getenv("DOUBAO_API_BASE_URL", "https://api.doubao.com/v1")  # 替换为实际的豆包API地址
+DOUBAO_API_URL = DOUBAO_API_BASE_URL.rstrip("/") + "/chat/completions"
+
+# 上游连接配置
+DOUBAO_CONNECT_TIMEOUT = float(os.getenv("DOUBAO_CONNECT_TIMEOUT", "5"))  # 建立连接超时（秒）
+DOUBAO_READ_TIMEOUT = float(os.getenv("DOUBAO_READ_TIMEOUT", "120"))  # 读取响应超时（秒）
+DOUBAO_MAX_CONNECTIONS = int(os.getenv("DOUBAO_MAX_CONNECTIONS", "100"))  # 连接池最大连接数
+DOUBAO_MAX_KEEPALIVE = int(os.getenv("DOUBAO_MAX_KEEPALIVE", "20"))  # 保持长连接的空闲连接数
+DOUBAO_MAX_CONCURRENCY = int(os.getenv("DOUBAO_MAX_CONCURRENCY", "50"))  # 同时进行的上游请求上限
+
+
+class DoubaoAPIError(Exception):
+    """豆包API调用失败"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class DoubaoClient:
+    """豆包API异步客户端，复用长连接池并限制并发上游请求数"""
+
+    def __init__(
+        self,
+        url: str = DOUBAO_API_URL,
+        connect_timeout: float = DOUBAO_CONNECT_TIMEOUT,
+        read_timeout: float = DOUBAO_READ_TIMEOUT,
+        max_connections: int = DOUBAO_MAX_CONNECTIONS,
+        max_keepalive: int = DOUBAO_MAX_KEEPALIVE,
+        max_concurrency: int = DOUBAO_MAX_CONCURRENCY,
+    ):
+        self.url = url
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def chat_completion(self, api_key: str, payload: dict) -> dict:
+        """发送一次对话补全请求，返回解析后的JSON"""
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+        async with self._semaphore:
+            try:
+                response = await self._client.post(self.url, headers=headers, json=payload)
+            except httpx.HTTPError as e:
+                raise DoubaoAPIError(f"{type(e).__name__}: {e}") from e
+
+        if response.status_code >= 400:
+            raise DoubaoAPIError(
+                f"HTTP {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code
+            )
+        return response.json()
+
+    async def stream_chat_completion(self, api_key: str, payload: dict) -> AsyncIterator[dict]:
+        """以流式方式发送对话补全请求，逐个产出上游返回的数据块"""
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        }
+        payload = dict(payload, stream=True)
+
+        async with self._semaphore:
+            try:
+                async with self._client.stream("POST", self.url, headers=headers, json=payload) as response:
+                    if response.status_code >= 400:
+                        body = await response.aread()
+                        raise DoubaoAPIError(
+                            f"HTTP {response.status_code}: {body[:200].decode(errors='replace')}",
+                            status_code=response.status_code
+                        )
+                    # 上游按SSE格式返回，每行 "data: {...}"，以 "data: [DONE]" 结束
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        yield json.loads(data)
+            except httpx.HTTPError as e:
+                raise DoubaoAPIError(f"{type(e).__name__}: {e}") from e
+
+    async def close(self):
+        await self._client.aclose()
+
+
+# 全局客户端实例，在应用启动时创建
+_client: Optional[DoubaoClient] = None
+
+
+def init_doubao_client() -> DoubaoClient:
+    """创建全局豆包API客户端"""
+    global _client
+    if _client is None:
+        _client = DoubaoClient()
+    return _client
+
+
+async def close_doubao_client():
+    """关闭全局豆包API客户端，释放连接池"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def get_doubao_client() -> DoubaoClient:
+    """FastAPI依赖：获取全局豆包API客户端"""
+    if _client is None:
+        return init_doubao_client()
+    return _client
@@ -0,0 +1,77 @@
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from services.key_pool import KeyState
+
+# 加载环境变量
+load_dotenv()
+
+# 对冲请求配置：主调用在延迟阈值内没有返回时，用另一个密钥发起相同的调用，先返回的结果胜出
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "false").lower() == "true"
+UPSTREAM_HEDGE_QUANTILE = float(os.getenv("UPSTREAM_HEDGE_QUANTILE", "0.9"))  # 按主调用密钥的该分位耗时决定何时对冲
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "1"))  # 对冲前至少等待的时间（秒）
+UPSTREAM_HEDGE_DEFAULT_DELAY = float(os.getenv("UPSTREAM_HEDGE_DEFAULT_DELAY", "10"))  # 密钥耗时样本不足时的等待时间（秒）
+UPSTREAM_HEDGE_BUDGET = float(os.getenv("UPSTREAM_HEDGE_BUDGET", "0.05"))  # 对冲调用占主调用的最大比例
+UPSTREAM_HEDGE_BURST = float(os.getenv("UPSTREAM_HEDGE_BURST", "10"))  # 预算最多累积的对冲次数
+
+
+class HedgeBudget:
+    """对冲预算：每次主调用积累budget个额度，每次对冲消耗一个，长期的额外调用不超过主调用的budget比例"""
+
+    def __init__(self, budget: float = UPSTREAM_HEDGE_BUDGET, burst: float = UPSTREAM_HEDGE_BURST):
+        self.budget = budget
+        self.burst = burst
+        self.tokens = burst
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    def record_primary(self):
+        self.primaries += 1
+        self.tokens = min(self.burst, self.tokens + self.budget)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            self.denied += 1
+            return False
+        self.tokens -= 1
+        self.hedges += 1
+        return True
+
+    def refund(self):
+        """额度已经扣除但没有可用的密钥发起对冲时退回"""
+        self.tokens += 1
+        self.hedges -= 1
+
+    def stats(self) -> dict:
+        return {
+            "primaries": self.primaries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "denied": self.denied,
+            "hedge_ratio": self.hedges / self.primaries if self.primaries else 0.0,
+            "tokens": self.tokens,
+        }
+
+
+def hedge_delay(key: KeyState) -> float:
+    """主调用等待多久仍未返回时发起对冲：该密钥最近耗时的分位数，样本不足时使用默认值"""
+    latency = key.latency_quantile(UPSTREAM_HEDGE_QUANTILE)
+    if latency is None:
+        return UPSTREAM_HEDGE_DEFAULT_DELAY
+    return max(UPSTREAM_HEDGE_MIN_DELAY, latency)
+
+
+# 全局对冲预算
+_budget: Optional[HedgeBudget] = None
+
+
+def get_hedge_budget() -> HedgeBudget:
+    """获取全局对冲预算"""
+    global _budget
+    if _budget is None:
+        _budget = HedgeBudget()
+    return _budget
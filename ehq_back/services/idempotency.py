@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from db.database import db_session
+from db.models import IdempotencyKey, IDEMPOTENCY_STATUS_COMPLETED, IDEMPOTENCY_STATUS_PENDING
+
+# 加载环境变量
+load_dotenv()
+
+# 幂等键配置：客户端重试携带相同 Idempotency-Key 的提问时，等待或直接返回第一次请求的结果，不再调用上游和扣费
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory").lower()  # memory 保存在进程内存；db 保存在数据库，多worker部署时使用
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))  # 成功的响应保存多久（秒）
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))  # 内存中最多保存的键数，超出时淘汰最早的键
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "120"))  # 进行中的键超过该时间（秒）视为原请求已异常退出，重复请求可以重新执行
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.5"))  # 数据库存储下等待进行中的请求时的查询间隔（秒）
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "600"))  # 数据库存储下删除过期键的间隔（秒）
+
+
+class IdempotencyConflict(Exception):
+    """同一个幂等键被用于内容不同的请求"""
+
+
+class IdempotencyInProgress(Exception):
+    """使用同一个幂等键的请求仍在进行，等待超时"""
+
+
+def request_fingerprint(*parts: str) -> str:
+    """请求内容的哈希，用于确认重复请求与第一次请求相同"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "response", "expires_at", "done")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.response: Optional[str] = None
+        self.expires_at = expires_at
+        self.done = asyncio.Event()
+
+
+class _StoreStats:
+    def __init__(self):
+        self.started = 0
+        self.replayed = 0
+        self.waited = 0
+        self.conflicts = 0
+        self.in_progress = 0
+        self.abandoned = 0
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "replayed": self.replayed,
+            "waited": self.waited,
+            "conflicts": self.conflicts,
+            "in_progress": self.in_progress,
+            "abandoned": self.abandoned
+        }
+
+
+class MemoryIdempotencyStore(_StoreStats):
+    """保存在进程内存中的幂等键，按插入顺序淘汰；只对同一个worker进程收到的重试生效"""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS, lock_timeout: float = IDEMPOTENCY_LOCK_TIMEOUT):
+        super().__init__()
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.lock_timeout = lock_timeout
+        self._entries: "OrderedDict[Tuple[int, str], _Entry]" = OrderedDict()
+        self.evicted = 0
+
+    async def begin(self, user_id: int, key: str, fingerprint: str, timeout: Optional[float] = None) -> Optional[str]:
+        """登记幂等键。第一次请求返回None，由调用方执行后调用complete或abandon；
+        已完成的键返回保存的响应；进行中的键等待其结束，最多等待timeout秒，超时抛出IdempotencyInProgress
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            now = time.monotonic()
+            entry = self._entries.get((user_id, key))
+            if entry is not None and entry.expires_at <= now:
+                # 已过期：完成的响应不再保留，进行中的视为原请求已异常退出
+                del self._entries[(user_id, key)]
+                entry.done.set()
+                entry = None
+            if entry is None:
+                self._entries[(user_id, key)] = _Entry(fingerprint, now + self.lock_timeout)
+                while len(self._entries) > self.max_keys:
+                    _, evicted = self._entries.popitem(last=False)
+                    evicted.done.set()
+                    self.evicted += 1
+                self.started += 1
+                return None
+            if entry.fingerprint != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict()
+            if entry.response is not None:
+                self.replayed += 1
+                return entry.response
+            if not waited:
+                waited = True
+                self.waited += 1
+            wait = min(entry.expires_at, deadline) - now if deadline is not None else entry.expires_at - now
+            if wait <= 0:
+                self.in_progress += 1
+                raise IdempotencyInProgress()
+            try:
+                await asyncio.wait_for(entry.done.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def complete(self, user_id: int, key: str, response: str):
+        """保存成功的响应，之后的重复请求直接返回它"""
+        entry = self._entries.get((user_id, key))
+        if entry is None:
+            return
+        entry.response = response
+        entry.expires_at = time.monotonic() + self.ttl
+        entry.done.set()
+
+    async def abandon(self, user_id: int, key: str):
+        """请求失败（没有扣费）时删除幂等键，等待的重复请求和之后的重试重新执行"""
+        entry = self._entries.get((user_id, key))
+        if entry is None or entry.response is not None:
+            return
+        del self._entries[(user_id, key)]
+        self.abandoned += 1
+        entry.done.set()
+
+    def stats(self) -> dict:
+        return dict(super().stats(), store="memory", keys=len(self._entries), max_keys=self.max_keys, evicted=self.evicted)
+
+
+class DatabaseIdempotencyStore(_StoreStats):
+    """保存在数据库中的幂等键，多个worker进程共享；唯一约束保证同一个键只有一个请求在执行
+
+    等待其他worker上进行中的请求时按 IDEMPOTENCY_POLL_INTERVAL 查询，过期的键定期删除。
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, lock_timeout: float = IDEMPOTENCY_LOCK_TIMEOUT, poll_interval: float = IDEMPOTENCY_POLL_INTERVAL, purge_interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+        super().__init__()
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self.purged = 0
+
+    async def begin(self, user_id: int, key: str, fingerprint: str, timeout: Optional[float] = None) -> Optional[str]:
+        """与 MemoryIdempotencyStore.begin 相同"""
+        await self._purge_expired()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            async with db_session() as db:
+                # 时间以数据库为准，多个worker的时钟不一致时也能正确判断过期
+                now = await db.scalar(select(func.now()))
+                row = (await db.execute(
+                    select(IdempotencyKey.fingerprint, IdempotencyKey.status, IdempotencyKey.response, IdempotencyKey.expires_at)
+                    .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+                )).first()
+                await db.commit()
+                if row is not None and row.expires_at <= now:
+                    await db.execute(delete(IdempotencyKey).where(
+                        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.expires_at <= now
+                    ))
+                    await db.commit()
+                    row = None
+                if row is None:
+                    db.add(IdempotencyKey(
+                        user_id=user_id,
+                        key=key,
+                        fingerprint=fingerprint,
+                        status=IDEMPOTENCY_STATUS_PENDING,
+                        expires_at=now + timedelta(seconds=self.lock_timeout)
+                    ))
+                    try:
+                        await db.commit()
+                    except IntegrityError:
+                        # 其他请求同时登记了这个键，重新读取它的状态
+                        await db.rollback()
+                        continue
+                    self.started += 1
+                    return None
+            if row.fingerprint != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict()
+            if row.status == IDEMPOTENCY_STATUS_COMPLETED:
+                self.replayed += 1
+                return row.response
+            if not waited:
+                waited = True
+                self.waited += 1
+            if deadline is not None and time.monotonic() + self.poll_interval > deadline:
+                self.in_progress += 1
+                raise IdempotencyInProgress()
+            await asyncio.sleep(self.poll_interval)
+
+    async def complete(self, user_id: int, key: str, response: str):
+        async with db_session() as db:
+            now = await db.scalar(select(func.now()))
+            await db.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.status == IDEMPOTENCY_STATUS_PENDING)
+                .values(status=IDEMPOTENCY_STATUS_COMPLETED, response=response, expires_at=now + timedelta(seconds=self.ttl))
+            )
+            await db.commit()
+
+    async def abandon(self, user_id: int, key: str):
+        async with db_session() as db:
+            result = await db.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.status == IDEMPOTENCY_STATUS_PENDING
+            ))
+            await db.commit()
+        self.abandoned += result.rowcount
+
+    async def _purge_expired(self):
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self.purge_interval
+        async with db_session() as db:
+            result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= func.now()))
+            await db.commit()
+        self.purged += result.rowcount
+
+    def stats(self) -> dict:
+        return dict(super().stats(), store="db", purged=self.purged)
+
+
+# 全局幂等键存储
+_store = None
+
+
+def get_idempotency_store():
+    """获取全局幂等键存储"""
+    global _store
+    if _store is None:
+        _store = DatabaseIdempotencyStore() if IDEMPOTENCY_STORE == "db" else MemoryIdempotencyStore()
+    return _store
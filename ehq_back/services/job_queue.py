@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from anyio import CancelScope
+from dotenv import load_dotenv
+from sqlalchemy import func, or_, select, update
+
+from db.database import db_session
+from db.models import (
+    QUESTION_STATUS_COMPLETED,
+    QUESTION_STATUS_FAILED,
+    QUESTION_STATUS_QUEUED,
+    QUESTION_STATUS_RUNNING,
+    QuestionRecord,
+    Transaction,
+)
+from services import ledger
+from services.ledger import Hold, to_money
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 后台任务配置：任务状态保存在问题记录上，worker从数据库领取排队中的任务
+JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "inprocess").lower()  # inprocess 在API进程内执行；external 由 job_worker.py 独立进程执行
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # 每个进程同时执行的任务数
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # 可重试的失败最多执行的次数
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))  # 第一次重试前的等待时间，之后每次翻倍（秒）
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))  # 没有任务时查询数据库的间隔（秒）
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", "60"))  # 执行中的任务超过该时间没有心跳视为worker已退出，重新排队（秒）
+JOB_FIFO_EVERY = int(os.getenv("JOB_FIFO_EVERY", "5"))  # 每领取N个任务按提交顺序领取一次，避免低优先级任务一直排不上，0为关闭
+JOB_SHUTDOWN_TIMEOUT = float(os.getenv("JOB_SHUTDOWN_TIMEOUT", "10"))  # 停止服务时等待执行中任务的时间，超时的任务重新排队（秒）
+# 用户等级对应的任务优先级，格式 "等级:优先级,..."，未列出的等级优先级为0
+JOB_TIER_PRIORITIES = os.getenv("JOB_TIER_PRIORITIES", "premium:10,standard:5,free:0")
+
+# 已结束的任务状态
+FINISHED_STATUSES = (QUESTION_STATUS_COMPLETED, QUESTION_STATUS_FAILED)
+
+
+def parse_tier_priorities(spec: str) -> Dict[str, int]:
+    priorities = {}
+    for item in spec.split(","):
+        if ":" in item:
+            tier, priority = item.split(":", 1)
+            priorities[tier.strip()] = int(priority)
+    return priorities
+
+
+_tier_priorities = parse_tier_priorities(JOB_TIER_PRIORITIES)
+
+
+def tier_priority(tier: Optional[str]) -> int:
+    """用户等级对应的任务优先级"""
+    return _tier_priorities.get(tier or "", 0)
+
+
+class JobError(Exception):
+    """任务执行失败；retryable为False时不再重试"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class JobQueue:
+    """基于问题记录状态列的后台任务队列
+
+    worker用条件UPDATE把任务从queued改为running，多个进程同时领取同一任务时只有一个成功。
+    执行中的任务定期更新心跳，worker异常退出后由其他worker在租约超时后重新排队；
+    可重试的失败按指数退避重新排队，最终失败时退回提交时冻结的费用。
+    """
+
+    def __init__(
+        self,
+        handler: Optional[Callable[[QuestionRecord], Awaitable[dict]]] = None,
+        on_complete: Optional[Callable[[QuestionRecord, dict], Awaitable[None]]] = None,
+        workers: int = JOB_WORKERS,
+    ):
+        self.handler = handler
+        self.on_complete = on_complete
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        # 任务ID -> [结束事件, 等待的请求数]
+        self._waiters: Dict[int, list] = {}
+        self._stopping = False
+        self._claims = 0
+        # 统计
+        self.claimed = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+
+    async def start(self):
+        """重新排队上次退出时遗留的执行中任务，并启动worker"""
+        self.recovered += await self.recover()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self, timeout: float = JOB_SHUTDOWN_TIMEOUT):
+        """停止领取新任务，等待执行中的任务结束；超时的任务取消后重新排队"""
+        self._stopping = True
+        self._wakeup.set()
+        running = list(self._running.values())
+        if running:
+            await asyncio.wait(running, timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        # worker被取消时会取消执行中的任务，等待这些任务重新排队
+        await asyncio.gather(*self._tasks, *running, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """有新任务提交时唤醒本进程的worker"""
+        self._wakeup.set()
+
+    async def wait(self, job_id: int, timeout: float):
+        """等待本进程执行的任务结束或超时；任务由其他进程执行时只能等到超时，由调用方重新查询"""
+        waiter = self._waiters.setdefault(job_id, [asyncio.Event(), 0])
+        waiter[1] += 1
+        try:
+            await asyncio.wait_for(waiter[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiter[1] -= 1
+            if waiter[1] == 0 and self._waiters.get(job_id) is waiter:
+                del self._waiters[job_id]
+
+    def _wake_waiters(self, job_id: int):
+        waiter = self._waiters.pop(job_id, None)
+        if waiter is not None:
+            waiter[0].set()
+
+    async def recover(self) -> int:
+        """把心跳超时的执行中任务重新排队，返回重新排队的任务数"""
+        async with db_session() as db:
+            cutoff = await db.scalar(select(func.now())) - timedelta(seconds=JOB_LEASE_TIMEOUT)
+            await db.commit()
+            result = await db.execute(
+                update(QuestionRecord)
+                .where(QuestionRecord.status == QUESTION_STATUS_RUNNING, QuestionRecord.updated_at < cutoff)
+                .values(status=QUESTION_STATUS_QUEUED, run_after=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        if result.rowcount:
+            logger.warning("重新排队 %d 个中断的后台任务", result.rowcount)
+            self._wakeup.set()
+        return result.rowcount
+
+    async def claim(self) -> Optional[int]:
+        """领取一个到期的排队任务并标记为执行中，没有可领取的任务返回None"""
+        self._claims += 1
+        # 每隔几次按提交顺序领取，低优先级的任务也能得到执行
+        fifo = JOB_FIFO_EVERY > 0 and self._claims % JOB_FIFO_EVERY == 0
+        order = (QuestionRecord.id,) if fifo else (QuestionRecord.priority.desc(), QuestionRecord.id)
+        async with db_session() as db:
+            now = await db.scalar(select(func.now()))
+            candidates = (await db.execute(
+                select(QuestionRecord.id)
+                .where(
+                    QuestionRecord.status == QUESTION_STATUS_QUEUED,
+                    or_(QuestionRecord.run_after.is_(None), QuestionRecord.run_after <= now)
+                )
+                .order_by(*order)
+                .limit(self.workers)
+            )).scalars().all()
+            # 先结束只读事务，领取在新事务中以写操作开始
+            await db.commit()
+            for job_id in candidates:
+                result = await db.execute(
+                    update(QuestionRecord)
+                    .where(QuestionRecord.id == job_id, QuestionRecord.status == QUESTION_STATUS_QUEUED)
+                    .values(status=QUESTION_STATUS_RUNNING, attempts=QuestionRecord.attempts + 1, updated_at=func.now())
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if result.rowcount == 1:
+                    self.claimed += 1
+                    return job_id
+        return None
+
+    async def _worker(self):
+        while not self._stopping:
+            # 领取前清除唤醒标志，领取期间提交的任务不会被漏掉
+            self._wakeup.clear()
+            try:
+                job_id = await self.claim()
+            except Exception:
+                logger.exception("领取后台任务失败")
+                job_id = None
+            if job_id is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # 任务在独立的任务中执行，停止服务时可以单独等待和取消
+            task = asyncio.create_task(self._run(job_id))
+            self._running[job_id] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _reaper(self):
+        """定期重新排队其他worker遗留的任务"""
+        while True:
+            await asyncio.sleep(JOB_LEASE_TIMEOUT / 2)
+            try:
+                self.recovered += await self.recover()
+            except Exception:
+                logger.exception("恢复中断的后台任务失败")
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(JOB_LEASE_TIMEOUT / 3)
+            try:
+                async with db_session() as db:
+                    await db.execute(
+                        update(QuestionRecord)
+                        .where(QuestionRecord.id == job_id, QuestionRecord.status == QUESTION_STATUS_RUNNING)
+                        .values(updated_at=func.now())
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception:
+                logger.exception("更新后台任务 %d 的心跳失败", job_id)
+
+    async def _run(self, job_id: int):
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            async with db_session() as db:
+                job = await db.get(QuestionRecord, job_id)
+            try:
+                result = await self.handler(job)
+            except asyncio.CancelledError:
+                # 停止服务时取消的任务重新排队，不计入执行次数
+                with CancelScope(shield=True):
+                    await self._requeue(job)
+                raise
+            except JobError as e:
+                await self._fail(job, str(e), e.retryable)
+            except Exception as e:
+                await self._fail(job, str(e), True)
+            else:
+                await self._complete(job, result)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 保存结果失败时任务仍为执行中，租约超时后重新排队
+            logger.exception("后台任务 %d 保存结果失败", job_id)
+        finally:
+            heartbeat.cancel()
+            self._wake_waiters(job_id)
+
+    async def _job_hold(self, db, job: QuestionRecord) -> Optional[Hold]:
+        if job.hold_transaction_id is None:
+            return None
+        amount = await db.scalar(select(Transaction.amount).where(Transaction.id == job.hold_transaction_id))
+        return Hold(job.user_id, -to_money(amount or 0), job.hold_transaction_id)
+
+    async def _complete(self, job: QuestionRecord, result: dict):
+        """保存解答并按实际费用结算提交时的冻结"""
+        async with db_session() as db:
+            hold = await self._job_hold(db, job)
+            await db.commit()
+            updated = await db.execute(
+                update(QuestionRecord)
+                .where(QuestionRecord.id == job.id, QuestionRecord.status == QUESTION_STATUS_RUNNING)
+                .values(
+                    status=QUESTION_STATUS_COMPLETED,
+                    answer=result["answer"],
+                    tokens_used=result["tokens_used"],
+                    cost=result["cost"],
+                    api_key_id=result.get("api_key_id"),
+                    finish_reason=result.get("finish_reason"),
+                    prompt_version=result.get("prompt_version"),
+                    error=None
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if updated.rowcount != 1:
+                # 租约超时已被重新排队，由重新领取的worker保存结果
+                await db.rollback()
+                return
+            if hold is not None:
+                await ledger.settle(db, hold, result["cost"])
+            else:
+                # 解答已经生成，照常扣费
+                await ledger.charge(db, job.user_id, result["cost"], allow_overdraft=True)
+            await db.commit()
+        self.completed += 1
+        if self.on_complete is not None:
+            await self.on_complete(job, result)
+
+    async def _fail(self, job: QuestionRecord, error: str, retryable: bool):
+        """可重试的失败按指数退避重新排队，否则标记为失败并退回冻结"""
+        async with db_session() as db:
+            hold = await self._job_hold(db, job)
+            statement = update(QuestionRecord).where(
+                QuestionRecord.id == job.id, QuestionRecord.status == QUESTION_STATUS_RUNNING
+            ).execution_options(synchronize_session=False)
+            if retryable and job.attempts < JOB_MAX_ATTEMPTS:
+                run_after = await db.scalar(select(func.now())) + timedelta(seconds=JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+                await db.commit()
+                await db.execute(statement.values(status=QUESTION_STATUS_QUEUED, error=error, run_after=run_after))
+                self.retried += 1
+            else:
+                await db.commit()
+                updated = await db.execute(statement.values(status=QUESTION_STATUS_FAILED, error=error))
+                if updated.rowcount == 1 and hold is not None:
+                    await ledger.release(db, hold)
+                self.failed += 1
+            await db.commit()
+
+    async def _requeue(self, job: QuestionRecord):
+        async with db_session() as db:
+            await db.execute(
+                update(QuestionRecord)
+                .where(QuestionRecord.id == job.id, QuestionRecord.status == QUESTION_STATUS_RUNNING)
+                .values(status=QUESTION_STATUS_QUEUED, attempts=QuestionRecord.attempts - 1)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "mode": JOB_WORKER_MODE,
+            "workers": self.workers if self._tasks else 0,
+            "running": len(self._running),
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "recovered": self.recovered,
+            "waiting_requests": sum(waiter[1] for waiter in self._waiters.values()),
+        }
+
+
+# 全局任务队列
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """获取全局后台任务队列；处理函数在启动worker前设置"""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
@@ -0,0 +1,187 @@
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# API密钥池配置
+KEY_POOL_MAX_ATTEMPTS = int(os.getenv("KEY_POOL_MAX_ATTEMPTS", "3"))  # 单次提问最多尝试的密钥数
+KEY_POOL_FAILURE_THRESHOLD = int(os.getenv("KEY_POOL_FAILURE_THRESHOLD", "5"))  # 连续失败多少次后熔断
+KEY_POOL_COOLDOWN = float(os.getenv("KEY_POOL_COOLDOWN", "30"))  # 熔断持续时间（秒）
+KEY_POOL_RATE_LIMIT_COOLDOWN = float(os.getenv("KEY_POOL_RATE_LIMIT_COOLDOWN", "60"))  # 收到429后暂停使用的时间（秒）
+KEY_POOL_REFRESH_INTERVAL = float(os.getenv("KEY_POOL_REFRESH_INTERVAL", "60"))  # 定期从数据库刷新密钥的间隔（秒）
+KEY_POOL_LATENCY_ALPHA = 0.2  # 延迟指数加权平均的平滑系数
+KEY_POOL_LATENCY_WINDOW = int(os.getenv("KEY_POOL_LATENCY_WINDOW", "200"))  # 每个密钥保留最近多少次非流式调用的耗时用于计算分位数
+KEY_POOL_LATENCY_MIN_SAMPLES = 20  # 样本少于该数时不计算分位数
+
+# 这些状态码说明问题出在密钥本身或上游，换一个密钥重试可能成功
+RETRYABLE_STATUS_CODES = {401, 403, 408, 429, 500, 502, 503, 504}
+
+
+class KeyState:
+    """单个API密钥的内存状态和调用统计"""
+
+    def __init__(self, api_key):
+        self.id = api_key.id
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.latency_ewma = None
+        self.latencies = deque(maxlen=KEY_POOL_LATENCY_WINDOW)
+        self.in_flight = 0
+        self.update(api_key)
+
+    def update(self, api_key):
+        self.key_name = api_key.key_name
+        self.api_key = api_key.api_key
+        self.priority = api_key.priority
+        self.balance = float(api_key.balance or 0)
+
+    def is_available(self, now: float) -> bool:
+        return self.open_until <= now
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        """最近非流式调用耗时的分位数，样本不足时返回None"""
+        if len(self.latencies) < KEY_POOL_LATENCY_MIN_SAMPLES:
+            return None
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    def weight(self) -> float:
+        # 余额越多、延迟越低、在途请求越少的密钥权重越高
+        latency = self.latency_ewma or 1.0
+        return max(self.balance, 1.0) / max(latency, 0.05) / (1 + self.in_flight)
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "id": self.id,
+            "key_name": self.key_name,
+            "priority": self.priority,
+            "balance": self.balance,
+            "requests": self.requests,
+            "successes": self.successes,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "rate_limited_rate": self.rate_limited / self.requests if self.requests else 0.0,
+            "latency_ewma": self.latency_ewma,
+            "latency_p50": self.latency_quantile(0.5),
+            "latency_p90": self.latency_quantile(0.9),
+            "in_flight": self.in_flight,
+            "circuit_open": not self.is_available(now),
+            "circuit_open_seconds": max(0.0, self.open_until - now),
+        }
+
+
+class ApiKeyPool:
+    """进程内API密钥池：同优先级内按余额和延迟加权选择，按错误率熔断"""
+
+    def __init__(self):
+        self._keys: Dict[int, KeyState] = {}
+        self.loaded_at = 0.0
+
+    def load(self, db):
+        """从数据库加载启用的密钥，已有密钥保留调用统计"""
+        from db.models import ApiKey
+
+        self.update(db.query(ApiKey).filter(ApiKey.is_active == True).all())
+
+    async def load_async(self, db):
+        """通过异步会话加载启用的密钥"""
+        from sqlalchemy import select
+        from db.models import ApiKey
+
+        result = await db.execute(select(ApiKey).where(ApiKey.is_active == True))
+        self.update(result.scalars().all())
+
+    def update(self, rows):
+        """用数据库中的密钥行替换密钥池内容"""
+        keys = {}
+        for row in rows:
+            state = self._keys.get(row.id)
+            if state is None:
+                state = KeyState(row)
+            else:
+                state.update(row)
+            keys[row.id] = state
+        self._keys = keys
+        self.loaded_at = time.monotonic()
+
+    def select(self, exclude: Iterable[int] = ()) -> Optional[KeyState]:
+        """选择一个可用密钥：取可用密钥中优先级最高的一组，按权重随机选择"""
+        now = time.monotonic()
+        candidates = [k for k in self._keys.values() if k.id not in exclude and k.is_available(now)]
+        if not candidates:
+            return None
+        top_priority = min(k.priority for k in candidates)
+        tier = [k for k in candidates if k.priority == top_priority]
+        if len(tier) == 1:
+            return tier[0]
+        return random.choices(tier, weights=[k.weight() for k in tier])[0]
+
+    def begin(self, key: KeyState):
+        key.requests += 1
+        key.in_flight += 1
+
+    def report_success(self, key: KeyState, latency: float):
+        key.in_flight -= 1
+        key.successes += 1
+        key.consecutive_failures = 0
+        if key.latency_ewma is None:
+            key.latency_ewma = latency
+        else:
+            key.latency_ewma += KEY_POOL_LATENCY_ALPHA * (latency - key.latency_ewma)
+
+    def observe_latency(self, key: KeyState, latency: float):
+        """记录一次成功的非流式调用耗时；流式调用的总耗时取决于生成长度，不计入"""
+        key.latencies.append(latency)
+
+    def report_failure(self, key: KeyState, status_code: Optional[int] = None):
+        key.in_flight -= 1
+        key.errors += 1
+        key.consecutive_failures += 1
+        now = time.monotonic()
+        if status_code == 429:
+            # 被上游限流时立即暂停使用该密钥
+            key.rate_limited += 1
+            key.open_until = max(key.open_until, now + KEY_POOL_RATE_LIMIT_COOLDOWN)
+        elif key.consecutive_failures >= KEY_POOL_FAILURE_THRESHOLD:
+            # 熔断到期后允许一次试探，试探失败会再次熔断
+            key.open_until = now + KEY_POOL_COOLDOWN
+
+    def release(self, key: KeyState):
+        """调用被取消等未产生结果时，只归还在途计数"""
+        key.requests -= 1
+        key.in_flight -= 1
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [k.to_dict(now) for k in sorted(self._keys.values(), key=lambda k: (k.priority, k.id))]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+# 全局密钥池实例
+_pool: Optional[ApiKeyPool] = None
+
+
+def get_key_pool() -> ApiKeyPool:
+    """获取全局API密钥池"""
+    global _pool
+    if _pool is None:
+        _pool = ApiKeyPool()
+    return _pool
+
+
+def is_retryable(status_code: Optional[int]) -> bool:
+    """网络错误（无状态码）或密钥/上游相关的错误可以换密钥重试"""
+    return status_code is None or status_code in RETRYABLE_STATUS_CODES
@@ -0,0 +1,170 @@
+import os
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
+
+from db.models import QUESTION_STATUS_QUEUED, QUESTION_STATUS_RUNNING, QuestionRecord, Transaction, User
+
+# 加载环境变量
+load_dotenv()
+
+# 金额精度：4位小数，与数据库中的 Numeric(12, 4) 一致
+MONEY_QUANT = Decimal("0.0001")
+# 计费模式：reserve 调用上游前按预估费用冻结余额、完成后按实际费用结算；charge 完成后一次性扣费
+LEDGER_MODE = os.getenv("LEDGER_MODE", "reserve").lower()
+LEDGER_HOLD_TIMEOUT = float(os.getenv("LEDGER_HOLD_TIMEOUT", "600"))  # 超过该时间仍未结算的冻结视为进程异常退出遗留（秒）
+
+# 交易类型
+TRANSACTION_DEPOSIT = "deposit"
+TRANSACTION_CONSUMPTION = "consumption"
+TRANSACTION_HOLD = "hold"
+
+
+def to_money(value) -> Decimal:
+    """转换为4位小数的定点金额，浮点数先转为字符串避免二进制误差"""
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+
+class Hold:
+    """一笔已冻结、待结算的费用"""
+
+    def __init__(self, user_id: int, amount: Decimal, transaction_id: int):
+        self.user_id = user_id
+        self.amount = amount
+        self.transaction_id = transaction_id
+
+
+def consumption_row(user_id: int, amount, description: str = "提问消费") -> dict:
+    """消费流水的列值"""
+    return {"user_id": user_id, "amount": -to_money(amount), "transaction_type": TRANSACTION_CONSUMPTION, "description": description}
+
+
+# 以下函数都在调用方的事务中执行，对用户行的更新放在事务最后一步，缩短行锁的持有时间
+
+async def charge(db, user_id: int, amount, description: str = "提问消费", allow_overdraft: bool = False, record: bool = True) -> bool:
+    """余额充足时扣费并写入消费流水，余额不足返回False，由调用方回滚
+
+    allow_overdraft 用于内容已经交付给用户的情况（如流式输出），此时照常扣费，余额可能略低于0。
+    record 为False时不写流水，由调用方通过 consumption_row 交给写后落库队列。
+    """
+    amount = to_money(amount)
+    if record:
+        db.add(Transaction(**consumption_row(user_id, amount, description)))
+    if not amount:
+        return True
+    if record:
+        await db.flush()
+    # 单条条件UPDATE完成检查和扣减，并发请求不会基于过期余额互相覆盖，也不会扣成负数
+    statement = update(User).where(User.id == user_id)
+    if not allow_overdraft:
+        statement = statement.where(User.balance >= amount)
+    result = await db.execute(
+        statement.values(balance=User.balance - amount).execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def deposit(db, user_id: int, amount, description: str = "用户充值"):
+    """充值并写入充值流水"""
+    amount = to_money(amount)
+    db.add(Transaction(user_id=user_id, amount=amount, transaction_type=TRANSACTION_DEPOSIT, description=description))
+    await db.flush()
+    await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(balance=User.balance + amount)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reserve(db, user_id: int, amount, description: str = "提问预扣") -> Optional[Hold]:
+    """冻结预估费用并立即提交，余额不足返回None"""
+    amount = to_money(amount)
+    transaction = Transaction(user_id=user_id, amount=-amount, transaction_type=TRANSACTION_HOLD, description=description)
+    db.add(transaction)
+    await db.flush()
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id, User.balance >= amount)
+        .values(balance=User.balance - amount)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        return None
+    await db.commit()
+    return Hold(user_id, amount, transaction.id)
+
+
+async def settle(db, hold: Hold, amount, description: str = "提问消费"):
+    """按实际费用结算冻结：冻结流水转为消费流水，多冻结的部分退回余额
+
+    实际费用超过冻结金额时照常扣除超出部分（上游已经产生费用），余额可能因此略低于0。
+    """
+    amount = to_money(amount)
+    # 只结算仍处于冻结状态的流水，冻结已被超时清理退回时改为直接扣费
+    result = await db.execute(
+        update(Transaction)
+        .where(Transaction.id == hold.transaction_id, Transaction.transaction_type == TRANSACTION_HOLD)
+        .values(amount=-amount, transaction_type=TRANSACTION_CONSUMPTION, description=description)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.add(Transaction(user_id=hold.user_id, amount=-amount, transaction_type=TRANSACTION_CONSUMPTION, description=description))
+        await db.flush()
+        refund = -amount
+    else:
+        refund = hold.amount - amount
+    if refund:
+        await db.execute(
+            update(User)
+            .where(User.id == hold.user_id)
+            .values(balance=User.balance + refund)
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def release(db, hold: Hold) -> bool:
+    """调用失败时取消冻结并全额退回，冻结已结算或已退回时返回False"""
+    result = await db.execute(
+        delete(Transaction)
+        .where(Transaction.id == hold.transaction_id, Transaction.transaction_type == TRANSACTION_HOLD)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    await db.execute(
+        update(User)
+        .where(User.id == hold.user_id)
+        .values(balance=User.balance + hold.amount)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+async def release_stale_holds(db, older_than: float = LEDGER_HOLD_TIMEOUT) -> int:
+    """退回进程异常退出后遗留的冻结，返回退回的条数；仍在排队或执行的后台任务的冻结不退回"""
+    # 使用数据库时钟，与created_at的默认值保持同一时区
+    cutoff = await db.scalar(select(func.now())) - timedelta(seconds=older_than)
+    pending_jobs = select(QuestionRecord.hold_transaction_id).where(
+        QuestionRecord.status.in_((QUESTION_STATUS_QUEUED, QUESTION_STATUS_RUNNING)),
+        QuestionRecord.hold_transaction_id.isnot(None)
+    )
+    result = await db.execute(
+        select(Transaction.id, Transaction.user_id, Transaction.amount)
+        .where(
+            Transaction.transaction_type == TRANSACTION_HOLD,
+            Transaction.created_at < cutoff,
+            Transaction.id.notin_(pending_jobs)
+        )
+    )
+    released = 0
+    for transaction_id, user_id, amount in result.all():
+        released += await release(db, Hold(user_id, -to_money(amount), transaction_id))
+        await db.commit()
+    return released
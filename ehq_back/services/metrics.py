@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 指标配置
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # 抓取 /metrics 需携带的Bearer令牌，为空则不校验
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))  # 事件循环延迟的采样间隔（秒）
+# 在响应的Server-Timing头中返回各阶段耗时，用于调试；也可以按请求携带 X-Server-Timing: 1 开启
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+# 延迟直方图的桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 4000, 8000)
+
+# 当前请求的各阶段耗时：阶段 -> [累计秒数, 次数]，不需要Server-Timing时为None
+_request_timings: ContextVar[Optional[Dict[str, list]]] = ContextVar("request_timings", default=None)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+
+    kind = "gauge"
+
+    def set(self, *label_values, value: float):
+        self._values[label_values] = value
+
+
+class Histogram:
+    """按固定的桶统计分布，观测一次只需一次二分查找"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # 标签值 -> [各桶计数（不累计，最后一个为+Inf）, 总和]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        state = self._values.get(label_values)
+        if state is None:
+            state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self) -> Iterable[str]:
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, label_values + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}"
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按Prometheus文本格式输出
+
+    指标在事件循环线程中更新，不加锁；抓取时再调用各收集函数读取连接池、缓存等组件的当前状态。
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable):
+        """注册抓取时调用的收集函数，返回 (名称, 类型, 说明, 标签, 值) 的序列"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        described = set()
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                logger.exception("收集指标失败")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} {kind}")
+                label_names = tuple(labels)
+                lines.append(f"{name}{_format_labels(label_names, tuple(labels[n] for n in label_names))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.register(Histogram(
+    "ehq_http_request_duration_seconds", "HTTP请求耗时（流式响应到最后一个数据块为止）", ("method", "route", "status")
+))
+stage_duration = registry.register(Histogram(
+    "ehq_stage_duration_seconds", "请求处理各阶段的耗时", ("stage",)
+))
+upstream_duration = registry.register(Histogram(
+    "ehq_upstream_duration_seconds", "每次调用豆包API的耗时", ("api_key", "outcome")
+))
+upstream_tokens = registry.register(Histogram(
+    "ehq_upstream_tokens", "每次成功调用豆包API使用的token数", ("api_key",), buckets=TOKEN_BUCKETS
+))
+requests_cancelled = registry.register(Counter(
+    "ehq_requests_cancelled_total", "客户端断开或超过截止时间而提前结束的提问请求数", ("endpoint", "reason")
+))
+upstream_queue_wait = registry.register(Histogram(
+    "ehq_upstream_queue_wait_seconds", "上游并发已满时调用排队等待的时间", ("tier",)
+))
+upstream_queue_shed = registry.register(Counter(
+    "ehq_upstream_queue_shed_total", "排队已满而被拒绝的上游调用数", ("tier",)
+))
+write_behind_failures = registry.register(Counter(
+    "ehq_write_behind_failures_total", "写后落库批量写入失败的次数，以及停止服务时未写完的条目数", ("kind",)
+))
+question_type_duration = registry.register(Histogram(
+    "ehq_question_type_duration_seconds", "按题型统计的每次成功上游调用的耗时", ("type", "model_tier")
+))
+question_type_tokens = registry.register(Histogram(
+    "ehq_question_type_tokens", "按题型统计的每次成功上游调用使用的token数", ("type",), buckets=TOKEN_BUCKETS
+))
+question_type_cost = registry.register(Counter(
+    "ehq_question_type_cost_total", "按题型统计的上游调用按原价折算的费用（元）", ("type",)
+))
+event_loop_lag = registry.register(Histogram(
+    "ehq_event_loop_lag_seconds", "事件循环定时任务的实际唤醒延迟"
+))
+
+
+def record_stage(stage: str, seconds: float):
+    """记录一个阶段的耗时，开启Server-Timing时同时计入当前请求"""
+    if not METRICS_ENABLED:
+        return
+    stage_duration.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.get(stage)
+        if entry is None:
+            timings[stage] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+@contextmanager
+def timed(stage: str):
+    """统计代码块的耗时，可以包含await"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_upstream_call(api_key_name: str, seconds: float, success: bool, tokens_used: int = 0):
+    """记录一次上游调用的耗时和token数"""
+    if not METRICS_ENABLED:
+        return
+    upstream_duration.observe(seconds, api_key_name, "success" if success else "error")
+    if success:
+        upstream_tokens.observe(tokens_used, api_key_name)
+    record_stage("upstream", seconds)
+
+
+def record_cancelled(endpoint: str, reason: str):
+    """记录一次提前结束的请求，reason为 disconnect 或 deadline"""
+    if METRICS_ENABLED:
+        requests_cancelled.inc(endpoint, reason)
+
+
+def record_queue_wait(tier: str, seconds: float):
+    """记录一次上游调用的排队时间"""
+    if not METRICS_ENABLED:
+        return
+    upstream_queue_wait.observe(seconds, tier)
+    record_stage("queue", seconds)
+
+
+def record_queue_shed(tier: str):
+    """记录一次因排队已满被拒绝的上游调用"""
+    if METRICS_ENABLED:
+        upstream_queue_shed.inc(tier)
+
+
+def record_write_behind_failure(kind: str, amount: int = 1):
+    """记录写后落库的失败：kind为 batch（一次批量写入失败）或 unflushed（停止时未写完的条目数）"""
+    if METRICS_ENABLED:
+        write_behind_failures.inc(kind, amount=amount)
+
+
+def record_question_type(question_type: str, model_tier: str, seconds: float, tokens_used: int, cost: float):
+    """记录一次成功上游调用所属题型的耗时、token数和费用"""
+    if not METRICS_ENABLED:
+        return
+    question_type_duration.observe(seconds, question_type, model_tier)
+    question_type_tokens.observe(tokens_used, question_type)
+    question_type_cost.inc(question_type, amount=cost)
+
+
+def instrument_engine(engine):
+    """统计SQL语句的执行耗时；异步引擎传入其 sync_engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_stage("db", time.perf_counter() - conn.info["query_start"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
+
+
+def _format_server_timing(timings: Dict[str, list], total: float) -> bytes:
+    parts = [f"{stage};dur={seconds * 1000:.2f}" + (f';desc="{count}x"' if count > 1 else "") for stage, (seconds, count) in timings.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """ASGI中间件：按路由模板统计请求耗时，按需返回Server-Timing头
+
+    直接实现ASGI接口而不是继承BaseHTTPMiddleware，不会缓冲流式响应，开销也更小。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Optional[Dict[int, str]] = None
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            # 用路由模板而不是实际路径作为标签，避免路径参数导致标签数量无限增长
+            self._route_paths = {id(route.endpoint): route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        return self._route_paths.get(id(endpoint), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        server_timing = SERVER_TIMING_ENABLED or any(
+            name == b"x-server-timing" and value == b"1" for name, value in scope["headers"]
+        )
+        timings = {} if server_timing else None
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if timings is not None:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _format_server_timing(timings, time.perf_counter() - start)))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], self._route_path(scope), status_code)
+
+
+async def monitor_event_loop_lag(interval: float = METRICS_LOOP_LAG_INTERVAL):
+    """定期睡眠固定时间，实际唤醒时间超出的部分即事件循环被阻塞的时间"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, time.perf_counter() - start - interval))
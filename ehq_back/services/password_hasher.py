@@ -0,0 +1,65 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from db.models import pwd_context
+
+# 加载环境变量
+load_dotenv()
+
+# 密码哈希配置
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))  # 执行bcrypt的线程数
+LOGIN_MAX_CONCURRENCY = int(os.getenv("LOGIN_MAX_CONCURRENCY", "16"))  # 同时进行哈希计算的登录/注册请求上限
+LOGIN_QUEUE_TIMEOUT = float(os.getenv("LOGIN_QUEUE_TIMEOUT", "10"))  # 排队超过该时间返回503（秒）
+
+# bcrypt在计算时会释放GIL，放到线程池中执行即可避免阻塞事件循环
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _executor
+
+
+def shutdown_password_hasher():
+    """关闭哈希线程池"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+async def _run_limited(func, *args):
+    """在哈希线程池中执行，并发数超过上限时排队，排队超时返回503"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LOGIN_MAX_CONCURRENCY)
+    try:
+        await asyncio.wait_for(_semaphore.acquire(), LOGIN_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login requests, please retry later",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _semaphore.release()
+
+
+async def hash_password(password: str) -> str:
+    """计算密码哈希"""
+    return await _run_limited(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """校验密码，返回 (是否正确, 新哈希)；哈希使用的cost与当前配置不同时新哈希不为None，应写回数据库"""
+    return await _run_limited(pwd_context.verify_and_update, password, hashed_password)
@@ -0,0 +1,240 @@
+import os
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+from services.metrics import record_question_type
+
+# 加载环境变量
+load_dotenv()
+
+# 模型和解答长度配置
+DOUBAO_MODEL = os.getenv("DOUBAO_MODEL", "doubao-model")  # 替换为实际的豆包模型名称
+DOUBAO_MODEL_LITE = os.getenv("DOUBAO_MODEL_LITE", DOUBAO_MODEL)  # 简短题型使用的更便宜、更快的模型，默认与DOUBAO_MODEL相同
+DOUBAO_MAX_TOKENS = int(os.getenv("DOUBAO_MAX_TOKENS", "2000"))  # 每次解答最多生成的token数
+
+# 题型路由配置：按本地识别的题型选择提示词模板、max_tokens和模型等级；关闭时所有题目使用通用模板
+QUESTION_ROUTING_ENABLED = os.getenv("QUESTION_ROUTING_ENABLED", "true").lower() == "true"
+# 各题型的max_tokens，未配置的题型使用DOUBAO_MAX_TOKENS
+QUESTION_TYPE_MAX_TOKENS = os.getenv("QUESTION_TYPE_MAX_TOKENS", "choice:600,cloze:1200,correction:1200,reading:1500")
+# 各题型的模型等级（lite 使用DOUBAO_MODEL_LITE，pro 使用DOUBAO_MODEL），未配置的题型为pro
+QUESTION_TYPE_MODEL_TIERS = os.getenv("QUESTION_TYPE_MODEL_TIERS", "choice:lite,cloze:lite")
+QUESTION_TYPE_LATENCY_WINDOW = int(os.getenv("QUESTION_TYPE_LATENCY_WINDOW", "200"))  # 每个题型保留最近多少次上游调用的耗时
+
+# 提示词模板版本，通用模板变更时需同时更新，答案缓存随之失效
+PROMPT_TEMPLATE_VERSION = "v1"
+
+# 系统提示词和通用题目模板
+SYSTEM_PROMPT = "你是一位专业的英语教师，擅长解答各类英语题目并提供详细解析。"
+PROMPT_TEMPLATE = """请你作为一位专业的英语教师，解答以下英语题目。请提供详细的解析，包括语法分析、词汇解释和答案推导过程。
+
+题目：{question}
+
+请按照以下格式回答：
+1. 题目分析
+2. 解题思路
+3. 详细解答
+4. 正确答案
+5. 相关知识点扩展"""
+
+# 各题型的提示词模板和版本，修改模板时需同时更新对应的版本
+QUESTION_TEMPLATES = {
+    "choice": ("v1", """请解答以下英语单项选择或单句填空题。先给出正确答案，再用两三句话说明理由（涉及的语法点或词义辨析），不要展开与本题无关的知识点。
+
+题目：{question}
+
+请按照以下格式回答：
+1. 正确答案
+2. 简要解析"""),
+    "cloze": ("v1", """请解答以下英语完形填空或语法填空题。逐空给出答案，每空用一句话说明依据（上下文线索、固定搭配或语法规则）。
+
+题目：{question}
+
+请按照以下格式回答：
+1. 答案汇总
+2. 逐空解析"""),
+    "correction": ("v1", """请找出并改正以下内容中的语法和用词错误。逐处指出原文、改正后的写法和错误原因。
+
+题目：{question}
+
+请按照以下格式回答：
+1. 逐处改错
+2. 改正后的全文"""),
+    "reading": ("v1", """请阅读以下材料并回答其中的问题。每道题给出答案，并指出文章中支持该答案的句子，必要时解释关键词汇。
+
+题目：{question}
+
+请按照以下格式回答：
+1. 文章大意
+2. 逐题答案与依据"""),
+    "writing": ("v1", """请根据以下写作要求，给出写作思路和一篇范文。范文需符合题目要求的体裁和字数，之后列出文中值得学习的句型和词汇。
+
+题目：{question}
+
+请按照以下格式回答：
+1. 审题与写作思路
+2. 范文
+3. 亮点句型与词汇"""),
+    "general": (PROMPT_TEMPLATE_VERSION, PROMPT_TEMPLATE),
+}
+QUESTION_TYPES = tuple(QUESTION_TEMPLATES)
+
+# 题型识别用的特征
+_writing_re = re.compile(
+    r"作文|书面表达|写作|写一(篇|封)|不少于\s*\d+\s*(个)?(词|字|单词)|词数"
+    r"|\bwrite\s+(an?\s+)?(\w+\s+)?(letter|composition|essay|passage|article|e-?mail|story|speech|notice|diary)\b"
+    r"|\b(at\s+least|about|no\s+less\s+than)\s+\d+\s+words\b",
+    re.I
+)
+_correction_re = re.compile(r"改错|改正|纠错|找出.{0,8}错误|\d+\s*处(语言)?错误|\bcorrect\s+(the\s+|all\s+)?(mistakes?|errors?)\b|\bfind\s+(out\s+)?(the\s+)?(mistakes?|errors?)\b|\bproofread", re.I)
+_reading_re = re.compile(r"阅读理解|阅读(下面|下列|以下)|\bread\s+the\s+(following\s+)?(passage|text|article)\b|\baccording\s+to\s+the\s+(passage|text|article)\b|\bmain\s+idea\b|\bbest\s+title\b", re.I)
+_cloze_re = re.compile(r"完形填空|语法填空|完型填空|(所给|括号内)(单)?词的(适当|正确)形式|\bcloze\b|\bfill\s+in\s+the\s+blanks\b", re.I)
+# 选项标记："A." "B、" "C)" "(D)" 等，统计出现了几个不同的字母
+_option_re = re.compile(r"(?:^|[\s(（])([A-Da-d])\s*[.．、)）:]|[(（]([A-Da-d])[)）]")
+# 空格："___"、空括号，以及 "__1__" "(1)____" 这类编号的空
+_blank_re = re.compile(r"_{2,}\s*\d{0,2}\s*_*|[(（]\s*[)）]")
+_numbered_blank_re = re.compile(r"_+\s*\d{1,2}\s*_+|[(（]\d{1,2}[)）]\s*_+|\d{1,2}\s*[.．]\s*_{2,}")
+_word_re = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+
+# 超过这个英文单词数的材料按篇章处理（阅读、完形），而不是单句题
+PASSAGE_MIN_WORDS = 120
+
+
+def _parse_table(text: str) -> Dict[str, str]:
+    table = {}
+    for item in text.split(","):
+        if ":" in item:
+            key, value = item.split(":", 1)
+            table[key.strip()] = value.strip()
+    return table
+
+
+@lru_cache(maxsize=8192)
+def classify_question(question: str) -> str:
+    """按关键词、选项、空格和篇幅识别题型：choice（单选/单句填空）、cloze（完形/语法填空）、correction（改错）、
+    reading（阅读理解）、writing（写作），都不像时为general
+
+    只用正则和简单的计数，单次耗时约0.1毫秒，结果按题目缓存。
+    """
+    words = len(_word_re.findall(question))
+    options = {(a or b).upper() for a, b in _option_re.findall(question)}
+    blanks = len(_blank_re.findall(question))
+    numbered_blanks = len(_numbered_blank_re.findall(question))
+
+    # 改错和写作的题干特征最明确，先判断；改错题的题干常提到“作文”，所以先判断改错
+    if _correction_re.search(question) and len(options) < 2:
+        return "correction"
+    if _writing_re.search(question) and len(options) < 2:
+        return "writing"
+    if _cloze_re.search(question) or numbered_blanks >= 3 or (blanks >= 3 and words >= PASSAGE_MIN_WORDS):
+        return "cloze"
+    if _reading_re.search(question) or (words >= PASSAGE_MIN_WORDS and len(options) >= 2):
+        return "reading"
+    if len(options) >= 2 or 1 <= blanks <= 2:
+        return "choice"
+    return "general"
+
+
+class QuestionProfile:
+    """一种题型的调用配置：提示词模板、max_tokens和模型"""
+
+    def __init__(self, question_type: str, template_version: str, template: str, max_tokens: int, model_tier: str):
+        self.question_type = question_type
+        # 通用模板沿用原来的版本号，关闭路由时答案缓存键不变
+        self.template_version = template_version if question_type == "general" else f"{question_type}-{template_version}"
+        self.template = template
+        self.max_tokens = max_tokens
+        self.model_tier = model_tier
+        self.model = DOUBAO_MODEL_LITE if model_tier == "lite" else DOUBAO_MODEL
+
+    def to_dict(self) -> dict:
+        return {
+            "template_version": self.template_version,
+            "max_tokens": self.max_tokens,
+            "model_tier": self.model_tier,
+            "model": self.model
+        }
+
+
+def _build_profiles() -> Dict[str, QuestionProfile]:
+    max_tokens = _parse_table(QUESTION_TYPE_MAX_TOKENS)
+    tiers = _parse_table(QUESTION_TYPE_MODEL_TIERS)
+    return {
+        question_type: QuestionProfile(
+            question_type, version, template,
+            int(max_tokens.get(question_type, DOUBAO_MAX_TOKENS)),
+            tiers.get(question_type, "pro")
+        )
+        for question_type, (version, template) in QUESTION_TEMPLATES.items()
+    }
+
+
+PROFILES = _build_profiles()
+
+
+def question_profile(question: str) -> QuestionProfile:
+    """题目对应的调用配置，关闭路由时总是通用配置"""
+    if not QUESTION_ROUTING_ENABLED:
+        return PROFILES["general"]
+    return PROFILES[classify_question(question)]
+
+
+class QuestionTypeStats:
+    """按题型统计上游调用的次数、token数、费用、截断次数和最近的耗时"""
+
+    def __init__(self, window: int = QUESTION_TYPE_LATENCY_WINDOW):
+        self.window = window
+        self.totals: Dict[str, dict] = {}
+        self.latencies: Dict[str, Deque[float]] = {}
+
+    def record(self, question_type: str, seconds: float, tokens_used: int, cost, truncated: bool):
+        totals = self.totals.get(question_type)
+        if totals is None:
+            totals = self.totals[question_type] = {"calls": 0, "tokens": 0, "cost": 0.0, "truncated": 0}
+            self.latencies[question_type] = deque(maxlen=self.window)
+        totals["calls"] += 1
+        totals["tokens"] += tokens_used
+        totals["cost"] += float(cost)
+        totals["truncated"] += int(truncated)
+        self.latencies[question_type].append(seconds)
+        record_question_type(question_type, PROFILES[question_type].model_tier, seconds, tokens_used, float(cost))
+
+    @staticmethod
+    def _quantile(samples, q: float) -> Optional[float]:
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> dict:
+        types = {}
+        for question_type, profile in PROFILES.items():
+            totals = self.totals.get(question_type, {"calls": 0, "tokens": 0, "cost": 0.0, "truncated": 0})
+            latencies = self.latencies.get(question_type, ())
+            calls = totals["calls"]
+            types[question_type] = dict(
+                profile.to_dict(),
+                calls=calls,
+                avg_tokens=totals["tokens"] / calls if calls else None,
+                avg_cost=totals["cost"] / calls if calls else None,
+                total_cost=totals["cost"],
+                truncated=totals["truncated"],
+                latency_p50=self._quantile(latencies, 0.5),
+                latency_p90=self._quantile(latencies, 0.9)
+            )
+        return {"enabled": QUESTION_ROUTING_ENABLED, "types": types}
+
+
+# 全局题型统计
+_stats: Optional[QuestionTypeStats] = None
+
+
+def get_question_type_stats() -> QuestionTypeStats:
+    """获取全局题型统计"""
+    global _stats
+    if _stats is None:
+        _stats = QuestionTypeStats()
+    return _stats
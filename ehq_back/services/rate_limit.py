@@ -0,0 +1,213 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+# 加载环境变量
+load_dotenv()
+
+# 限流配置，格式为 "次数/秒数"，如 "10/60" 表示每60秒10次、突发上限10次；为空或0表示不限
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_STORE_PATH = os.getenv("RATE_LIMIT_STORE_PATH", "")  # 多worker共享的SQLite状态文件，为空则使用进程内存
+RATE_LIMIT_DEFAULTS = {
+    "ASK_USER": "10/60",
+    "ASK_GLOBAL": "600/60",
+    # 批量提问按题目数消耗令牌
+    "ASK_BATCH_USER": "100/600",
+    "ASK_BATCH_GLOBAL": "3000/60",
+}
+# 每个上游API密钥的每分钟请求数和每分钟token数，与服务商的RPM/TPM配额保持一致
+RATE_LIMIT_KEY_RPM = int(os.getenv("RATE_LIMIT_KEY_RPM", "60"))
+RATE_LIMIT_KEY_TPM = int(os.getenv("RATE_LIMIT_KEY_TPM", "100000"))
+
+
+def parse_limit(value: str) -> Optional[Tuple[float, float]]:
+    """解析 "次数/秒数" 格式的限流配置，返回 (桶容量, 每秒补充量)"""
+    if not value or value.strip() == "0":
+        return None
+    count, _, period = value.partition("/")
+    capacity = float(count)
+    return capacity, capacity / float(period or 1)
+
+
+def endpoint_limit(endpoint: str, scope: str) -> Optional[Tuple[float, float]]:
+    """读取某个接口在 user/global 维度上的限流配置"""
+    name = f"{endpoint}_{scope}".upper()
+    return parse_limit(os.getenv(f"RATE_LIMIT_{name}", RATE_LIMIT_DEFAULTS.get(name, "")))
+
+
+class KeysThrottled(Exception):
+    """所有可用的API密钥都已用尽RPM/TPM配额，retry_after为最早恢复配额的等待秒数"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"All API keys are rate limited. Retry after {math.ceil(retry_after)} seconds.")
+        self.retry_after = retry_after
+
+
+def _refill(tokens: float, updated_at: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+class MemoryBucketStore:
+    """进程内令牌桶状态"""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    async def take(self, buckets: List[Tuple[str, float, float]], cost: float = 1, allow_debt: bool = False):
+        """buckets为 [(键, 桶容量, 每秒补充量)]，所有桶都有cost个令牌时才一起扣除，返回 (是否允许, 各桶剩余令牌数)；
+        allow_debt为True时总是扣除，余额可为负"""
+        now = time.time()
+        with self._lock:
+            tokens = [
+                _refill(*self._buckets.get(key, (capacity, now)), now, capacity, rate)
+                for key, capacity, rate in buckets
+            ]
+            allowed = allow_debt or all(left >= cost for left in tokens)
+            if allowed:
+                tokens = [left - cost for left in tokens]
+            for (key, _, _), left in zip(buckets, tokens):
+                self._buckets[key] = (left, now)
+        return allowed, tokens
+
+
+class SQLiteBucketStore:
+    """基于SQLite文件的令牌桶状态，供同一主机上的多个uvicorn worker共享"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    async def take(self, buckets: List[Tuple[str, float, float]], cost: float = 1, allow_debt: bool = False):
+        # 等待其他worker释放写锁最多阻塞5秒，放到线程池执行，不阻塞事件循环
+        return await run_in_threadpool(self._take, buckets, cost, allow_debt)
+
+    def _take(self, buckets: List[Tuple[str, float, float]], cost: float, allow_debt: bool):
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE 取得写锁，保证跨进程的读-改-写是原子的
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens = []
+                for key, capacity, rate in buckets:
+                    row = self._conn.execute(
+                        "SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?", (key,)
+                    ).fetchone()
+                    tokens.append(_refill(row[0], row[1], now, capacity, rate) if row else capacity)
+                allowed = allow_debt or all(left >= cost for left in tokens)
+                if allowed:
+                    tokens = [left - cost for left in tokens]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    [(key, left, now) for (key, _, _), left in zip(buckets, tokens)]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return allowed, tokens
+
+
+class RateLimiter:
+    """按用户、全局和上游API密钥维度的令牌桶限流"""
+
+    def __init__(self, store):
+        self.store = store
+        self.throttled = Counter()  # (维度, 名称) -> 被限流次数
+
+    async def check(self, name: str, checks: List[Tuple[str, str, Optional[Tuple[float, float]]]], cost: float = 1) -> float:
+        """checks为 [(维度, 键, 限流配置)]，所有桶都有余量时才一起消耗令牌，允许时返回0，
+        被限流时不扣除任何桶，返回建议的重试等待秒数"""
+        checks = [(scope, key, limit) for scope, key, limit in checks if limit is not None]
+        if not checks:
+            return 0.0
+        allowed, tokens = await self.store.take(
+            [(f"{name}:{scope}:{key}", capacity, rate) for scope, key, (capacity, rate) in checks], cost
+        )
+        if allowed:
+            return 0.0
+        retry_after = 0.0
+        for (scope, _, (_, rate)), left in zip(checks, tokens):
+            if left < cost:
+                self.throttled[(scope, name)] += 1
+                retry_after = max(retry_after, (cost - left) / rate)
+        return retry_after
+
+    async def acquire_key(self, api_key_id: int) -> float:
+        """调用上游前检查API密钥的RPM和TPM配额，RPM消耗一次，TPM只检查是否还有余量；
+        允许时返回0，配额用尽时返回配额恢复前的等待秒数"""
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        if RATE_LIMIT_KEY_TPM > 0:
+            rate = RATE_LIMIT_KEY_TPM / 60
+            _, (tokens,) = await self.store.take([(f"api_key:tpm:{api_key_id}", RATE_LIMIT_KEY_TPM, rate)], 0)
+            if tokens <= 0:
+                self.throttled[("api_key", "tpm")] += 1
+                return (1 - tokens) / rate
+        if RATE_LIMIT_KEY_RPM > 0:
+            rate = RATE_LIMIT_KEY_RPM / 60
+            allowed, (tokens,) = await self.store.take([(f"api_key:rpm:{api_key_id}", RATE_LIMIT_KEY_RPM, rate)])
+            if not allowed:
+                self.throttled[("api_key", "rpm")] += 1
+                return (1 - tokens) / rate
+        return 0.0
+
+    async def key_retry_after(self, api_key_id: int) -> float:
+        """只检查不消耗：API密钥的RPM和TPM配额都有余量时返回0，否则返回配额恢复前的等待秒数"""
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        wait = 0.0
+        if RATE_LIMIT_KEY_TPM > 0:
+            rate = RATE_LIMIT_KEY_TPM / 60
+            _, (tokens,) = await self.store.take([(f"api_key:tpm:{api_key_id}", RATE_LIMIT_KEY_TPM, rate)], 0)
+            if tokens <= 0:
+                wait = (1 - tokens) / rate
+        if RATE_LIMIT_KEY_RPM > 0:
+            rate = RATE_LIMIT_KEY_RPM / 60
+            _, (tokens,) = await self.store.take([(f"api_key:rpm:{api_key_id}", RATE_LIMIT_KEY_RPM, rate)], 0)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+        return wait
+
+    def record_keys_throttled(self):
+        """所有密钥都被限流、请求返回429时计数"""
+        self.throttled[("api_key", "all_keys")] += 1
+
+    async def consume_key_tokens(self, api_key_id: int, tokens_used: int):
+        """调用完成后按实际使用的token数扣减密钥的TPM配额，允许透支"""
+        if RATE_LIMIT_ENABLED and RATE_LIMIT_KEY_TPM > 0 and tokens_used:
+            await self.store.take([(f"api_key:tpm:{api_key_id}", RATE_LIMIT_KEY_TPM, RATE_LIMIT_KEY_TPM / 60)], tokens_used, allow_debt=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "shared_store": isinstance(self.store, SQLiteBucketStore),
+            "throttled": [
+                {"scope": scope, "name": name, "count": count}
+                for (scope, name), count in sorted(self.throttled.items())
+            ],
+        }
+
+
+# 全局限流器实例
+_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """获取全局限流器"""
+    global _limiter
+    if _limiter is None:
+        store = SQLiteBucketStore(RATE_LIMIT_STORE_PATH) if RATE_LIMIT_STORE_PATH else MemoryBucketStore()
+        _limiter = RateLimiter(store)
+    return _limiter
@@ -0,0 +1,222 @@
+import logging
+import os
+import pickle
+import re
+import zlib
+from array import array
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.answer_cache import normalize_question
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 相似题目索引配置
+SIMILARITY_INDEX_ENABLED = os.getenv("SIMILARITY_INDEX_ENABLED", "true").lower() == "true"
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.9"))  # 估计Jaccard相似度阈值
+SIMILARITY_SHINGLE_SIZE = int(os.getenv("SIMILARITY_SHINGLE_SIZE", "4"))  # 字符shingle长度
+SIMILARITY_BANDS = int(os.getenv("SIMILARITY_BANDS", "6"))  # LSH分带数
+SIMILARITY_ROWS = int(os.getenv("SIMILARITY_ROWS", "6"))  # 每个分带的签名行数
+SIMILARITY_MIN_LENGTH = int(os.getenv("SIMILARITY_MIN_LENGTH", "20"))  # 过短的题目不做近似匹配
+SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", "")  # 离线构建的索引文件路径
+
+# 选项标号，如 "A." "(B)" "C、"，重排选项时这些标号会变化
+_option_label_re = re.compile(r"(?:(?<=\s)|^)[\(（]?([A-Da-d])[\.\)）、:：]")
+
+_EMPTY = 0xFFFF
+
+# 索引文件格式版本，旧版本的文件需要重新构建
+INDEX_FORMAT_VERSION = 2
+
+
+def shingle_text(question: str) -> str:
+    """去掉选项标号后规范化题目，空白标记和标点会在规范化时统一去除"""
+    return normalize_question(_option_label_re.sub(" ", question))
+
+
+def option_key(question: str) -> Optional[int]:
+    """选项标号与选项内容的对应关系的哈希，没有选项时为None
+
+    签名忽略选项标号，选项重排后的题目签名几乎相同，但解答中的答案字母已经不对，
+    所以有选项的题目还要求对应关系完全一致。
+    """
+    labels = list(_option_label_re.finditer(question))
+    if len(labels) < 2:
+        return None
+    options = []
+    for i, label in enumerate(labels):
+        end = labels[i + 1].start() if i + 1 < len(labels) else len(question)
+        options.append(f"{label.group(1).upper()}\x1f{normalize_question(question[label.end():end])}")
+    return zlib.crc32("\x1e".join(sorted(options)).encode("utf-8"))
+
+
+class SimilarityIndex:
+    """基于MinHash/LSH的近似重复题目索引
+
+    使用单次哈希的MinHash（one permutation hashing）：每个shingle只计算一次哈希，
+    按哈希值分桶取最小值，再对空桶做旋转填充，查询时的签名计算与分桶数无关。
+    """
+
+    def __init__(self, shingle_size: int = SIMILARITY_SHINGLE_SIZE, bands: int = SIMILARITY_BANDS, rows: int = SIMILARITY_ROWS):
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = rows
+        self.num_bins = bands * rows
+        self.signatures: Dict[int, array] = {}  # 记录ID -> 签名
+        self.buckets: Dict[int, object] = {}  # 分带键 -> 记录ID 或 记录ID列表
+        self.option_keys: Dict[int, int] = {}  # 有选项的记录ID -> 选项对应关系的哈希
+        self.max_id = 0
+
+    def signature(self, text: str) -> Optional[array]:
+        k = self.shingle_size
+        if len(text) < SIMILARITY_MIN_LENGTH:
+            return None
+        num_bins = self.num_bins
+        sig = [_EMPTY] * num_bins
+        crc32 = zlib.crc32
+        for sh in {text[i:i + k] for i in range(len(text) - k + 1)}:
+            # 乘法散列打散crc32的输出，高位决定分桶，低位作为桶内取值
+            h = (crc32(sh.encode("utf-8")) * 0x9E3779B1) & 0xFFFFFFFF
+            b = (h * num_bins) >> 32
+            v = h & 0xFFFE
+            if v < sig[b]:
+                sig[b] = v
+        # 空桶取右侧最近非空桶的值并按距离偏移
+        for i in range(num_bins):
+            if sig[i] != _EMPTY:
+                continue
+            for d in range(1, num_bins):
+                v = sig[(i + d) % num_bins]
+                if v != _EMPTY and v < 0xFFFE:
+                    sig[i] = (v + d * 0x9E37) & 0xFFFE
+                    break
+        return array("H", sig)
+
+    def _band_keys(self, sig: array):
+        rows = self.rows
+        return [hash((band, tuple(sig[band * rows:(band + 1) * rows]))) for band in range(self.bands)]
+
+    def add(self, record_id: int, question: str):
+        """加入一条题目记录"""
+        sig = self.signature(shingle_text(question))
+        if sig is None or record_id in self.signatures:
+            return
+        self.signatures[record_id] = sig
+        options = option_key(question)
+        if options is not None:
+            self.option_keys[record_id] = options
+        for key in self._band_keys(sig):
+            existing = self.buckets.get(key)
+            if existing is None:
+                self.buckets[key] = record_id
+            elif isinstance(existing, list):
+                existing.append(record_id)
+            else:
+                self.buckets[key] = [existing, record_id]
+        if record_id > self.max_id:
+            self.max_id = record_id
+
+    def lookup(self, question: str, threshold: float = SIMILARITY_THRESHOLD) -> Optional[Tuple[int, float]]:
+        """查找最相似的历史记录，返回 (记录ID, 估计相似度)，低于阈值或选项对应关系不同时返回None"""
+        sig = self.signature(shingle_text(question))
+        if sig is None:
+            return None
+        options = option_key(question)
+        candidates = set()
+        for key in self._band_keys(sig):
+            found = self.buckets.get(key)
+            if found is None:
+                continue
+            if isinstance(found, list):
+                candidates.update(found)
+            else:
+                candidates.add(found)
+
+        best = None
+        num_bins = self.num_bins
+        for record_id in candidates:
+            if self.option_keys.get(record_id) != options:
+                continue
+            other = self.signatures[record_id]
+            score = sum(1 for a, b in zip(sig, other) if a == b) / num_bins
+            # 相似度相同时取最新的记录
+            if score >= threshold and (best is None or (score, record_id) > (best[1], best[0])):
+                best = (record_id, score)
+        return best
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def build_from_db(self, db, batch_size: int = 5000):
+        """从数据库增量加载ID大于max_id的完整解答记录，返回新加入的条数；
+        被截断、中途断开的解答和没有完成情况的旧记录不加入索引"""
+        from db.models import QuestionRecord, FINISH_REASON_STOP
+
+        added = 0
+        while True:
+            rows = (
+                db.query(QuestionRecord.id, QuestionRecord.question)
+                .filter(
+                    QuestionRecord.id > self.max_id,
+                    QuestionRecord.finish_reason == FINISH_REASON_STOP,
+                    QuestionRecord.answer.isnot(None)
+                )
+                .order_by(QuestionRecord.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                return added
+            for record_id, question in rows:
+                self.add(record_id, question or "")
+                added += 1
+            # 过短的题目不会推进max_id，这里按批次推进
+            self.max_id = max(self.max_id, rows[-1][0])
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump({
+                "version": INDEX_FORMAT_VERSION,
+                "params": (self.shingle_size, self.bands, self.rows),
+                "max_id": self.max_id,
+                "signatures": self.signatures,
+                "buckets": self.buckets,
+                "option_keys": self.option_keys,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> "SimilarityIndex":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"索引文件格式版本为 {data.get('version')}，需要 {INDEX_FORMAT_VERSION}，请重新构建")
+        index = cls(*data["params"])
+        index.max_id = data["max_id"]
+        index.signatures = data["signatures"]
+        index.buckets = data["buckets"]
+        index.option_keys = data["option_keys"]
+        return index
+
+
+# 全局索引实例
+_index: Optional[SimilarityIndex] = None
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """获取全局相似题目索引，存在离线索引文件时从文件加载"""
+    global _index
+    if _index is None:
+        if SIMILARITY_INDEX_PATH and os.path.exists(SIMILARITY_INDEX_PATH):
+            try:
+                _index = SimilarityIndex.load(SIMILARITY_INDEX_PATH)
+            except ValueError as e:
+                # 旧格式的索引文件不再使用，启动时从数据库重新加载全部记录
+                logger.warning("忽略相似题目索引文件 %s：%s", SIMILARITY_INDEX_PATH, e)
+                _index = SimilarityIndex()
+        else:
+            _index = SimilarityIndex()
+    return _index
@@ -0,0 +1,210 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.deadline import DeadlineExceeded, remaining
+
+# 加载环境变量
+load_dotenv()
+
+# 合并相同题目的并发请求，只调用一次上游
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+def _consume_exception(task: asyncio.Task):
+    # 所有等待者都已取消时，避免事件循环报告"异常未被获取"
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    """合并相同键的并发调用：第一个请求发起调用，其余请求等待并共享同一结果
+
+    调用在独立的任务中执行，发起调用的请求被取消（客户端断开）时，其他等待者不受影响；
+    所有等待者都被取消后才取消调用本身，释放上游的并发配额。
+    """
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """执行调用或加入进行中的相同调用，返回 (结果, 是否为共享结果)"""
+        task = self._flights.get(key) if self.enabled else None
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.create_task(func())
+            if self.enabled:
+                self._flights[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            self._leave(task)
+
+    def _leave(self, task: asyncio.Task):
+        waiters = self._waiters.pop(task) - 1
+        if waiters:
+            self._waiters[task] = waiters
+        elif not task.done():
+            # 最后一个等待者被取消（客户端断开或超过截止时间），不再需要这次调用
+            self.cancelled += 1
+            task.cancel()
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        _consume_exception(task)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+            "cancelled": self.cancelled,
+            "in_flight": len(self._flights),
+        }
+
+
+class StreamFlight:
+    """一次上游流式调用的输出，多个请求订阅同一份增量内容"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.usage_tokens: Optional[int] = None
+        self.error: Optional[str] = None
+        self.completed = False
+        self.finish_reason: Optional[str] = None  # 上游返回的结束原因，length表示被截断
+        self.api_key_id: Optional[int] = None
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._index_claimed = False
+        self._changed = asyncio.Condition()
+
+    async def publish(self, content: str):
+        self.parts.append(content)
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def finish(self):
+        self.done = True
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def follow(self):
+        """从头依次产出增量内容，直到上游调用结束；晚加入的订阅者会先收到已生成的部分
+
+        超过当前请求的截止时间时抛出DeadlineExceeded。
+        """
+        index = 0
+        while True:
+            while index < len(self.parts):
+                yield self.parts[index]
+                index += 1
+            if self.done:
+                return
+            try:
+                async with self._changed:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: index < len(self.parts) or self.done), remaining())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded()
+
+    async def wait_started(self, timeout: Optional[float]):
+        """等待第一段内容或调用结束，最多等待timeout秒"""
+        try:
+            async with self._changed:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.parts or self.done), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def claim_index(self) -> bool:
+        """完整解答只由第一个保存的订阅者加入相似题目索引"""
+        if self._index_claimed:
+            return False
+        self._index_claimed = True
+        return True
+
+
+class StreamFlightGroup:
+    """合并相同键的并发流式调用"""
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[str, StreamFlight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def join(self, key: str, produce: Callable[[StreamFlight], Awaitable[None]]) -> Tuple[StreamFlight, bool]:
+        """订阅进行中的相同调用，没有时创建并启动新的调用，返回 (调用, 是否为共享调用)"""
+        flight = self._flights.get(key) if self.enabled else None
+        shared = flight is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            flight = StreamFlight()
+            flight.task = asyncio.create_task(self._run(key, flight, produce))
+            if self.enabled:
+                self._flights[key] = flight
+        flight.subscribers += 1
+        return flight, shared
+
+    async def _run(self, key: str, flight: StreamFlight, produce: Callable[[StreamFlight], Awaitable[None]]):
+        try:
+            await produce(flight)
+        finally:
+            # 调用结束后新的请求不再加入，改为走答案缓存
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            await flight.finish()
+
+    def leave(self, flight: StreamFlight):
+        """取消订阅；所有订阅者都已离开时取消上游调用"""
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done and flight.task is not None:
+            self.cancelled += 1
+            flight.task.cancel()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+            "cancelled": self.cancelled,
+            "in_flight": len(self._flights),
+        }
+
+
+# 全局实例
+_single_flight: Optional[SingleFlight] = None
+_stream_flights: Optional[StreamFlightGroup] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """获取合并普通提问的全局实例"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
+
+
+def get_stream_flights() -> StreamFlightGroup:
+    """获取合并流式提问的全局实例"""
+    global _stream_flights
+    if _stream_flights is None:
+        _stream_flights = StreamFlightGroup()
+    return _stream_flights
@@ -0,0 +1,111 @@
+import logging
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# token估算配置：调用上游前按估算的提示词token数计算最高费用
+TOKEN_VOCAB_PATH = os.getenv("TOKEN_VOCAB_PATH", "")  # 分词词表文件（每行一个词片段），为空时按字符类别估算；仓库不附带词表（豆包的词表不公开）
+TOKEN_ESTIMATE_MARGIN = float(os.getenv("TOKEN_ESTIMATE_MARGIN", "1.1"))  # 估算值的安全系数，宁可多冻结也不少冻结
+
+# 每条消息的格式开销（角色标记等），以及回复开头的固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+# 预切分：汉字逐字、英文单词、最多3位的数字、换行、空格和其他符号
+_piece_re = re.compile(
+    r"[㐀-䶿一-鿿豈-﫿]"
+    r"|[A-Za-z]+(?:'[A-Za-z]+)?"
+    r"|\d{1,3}"
+    r"|\n+"
+    r"|[ \t]+"
+    r"|[^\sA-Za-z\d]"
+)
+# BPE和SentencePiece词表中表示前导空格的标记
+_space_markers = ("Ġ", "▁")
+
+
+def load_vocab(path: str) -> frozenset:
+    """读取词表文件，去掉前导空格标记后返回词片段集合"""
+    pieces = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            piece = line.rstrip("\n")
+            for marker in _space_markers:
+                if piece.startswith(marker):
+                    piece = piece[len(marker):]
+            if piece:
+                pieces.add(piece)
+    return frozenset(pieces)
+
+
+class TokenEstimator:
+    """本地估算文本的token数，按偏高的方向估算，但分词方式与上游不同，不保证不低于上游的实际计数
+
+    有词表时英文单词按最长匹配切分为词片段计数，没有词表时按每4个字母1个token计；
+    汉字、数字分组、标点各计1个token，单个空格并入后面的单词。单词的计数结果会被缓存。
+    """
+
+    def __init__(self, vocab: Optional[frozenset] = None):
+        self.vocab = vocab
+        self.max_piece_length = max((len(piece) for piece in vocab), default=0) if vocab else 0
+        self._word_tokens = lru_cache(maxsize=65536)(self._count_word)
+
+    def _count_word(self, word: str) -> int:
+        if not self.vocab:
+            return math.ceil(len(word) / 4)
+        if word in self.vocab or word.lower() in self.vocab:
+            return 1
+        # 从左到右贪心匹配最长的词片段，词表中没有的字符单独计1个token
+        tokens = 0
+        start = 0
+        while start < len(word):
+            for end in range(min(len(word), start + self.max_piece_length), start, -1):
+                if word[start:end] in self.vocab:
+                    break
+            else:
+                end = start + 1
+            tokens += 1
+            start = end
+        return tokens
+
+    def count(self, text: str) -> int:
+        """估算一段文本的token数"""
+        tokens = 0
+        for match in _piece_re.finditer(text):
+            piece = match.group()
+            first = piece[0]
+            if first.isascii() and first.isalpha():
+                tokens += self._word_tokens(piece)
+            elif first == " " or first == "\t":
+                tokens += len(piece) > 1
+            else:
+                tokens += 1
+        return tokens
+
+    def count_messages(self, contents: Iterable[str]) -> int:
+        """估算一组对话消息的token数，包括消息格式开销"""
+        return sum(self.count(content) + MESSAGE_OVERHEAD_TOKENS for content in contents) + REPLY_OVERHEAD_TOKENS
+
+
+# 全局估算器，词表只加载一次
+_estimator: Optional[TokenEstimator] = None
+
+
+def get_token_estimator() -> TokenEstimator:
+    """获取全局token估算器"""
+    global _estimator
+    if _estimator is None:
+        vocab = load_vocab(TOKEN_VOCAB_PATH) if TOKEN_VOCAB_PATH else None
+        if vocab is None:
+            logger.info("未配置 TOKEN_VOCAB_PATH，提示词token数按字符类别估算")
+        _estimator = TokenEstimator(vocab)
+    return _estimator
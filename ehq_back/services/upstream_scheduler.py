@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.metrics import record_queue_shed, record_queue_wait
+
+# 加载环境变量
+load_dotenv()
+
+# 上游调用调度配置：并发已满时按用户加权公平排队，而不是谁先到谁先得
+UPSTREAM_SCHEDULER_ENABLED = os.getenv("UPSTREAM_SCHEDULER_ENABLED", "true").lower() == "true"
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", os.getenv("DOUBAO_MAX_CONCURRENCY", "50")))  # 同时进行的上游调用数
+UPSTREAM_QUEUE_MAX = int(os.getenv("UPSTREAM_QUEUE_MAX", "200"))  # 所有用户排队的上游调用总数上限，超出时丢弃请求
+UPSTREAM_RETRY_AFTER = int(os.getenv("UPSTREAM_RETRY_AFTER", "5"))  # 被丢弃的请求建议客户端重试的等待时间（秒）
+UPSTREAM_QUEUE_NOTIFY_INTERVAL = float(os.getenv("UPSTREAM_QUEUE_NOTIFY_INTERVAL", "1"))  # 流式提问排队时推送排队位置的间隔（秒）
+# 各用户等级的权重，权重越大，并发已满时分到的调用份额越多；未配置的等级权重为1
+UPSTREAM_TIER_WEIGHTS = os.getenv("UPSTREAM_TIER_WEIGHTS", "premium:4,standard:2,free:1")
+
+# 当前请求的上游调用归属 (用户ID, 用户等级)；在请求中创建的任务（如合并调用）归属发起请求的用户
+_owner: ContextVar[Optional[Tuple[int, str]]] = ContextVar("upstream_owner", default=None)
+
+
+def _parse_weights(text: str) -> Dict[str, float]:
+    weights = {}
+    for item in text.split(","):
+        if ":" in item:
+            tier, weight = item.split(":", 1)
+            weights[tier.strip()] = max(float(weight), 0.01)
+    return weights
+
+
+def set_upstream_owner(user_id: int, tier: Optional[str]):
+    """设置当前请求的上游调用归属的用户，调度器按用户分别排队"""
+    _owner.set((user_id, tier or "standard"))
+
+
+class SchedulerOverloaded(Exception):
+    """上游调用排队已满"""
+
+    def __init__(self, message: str = "Upstream queue is full"):
+        super().__init__(message)
+
+
+class _Waiter:
+    __slots__ = ("user_id", "tier", "start", "finish", "seq", "future", "enqueued_at", "removed")
+
+    def __init__(self, user_id, tier: str, start: float, finish: float, seq: int):
+        self.user_id = user_id
+        self.tier = tier
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.perf_counter()
+        self.removed = False
+
+
+class FairScheduler:
+    """按用户加权公平排队的上游并发限制
+
+    有空闲槽位时直接放行；并发已满时每个用户各自排队，按虚拟完成时间（加权公平排队）依次放行：
+    用户每排一次调用，虚拟完成时间增加 1/权重，所以同时排队的用户按权重比例轮流获得槽位，
+    一个用户提交大量题目时只会拉长他自己的队列。排队总数达到上限时，优先丢弃排队最多的用户最后排入的调用。
+    """
+
+    def __init__(self, capacity: int = UPSTREAM_CONCURRENCY, max_queue: int = UPSTREAM_QUEUE_MAX, weights: Optional[Dict[str, float]] = None, enabled: bool = UPSTREAM_SCHEDULER_ENABLED):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.weights = weights if weights is not None else _parse_weights(UPSTREAM_TIER_WEIGHTS)
+        self.active = 0
+        self.virtual_time = 0.0
+        self._heap: List[Tuple[float, int, _Waiter]] = []
+        self._queues: Dict[object, Deque[_Waiter]] = {}
+        self._last_finish: Dict[object, float] = {}
+        self._seq = itertools.count()
+        self.queued = 0
+        self.granted = 0
+        self.shed = 0
+
+    def weight(self, tier: str) -> float:
+        return self.weights.get(tier, 1.0)
+
+    def _owner(self) -> Tuple[object, str]:
+        return _owner.get() or ("anonymous", "standard")
+
+    async def acquire(self):
+        """获取一个上游调用槽位，需要排队时按公平顺序等待；排队已满时抛出SchedulerOverloaded"""
+        if not self.enabled:
+            return
+        user_id, tier = self._owner()
+        if self.active < self.capacity and not self.queued:
+            self.active += 1
+            self.granted += 1
+            return
+        if self.queued >= self.max_queue and not self._shed_for(user_id):
+            self.shed += 1
+            record_queue_shed(tier)
+            raise SchedulerOverloaded()
+
+        start = max(self.virtual_time, self._last_finish.get(user_id, 0.0))
+        waiter = _Waiter(user_id, tier, start, start + 1 / self.weight(tier), next(self._seq))
+        self._last_finish[user_id] = waiter.finish
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        heapq.heappush(self._heap, (waiter.finish, waiter.seq, waiter))
+        self.queued += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # 已经分到槽位但调用方同时被取消（客户端断开），归还槽位
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+        record_queue_wait(tier, time.perf_counter() - waiter.enqueued_at)
+
+    def try_acquire(self) -> bool:
+        """不排队地获取槽位，只在有空闲槽位且没有人排队时成功；用于对冲等可有可无的调用"""
+        if not self.enabled:
+            return True
+        if self.active < self.capacity and not self.queued:
+            self.active += 1
+            self.granted += 1
+            return True
+        return False
+
+    def release(self):
+        """归还槽位，放行虚拟完成时间最早的排队调用"""
+        if not self.enabled:
+            return
+        self.active -= 1
+        while self._heap and self.active < self.capacity:
+            _, _, waiter = heapq.heappop(self._heap)
+            if waiter.removed:
+                continue
+            self._remove(waiter)
+            if waiter.future.done():
+                # 调用方已被取消，还没来得及退出队列
+                continue
+            self.virtual_time = max(self.virtual_time, waiter.start)
+            self.active += 1
+            self.granted += 1
+            waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self):
+        """在获取到的槽位中执行上游调用"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _remove(self, waiter: _Waiter):
+        if waiter.removed:
+            return
+        waiter.removed = True
+        self.queued -= 1
+        queue = self._queues[waiter.user_id]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.user_id]
+            # 用户不再排队时，下次排队从当前虚拟时间开始，不会因为此前的份额被惩罚或补偿
+            if self._last_finish.get(waiter.user_id, 0.0) <= self.virtual_time:
+                self._last_finish.pop(waiter.user_id, None)
+
+    def _shed_for(self, user_id) -> bool:
+        """排队已满时，丢弃排队最多的其他用户最后排入的调用，为user_id腾出位置；腾出位置时返回True"""
+        own = len(self._queues.get(user_id, ()))
+        heaviest = max(self._queues, key=lambda key: len(self._queues[key]), default=None)
+        if heaviest is None or heaviest == user_id or len(self._queues[heaviest]) <= own + 1:
+            return False
+        waiter = self._queues[heaviest][-1]
+        self._remove(waiter)
+        self.shed += 1
+        record_queue_shed(waiter.tier)
+        if not waiter.future.done():
+            waiter.future.set_exception(SchedulerOverloaded())
+        return True
+
+    def position(self, user_id) -> Optional[int]:
+        """用户最靠前的排队调用前面还有多少个调用（0表示下一个放行），没有排队时返回None"""
+        queue = self._queues.get(user_id)
+        if not queue:
+            return None
+        head = queue[0]
+        return sum(1 for _, _, waiter in self._heap if not waiter.removed and (waiter.finish, waiter.seq) < (head.finish, head.seq))
+
+    def user_queued(self, user_id) -> int:
+        return len(self._queues.get(user_id, ()))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "capacity": self.capacity,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_users": len(self._queues),
+            "max_queue": self.max_queue,
+            "granted": self.granted,
+            "shed": self.shed,
+            "weights": self.weights,
+        }
+
+
+# 全局调度器
+_scheduler: Optional[FairScheduler] = None
+
+
+def get_upstream_scheduler() -> FairScheduler:
+    """获取全局上游调用调度器"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairScheduler()
+    return _scheduler
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from decimal import Decimal
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+
+from db.database import db_session
+from db.models import QuestionRecord, Transaction, WriteBehindCheckpoint
+from services.metrics import record_write_behind_failure
+from services.similarity_index import SIMILARITY_INDEX_ENABLED, get_similarity_index
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只支持单进程
+    fcntl = None
+
+# 加载环境变量
+load_dotenv()
+
+# 写入失败会导致问题记录和消费流水延迟或丢失，用日志记录完整的异常
+logger = logging.getLogger(__name__)
+
+# 写后落库配置：问题记录和消费流水先进入进程内队列，由后台任务批量写入数据库。
+# 默认关闭：开启后 /ask 的响应和流式完成事件中记录id为空、创建时间取应用服务器时间，记录在一个写入周期后才出现在历史中
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))  # 攒够该条数立即写入
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.2"))  # 未攒够时最长等待时间（秒）
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))  # 待写入条目上限，超出后请求等待
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "5"))  # 等待超过该时间改为同步写入（秒）
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv("WRITE_BEHIND_SHUTDOWN_TIMEOUT", "10"))  # 停止服务时等待写完的时间（秒）
+WRITE_BEHIND_JOURNAL_DIR = os.getenv("WRITE_BEHIND_JOURNAL_DIR", "")  # 本地日志目录，为空则不写日志（进程崩溃时丢失未落库条目）
+WRITE_BEHIND_JOURNAL_FSYNC = os.getenv("WRITE_BEHIND_JOURNAL_FSYNC", "false").lower() == "true"  # 每条日志都fsync，断电也不丢失
+WRITE_BEHIND_JOURNAL_SLOTS = 64  # 日志文件数上限，即最多支持的worker数
+
+# 需要还原为定点数的金额字段
+MONEY_FIELDS = ("cost", "amount")
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_row(row: dict) -> dict:
+    return {key: Decimal(value) if key in MONEY_FIELDS and value is not None else value for key, value in row.items()}
+
+
+class Journal:
+    """追加写入的本地日志，每行一个待落库条目；条目全部落库后截断
+
+    多worker部署时每个进程用文件锁独占一个日志文件，重启后按序号接管并重放其中未落库的条目。
+    """
+
+    def __init__(self, directory: str, fsync: bool = WRITE_BEHIND_JOURNAL_FSYNC):
+        os.makedirs(directory, exist_ok=True)
+        self.fsync = fsync
+        self.name, self._lock_file = self._acquire_slot(directory)
+        self.path = os.path.join(directory, f"{self.name}.jsonl")
+        self._file = open(self.path, "a+", encoding="utf-8")
+
+    @staticmethod
+    def _acquire_slot(directory: str):
+        for slot in range(WRITE_BEHIND_JOURNAL_SLOTS):
+            name = f"journal-{slot}"
+            lock_file = open(os.path.join(directory, f"{name}.lock"), "w")
+            if fcntl is None:
+                return name, lock_file
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return name, lock_file
+            except OSError:
+                lock_file.close()
+        raise RuntimeError(f"{directory} 中没有空闲的写后日志文件")
+
+    def read(self) -> List[dict]:
+        self._file.seek(0)
+        entries = []
+        for line in self._file:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # 进程崩溃时最后一行可能只写了一半，该条目的请求也未返回
+                break
+        return entries
+
+    def append(self, entry: dict):
+        self._file.write(json.dumps(entry, ensure_ascii=False, default=_json_default) + "\n")
+        self._file.flush()
+
+    async def sync(self):
+        if self.fsync:
+            await run_in_threadpool(os.fsync, self._file.fileno())
+
+    def truncate(self):
+        self._file.seek(0)
+        self._file.truncate()
+
+    def close(self):
+        self._file.close()
+        self._lock_file.close()
+
+
+class WriteBehindQueue:
+    """问题记录和消费流水的写后落库队列
+
+    请求只需把条目追加到日志和内存队列即可返回；后台任务按条数或时间批量写入，
+    并在同一事务中更新日志检查点，重放时跳过已落库的条目，不会重复写入。
+    """
+
+    def __init__(
+        self,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        enqueue_timeout: float = WRITE_BEHIND_ENQUEUE_TIMEOUT,
+        journal: Optional[Journal] = None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self.journal = journal
+        self._pending = deque()
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        # 统计
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.replayed = 0
+        self.backpressure_waits = 0
+        self.direct_writes = 0
+        self.last_batch_ms = 0.0
+
+    async def start(self):
+        """重放日志中尚未落库的条目，并启动后台写入任务"""
+        if self.journal is not None:
+            entries = self.journal.read()
+            async with db_session() as db:
+                checkpoint = await db.get(WriteBehindCheckpoint, self.journal.name)
+            last_seq = checkpoint.last_seq if checkpoint else 0
+            self._seq = max([last_seq] + [entry["seq"] for entry in entries])
+            replay = [entry for entry in entries if entry["seq"] > last_seq]
+            self._pending.extend(replay)
+            self.replayed = len(replay)
+            if not replay:
+                self.journal.truncate()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = WRITE_BEHIND_SHUTDOWN_TIMEOUT):
+        """写完待落库条目后停止；超时未写完的条目保留在日志中，下次启动时重放"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            unflushed = len(self._pending)
+            record_write_behind_failure("unflushed", unflushed)
+            if self.journal is not None:
+                logger.error("写后落库队列停止时仍有 %d 条未写入数据库，保留在日志 %s 中，下次启动时重放", unflushed, self.journal.path)
+            else:
+                logger.error("写后落库队列停止时仍有 %d 条未写入数据库，未配置日志目录，这些记录已丢失", unflushed)
+        self._task = None
+        if self.journal is not None:
+            self.journal.close()
+
+    async def enqueue(self, question_record: Optional[dict] = None, transactions: List[dict] = (), index: bool = False):
+        """提交一个待落库条目；index为True时落库后把题目加入相似题目索引"""
+        entry = {"question_record": question_record, "transactions": list(transactions), "index": index}
+        if len(self._pending) >= self.max_pending:
+            # 数据库写入跟不上时让请求等待，超时后由请求自己同步写入
+            self.backpressure_waits += 1
+            try:
+                await asyncio.wait_for(self._wait_for_space(), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.direct_writes += 1
+                await self._write([entry], checkpoint=False)
+                return
+
+        self._seq += 1
+        entry["seq"] = self._seq
+        # 先写日志和内存队列再等待fsync，避免后台任务在两者之间截断日志
+        if self.journal is not None:
+            self.journal.append(entry)
+        self._pending.append(entry)
+        self.enqueued += 1
+        if len(self._pending) >= self.batch_size or len(self._pending) == 1:
+            self._wakeup.set()
+        if self.journal is not None:
+            await self.journal.sync()
+
+    async def _wait_for_space(self):
+        while len(self._pending) >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+
+    async def _run(self):
+        backoff = 0.5
+        while True:
+            if not self._pending:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # 未攒够一批时再等待一段时间，让更多条目合并写入
+            if len(self._pending) < self.batch_size and not self._stopping:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+            start = time.perf_counter()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # 写入失败时保留条目并退避重试
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                record_write_behind_failure("batch")
+                logger.exception("写后落库失败（%d 条待写入），%.1f秒后重试", len(self._pending), backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = 0.5
+            self.last_batch_ms = (time.perf_counter() - start) * 1000
+            self.batches += 1
+            self.written += len(batch)
+            for _ in batch:
+                self._pending.popleft()
+            self._space.set()
+            if self.journal is not None and not self._pending:
+                self.journal.truncate()
+
+    async def _write(self, batch: List[dict], checkpoint: bool = True):
+        """在一个事务中写入一批条目，并更新日志检查点"""
+        indexed = []
+        transactions = []
+        async with db_session() as db:
+            for entry in batch:
+                if entry["question_record"]:
+                    record = QuestionRecord(**_decode_row(entry["question_record"]))
+                    db.add(record)
+                    if entry["index"]:
+                        indexed.append(record)
+                transactions.extend(_decode_row(row) for row in entry["transactions"])
+            # 流水不需要回读主键，用一条多行INSERT写入
+            if transactions:
+                await db.execute(insert(Transaction), transactions)
+            if checkpoint and self.journal is not None:
+                await db.merge(WriteBehindCheckpoint(journal=self.journal.name, last_seq=batch[-1]["seq"]))
+            await db.commit()
+
+        if indexed and SIMILARITY_INDEX_ENABLED:
+            index = get_similarity_index()
+            for record in indexed:
+                index.add(record.id, record.question)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "pending": len(self._pending),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch_size": self.written / self.batches if self.batches else 0.0,
+            "last_batch_ms": self.last_batch_ms,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "replayed": self.replayed,
+            "backpressure_waits": self.backpressure_waits,
+            "direct_writes": self.direct_writes,
+            "journal": self.journal.path if self.journal is not None else None,
+        }
+
+
+# 全局写后落库队列
+_queue: Optional[WriteBehindQueue] = None
+
+
+def get_write_behind() -> Optional[WriteBehindQueue]:
+    """获取全局写后落库队列，未启用时返回None"""
+    global _queue
+    if _queue is None and WRITE_BEHIND_ENABLED:
+        journal = Journal(WRITE_BEHIND_JOURNAL_DIR) if WRITE_BEHIND_JOURNAL_DIR else None
+        _queue = WriteBehindQueue(journal=journal)
+    return _queue
@@ -0,0 +1,79 @@
+"""测试使用临时的SQLite数据库，环境变量需在导入应用模块之前设置（各模块导入时读取配置）"""
+import asyncio
+import itertools
+import os
+import tempfile
+from decimal import Decimal
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix="ehq-test-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_db_dir, 'test.db')}",
+    "SECRET_KEY": "test-secret",
+    "ALGORITHM": "HS256",
+    "PASSWORD_BCRYPT_ROUNDS": "4",
+    "DB_AUTO_MIGRATE": "true",
+    "WRITE_BEHIND_ENABLED": "false",
+    "RATE_LIMIT_ENABLED": "false",
+    "ANSWER_CACHE_ENABLED": "false",
+    "SIMILARITY_INDEX_ENABLED": "false",
+    "IDEMPOTENCY_STORE": "memory",
+})
+
+from db.database import SessionLocal, async_engine  # noqa: E402
+from db.migrate import upgrade_database  # noqa: E402
+from db.models import User  # noqa: E402
+
+upgrade_database()
+
+_user_ids = itertools.count(1)
+
+
+# 所有测试共用一个事件循环：全局异步引擎的连接池与创建它的事件循环绑定，不能在多个循环间切换
+_loop = asyncio.new_event_loop()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _close_loop():
+    yield
+    _loop.run_until_complete(async_engine.dispose())
+    _loop.close()
+
+
+@pytest.fixture
+def run():
+    """在测试共用的事件循环中执行协程"""
+    return _loop.run_until_complete
+
+
+@pytest.fixture
+def make_user():
+    """创建测试用户，返回用户ID"""
+
+    def factory(balance="10", tier="standard") -> int:
+        name = f"test_user_{os.getpid()}_{next(_user_ids)}"
+        db = SessionLocal()
+        try:
+            user = User(username=name, email=f"{name}@example.com", hashed_password="x", balance=Decimal(balance), tier=tier)
+            db.add(user)
+            db.commit()
+            return user.id
+        finally:
+            db.close()
+
+    return factory
+
+
+@pytest.fixture
+def balance_of():
+    """读取用户当前余额"""
+
+    def read(user_id: int) -> Decimal:
+        db = SessionLocal()
+        try:
+            return db.get(User, user_id).balance
+        finally:
+            db.close()
+
+    return read
@@ -0,0 +1,29 @@
+from services.answer_cache import AnswerCache, MemoryCacheTier, SQLiteCacheTier, make_cache_key
+
+
+def _cache(path):
+    return AnswerCache(MemoryCacheTier(60, 100, 1024 * 1024), SQLiteCacheTier(str(path), 60))
+
+
+def test_cache_key_ignores_case_and_punctuation():
+    assert make_cache_key("Choose the  answer!", "v1", "m") == make_cache_key("choose the answer", "v1", "m")
+    assert make_cache_key("choose the answer", "v1", "m") != make_cache_key("choose the answer", "v2", "m")
+
+
+def test_shared_tier_hit_fills_memory(run, tmp_path):
+    path = tmp_path / "answers.db"
+    writer = _cache(path)
+    run(writer.set("k", "answer", 12))
+
+    # 另一个worker的缓存实例从共享层命中，并写入自己的内存层
+    reader = _cache(path)
+    assert run(reader.get("k")) == {"answer": "answer", "tokens_used": 12}
+    assert reader.shared_hits == 1
+    assert run(reader.get("k")) == {"answer": "answer", "tokens_used": 12}
+    assert reader.memory_hits == 1
+
+
+def test_miss_counts(run, tmp_path):
+    cache = _cache(tmp_path / "answers.db")
+    assert run(cache.get("missing")) is None
+    assert cache.misses == 1
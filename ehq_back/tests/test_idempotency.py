@@ -0,0 +1,142 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+
+import httpx
+import pytest
+
+from api.auth import create_access_token
+from api.routers import questions
+from db.database import SessionLocal
+from db.models import User
+from services.idempotency import DatabaseIdempotencyStore, IdempotencyConflict, MemoryIdempotencyStore
+
+
+@pytest.fixture(params=["memory", "db"])
+def store(request):
+    if request.param == "memory":
+        return MemoryIdempotencyStore()
+    return DatabaseIdempotencyStore(poll_interval=0.01)
+
+
+def test_store_replays_completed_response(run, make_user, store):
+    user_id = make_user()
+
+    async def scenario():
+        first = await store.begin(user_id, "key-1", "fp")
+        await store.complete(user_id, "key-1", '{"id": 1}')
+        return first, await store.begin(user_id, "key-1", "fp")
+
+    assert run(scenario()) == (None, '{"id": 1}')
+
+
+def test_store_rejects_different_request(run, make_user, store):
+    user_id = make_user()
+
+    async def scenario():
+        await store.begin(user_id, "key-2", "fp")
+        await store.complete(user_id, "key-2", "{}")
+        await store.begin(user_id, "key-2", "other")
+
+    with pytest.raises(IdempotencyConflict):
+        run(scenario())
+
+
+def test_store_abandon_allows_retry(run, make_user, store):
+    user_id = make_user()
+
+    async def scenario():
+        await store.begin(user_id, "key-3", "fp")
+        await store.abandon(user_id, "key-3")
+        return await store.begin(user_id, "key-3", "fp")
+
+    assert run(scenario()) is None
+
+
+def test_store_keys_are_per_user(run, make_user, store):
+    first_user, second_user = make_user(), make_user()
+
+    async def scenario():
+        await store.begin(first_user, "shared", "fp")
+        await store.complete(first_user, "shared", "{}")
+        return await store.begin(second_user, "shared", "other")
+
+    assert run(scenario()) is None
+
+
+def test_store_waits_for_in_progress_request(run, make_user, store):
+    user_id = make_user()
+
+    async def scenario():
+        await store.begin(user_id, "key-4", "fp")
+        waiter = asyncio.create_task(store.begin(user_id, "key-4", "fp", timeout=5))
+        await asyncio.sleep(0.05)
+        await store.complete(user_id, "key-4", '{"id": 4}')
+        return await waiter
+
+    assert run(scenario()) == '{"id": 4}'
+
+
+@pytest.fixture
+def ask(monkeypatch, make_user):
+    """通过ASGI调用 /api/questions/ask，解答过程替换为计数的假实现，不调用上游"""
+    from main import app
+
+    calls = []
+
+    async def fake_answer_question(question_text, *args, **kwargs):
+        calls.append(question_text)
+        await asyncio.sleep(0.05)
+        return {
+            "id": len(calls),
+            "question": question_text,
+            "answer": "answer",
+            "tokens_used": 10,
+            "cost": Decimal("0.01"),
+            "created_at": datetime(2026, 1, 1)
+        }
+
+    monkeypatch.setattr(questions, "answer_question", fake_answer_question)
+    user_id = make_user()
+    db = SessionLocal()
+    try:
+        username = db.get(User, user_id).username
+    finally:
+        db.close()
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': username})}"}
+
+    async def post(question: str, key: str):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/questions/ask", json={"question": question}, headers=dict(headers, **{"Idempotency-Key": key}))
+
+    post.calls = calls
+    return post
+
+
+def test_ask_replays_same_key(run, ask):
+    first = run(ask("What is a noun?", "retry-1"))
+    second = run(ask("What is a noun?", "retry-1"))
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert ask.calls == ["What is a noun?"]
+
+
+def test_ask_concurrent_duplicates_answer_once(run, ask):
+    async def scenario():
+        return await asyncio.gather(*(ask("What is a verb?", "retry-2") for _ in range(3)))
+
+    responses = run(scenario())
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert len({response.json()["id"] for response in responses}) == 1
+    assert ask.calls == ["What is a verb?"]
+
+
+def test_ask_rejects_key_reused_for_different_question(run, ask):
+    assert run(ask("What is an adverb?", "retry-3")).status_code == 200
+    conflict = run(ask("What is an adjective?", "retry-3"))
+
+    assert conflict.status_code == 422
+    assert ask.calls == ["What is an adverb?"]
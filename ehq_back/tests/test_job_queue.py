@@ -0,0 +1,129 @@
+import asyncio
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import update
+
+from db.database import SessionLocal, db_session
+from db.models import QUESTION_STATUS_COMPLETED, QUESTION_STATUS_FAILED, QUESTION_STATUS_QUEUED, QUESTION_STATUS_RUNNING, QuestionRecord
+from services import ledger
+from services.job_queue import JobQueue
+
+
+@pytest.fixture(autouse=True)
+def _no_other_queued_jobs():
+    """领取会扫描整张表，先把其他测试遗留的排队任务标记为失败"""
+    db = SessionLocal()
+    try:
+        db.execute(update(QuestionRecord).where(QuestionRecord.status == QUESTION_STATUS_QUEUED).values(status=QUESTION_STATUS_FAILED))
+        db.commit()
+    finally:
+        db.close()
+
+
+def make_job(user_id: int, priority: int = 0, run_after=None, hold_transaction_id=None) -> int:
+    db = SessionLocal()
+    try:
+        job = QuestionRecord(
+            user_id=user_id, question="job question", status=QUESTION_STATUS_QUEUED,
+            priority=priority, run_after=run_after, hold_transaction_id=hold_transaction_id
+        )
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def load_job(job_id: int) -> QuestionRecord:
+    db = SessionLocal()
+    try:
+        return db.get(QuestionRecord, job_id)
+    finally:
+        db.close()
+
+
+def test_claim_prefers_higher_priority(run, make_user):
+    user_id = make_user()
+    low = make_job(user_id, priority=0)
+    high = make_job(user_id, priority=10)
+
+    queue = JobQueue(workers=2)
+    assert run(queue.claim()) == high
+    assert run(queue.claim()) == low
+    assert run(queue.claim()) is None
+    job = load_job(high)
+    assert job.status == QUESTION_STATUS_RUNNING and job.attempts == 1
+
+
+def test_claim_skips_jobs_in_backoff(run, make_user):
+    user_id = make_user()
+    make_job(user_id, run_after=datetime.utcnow() + timedelta(hours=1))
+
+    assert run(JobQueue().claim()) is None
+
+
+def test_concurrent_workers_claim_each_job_once(run, make_user):
+    user_id = make_user()
+    jobs = {make_job(user_id) for _ in range(3)}
+
+    async def scenario():
+        # 每个JobQueue相当于一个worker进程，同时领取同一批任务
+        queues = [JobQueue(workers=3) for _ in range(6)]
+        return await asyncio.gather(*(queue.claim() for queue in queues))
+
+    claimed = [job_id for job_id in run(scenario()) if job_id is not None]
+    assert sorted(claimed) == sorted(jobs)
+    assert all(load_job(job_id).attempts == 1 for job_id in jobs)
+
+
+def _reserve(run, user_id, amount):
+    async def scenario():
+        async with db_session() as db:
+            return await ledger.reserve(db, user_id, amount)
+
+    return run(scenario())
+
+
+def test_complete_settles_hold(run, make_user, balance_of):
+    user_id = make_user("5")
+    hold = _reserve(run, user_id, "2")
+    job_id = make_job(user_id, hold_transaction_id=hold.transaction_id)
+
+    queue = JobQueue()
+    assert run(queue.claim()) == job_id
+    run(queue._complete(load_job(job_id), {"answer": "answer", "tokens_used": 100, "cost": Decimal("0.5"), "api_key_id": None}))
+
+    job = load_job(job_id)
+    assert job.status == QUESTION_STATUS_COMPLETED and job.answer == "answer"
+    assert balance_of(user_id) == Decimal("4.5000")
+
+
+def test_final_failure_releases_hold(run, make_user, balance_of):
+    user_id = make_user("5")
+    hold = _reserve(run, user_id, "2")
+    job_id = make_job(user_id, hold_transaction_id=hold.transaction_id)
+
+    queue = JobQueue()
+    assert run(queue.claim()) == job_id
+    run(queue._fail(load_job(job_id), "bad request", retryable=False))
+
+    assert load_job(job_id).status == QUESTION_STATUS_FAILED
+    assert balance_of(user_id) == Decimal("5.0000")
+
+
+def test_retryable_failure_requeues_with_backoff(run, make_user, balance_of):
+    user_id = make_user("5")
+    hold = _reserve(run, user_id, "2")
+    job_id = make_job(user_id, hold_transaction_id=hold.transaction_id)
+
+    queue = JobQueue()
+    assert run(queue.claim()) == job_id
+    run(queue._fail(load_job(job_id), "upstream 503", retryable=True))
+
+    job = load_job(job_id)
+    assert job.status == QUESTION_STATUS_QUEUED and job.run_after is not None
+    # 退避期间不会被再次领取，冻结保持不变
+    assert run(queue.claim()) is None
+    assert balance_of(user_id) == Decimal("3.0000")
@@ -0,0 +1,156 @@
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import select
+
+from db.database import db_session
+from db.models import Transaction
+from services import ledger
+
+
+async def _transactions(user_id):
+    async with db_session() as db:
+        rows = await db.execute(
+            select(Transaction.transaction_type, Transaction.amount).where(Transaction.user_id == user_id).order_by(Transaction.id)
+        )
+        return [(kind, Decimal(amount)) for kind, amount in rows.all()]
+
+
+def test_reserve_deducts_and_records_hold(run, make_user, balance_of):
+    user_id = make_user("10")
+
+    async def scenario():
+        async with db_session() as db:
+            return await ledger.reserve(db, user_id, "3.5")
+
+    hold = run(scenario())
+    assert hold is not None and hold.amount == Decimal("3.5000")
+    assert balance_of(user_id) == Decimal("6.5000")
+    assert run(_transactions(user_id)) == [(ledger.TRANSACTION_HOLD, Decimal("-3.5000"))]
+
+
+def test_reserve_rejects_insufficient_balance(run, make_user, balance_of):
+    user_id = make_user("1")
+
+    async def scenario():
+        async with db_session() as db:
+            return await ledger.reserve(db, user_id, "1.0001")
+
+    assert run(scenario()) is None
+    assert balance_of(user_id) == Decimal("1.0000")
+    # 失败的冻结不留下流水
+    assert run(_transactions(user_id)) == []
+
+
+def test_settle_refunds_unused_hold(run, make_user, balance_of):
+    user_id = make_user("10")
+
+    async def scenario():
+        async with db_session() as db:
+            hold = await ledger.reserve(db, user_id, "4")
+            await ledger.settle(db, hold, "1.25")
+            await db.commit()
+
+    run(scenario())
+    assert balance_of(user_id) == Decimal("8.7500")
+    assert run(_transactions(user_id)) == [(ledger.TRANSACTION_CONSUMPTION, Decimal("-1.2500"))]
+
+
+def test_settle_above_hold_overdraws(run, make_user, balance_of):
+    user_id = make_user("2")
+
+    async def scenario():
+        async with db_session() as db:
+            hold = await ledger.reserve(db, user_id, "2")
+            # 上游已经产生费用，超出冻结的部分照常扣除
+            await ledger.settle(db, hold, "2.5")
+            await db.commit()
+
+    run(scenario())
+    assert balance_of(user_id) == Decimal("-0.5000")
+
+
+def test_release_refunds_once(run, make_user, balance_of):
+    user_id = make_user("5")
+
+    async def scenario():
+        async with db_session() as db:
+            hold = await ledger.reserve(db, user_id, "3")
+            first = await ledger.release(db, hold)
+            await db.commit()
+            second = await ledger.release(db, hold)
+            await db.commit()
+            return first, second
+
+    assert run(scenario()) == (True, False)
+    assert balance_of(user_id) == Decimal("5.0000")
+    assert run(_transactions(user_id)) == []
+
+
+def test_release_after_settle_is_noop(run, make_user, balance_of):
+    user_id = make_user("5")
+
+    async def scenario():
+        async with db_session() as db:
+            hold = await ledger.reserve(db, user_id, "3")
+            await ledger.settle(db, hold, "1")
+            await db.commit()
+            released = await ledger.release(db, hold)
+            await db.commit()
+            return released
+
+    assert run(scenario()) is False
+    assert balance_of(user_id) == Decimal("4.0000")
+
+
+def test_settle_after_release_charges_directly(run, make_user, balance_of):
+    user_id = make_user("5")
+
+    async def scenario():
+        async with db_session() as db:
+            hold = await ledger.reserve(db, user_id, "3")
+            # 冻结已被超时清理退回，结算改为直接扣费
+            await ledger.release(db, hold)
+            await db.commit()
+            await ledger.settle(db, hold, "1")
+            await db.commit()
+
+    run(scenario())
+    assert balance_of(user_id) == Decimal("4.0000")
+    assert run(_transactions(user_id)) == [(ledger.TRANSACTION_CONSUMPTION, Decimal("-1.0000"))]
+
+
+def test_charge_respects_overdraft_rule(run, make_user, balance_of):
+    user_id = make_user("1")
+
+    async def scenario():
+        async with db_session() as db:
+            refused = await ledger.charge(db, user_id, "1.5")
+            await db.rollback()
+            allowed = await ledger.charge(db, user_id, "1.5", allow_overdraft=True)
+            await db.commit()
+            return refused, allowed
+
+    assert run(scenario()) == (False, True)
+    assert balance_of(user_id) == Decimal("-0.5000")
+    assert run(_transactions(user_id)) == [(ledger.TRANSACTION_CONSUMPTION, Decimal("-1.5000"))]
+
+
+def test_concurrent_reserves_never_overdraw(run, make_user, balance_of):
+    user_id = make_user("10")
+
+    async def reserve_once():
+        async with db_session() as db:
+            return await ledger.reserve(db, user_id, "3")
+
+    async def scenario():
+        return await asyncio.gather(*(reserve_once() for _ in range(5)))
+
+    holds = run(scenario())
+    assert sum(hold is not None for hold in holds) == 3
+    assert balance_of(user_id) == Decimal("1.0000")
+
+
+def test_to_money_rounds_half_up():
+    assert ledger.to_money(0.00005) == Decimal("0.0001")
+    assert ledger.to_money("1.23444") == Decimal("1.2344")
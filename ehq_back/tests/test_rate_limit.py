@@ -0,0 +1,55 @@
+import pytest
+
+from services.rate_limit import MemoryBucketStore, RateLimiter, SQLiteBucketStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def limiter(request, tmp_path):
+    if request.param == "memory":
+        return RateLimiter(MemoryBucketStore())
+    return RateLimiter(SQLiteBucketStore(str(tmp_path / "buckets.db")))
+
+
+def _checks(user, user_limit=(2, 0.001), global_limit=(3, 0.001)):
+    return [("user", user, user_limit), ("global", "all", global_limit)]
+
+
+def test_check_allows_until_bucket_empty(run, limiter):
+    assert run(limiter.check("ask", _checks("1"))) == 0
+    assert run(limiter.check("ask", _checks("1"))) == 0
+    assert run(limiter.check("ask", _checks("1"))) > 0
+    assert limiter.throttled[("user", "ask")] == 1
+
+
+def test_user_throttled_does_not_spend_global(run, limiter):
+    for _ in range(2):
+        assert run(limiter.check("ask", _checks("1"))) == 0
+    # 用户1被限流的请求不消耗全局配额
+    for _ in range(5):
+        assert run(limiter.check("ask", _checks("1"))) > 0
+    assert run(limiter.check("ask", _checks("2"))) == 0
+    assert limiter.throttled[("global", "ask")] == 0
+
+
+def test_global_throttled_does_not_spend_user(run, limiter):
+    assert run(limiter.check("ask", _checks("1", global_limit=(1, 0.001)))) == 0
+    assert run(limiter.check("ask", _checks("2", global_limit=(1, 0.001)))) > 0
+    assert limiter.throttled[("global", "ask")] == 1
+    # 全局被限流的请求没有扣除用户2的令牌
+    assert run(limiter.check("ask", _checks("2", global_limit=None))) == 0
+    assert run(limiter.check("ask", _checks("2", global_limit=None))) == 0
+
+
+def test_disabled_limits_always_allow(run, limiter):
+    for _ in range(5):
+        assert run(limiter.check("ask", _checks("1", user_limit=None, global_limit=None))) == 0
+
+
+def test_key_tpm_overdraft_blocks_key(run, limiter, monkeypatch):
+    monkeypatch.setattr("services.rate_limit.RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr("services.rate_limit.RATE_LIMIT_KEY_TPM", 100)
+    assert run(limiter.acquire_key(1)) == 0
+    run(limiter.consume_key_tokens(1, 150))
+    assert run(limiter.key_retry_after(1)) > 0
+    assert run(limiter.acquire_key(1)) > 0
+    assert run(limiter.acquire_key(2)) == 0
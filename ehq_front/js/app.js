@@ -3,6 +3,9 @@
 // API基础URL
 const API_BASE_URL = 'http://localhost:8000/api';
 
+// 提问最长等待时间（秒），超时后放弃请求，服务端据此不再为这次提问调用上游
+const QUESTION_TIMEOUT_SECONDS = 90;
+
 // 页面元素
 const pages = document.querySelectorAll('.page');
 const navLinks = document.querySelectorAll('[data-page]');
@@ -37,6 +40,7 @@ const answerCost = document.getElementById('answer-cost');
 // 历史记录元素
 const historyList = document.getElementById('history-list');
 const historyEmpty = document.getElementById('history-empty');
+const historyLoadMore = document.getElementById('history-load-more');
 
 // 初始化应用
 function initApp() {
@@ -51,6 +55,9 @@ function initApp() {
     
     // 设置退出登录事件
     document.getElementById('logout-btn').addEventListener('click', logout);
+    
+    // 历史记录加载下一页
+    historyLoadMore.addEventListener('click', () => loadQuestionHistory(false));
 }
 
 // 检查用户认证状态
@@ -344,6 +351,43 @@ async function recharge() {
     }
 }
 
+// 读取服务端推送的SSE事件流，按事件名分发给对应的处理函数
+async function readEventStream(response, handlers) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        
+        buffer += decoder.decode(value, { stream: true });
+        
+        // 事件之间以空行分隔
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            
+            if (data && handlers[eventName]) {
+                handlers[eventName](JSON.parse(data));
+            }
+        }
+    }
+}
+
 // 提交英语题目
 async function askQuestion() {
     hideError(questionError);
@@ -371,27 +415,49 @@ async function askQuestion() {
     submitBtn.disabled = true;
     submitBtn.innerHTML = '<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> 处理中...';
     
+    // 超时后中止请求，连接断开后服务端会取消上游调用
+    const controller = new AbortController();
+    const timer = setTimeout(() => controller.abort(), QUESTION_TIMEOUT_SECONDS * 1000);
+    
     try {
-        const response = await fetch(`${API_BASE_URL}/questions/ask`, {
+        const response = await fetch(`${API_BASE_URL}/questions/ask/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-                'Authorization': `Bearer ${token}`
+                'Authorization': `Bearer ${token}`,
+                'X-Request-Timeout': String(QUESTION_TIMEOUT_SECONDS)
             },
             body: JSON.stringify({
                 question
-            })
+            }),
+            signal: controller.signal
         });
         
         if (response.ok) {
-            const data = await response.json();
-            
-            // 显示答案
-            answerQuestion.textContent = data.question;
-            answerContent.textContent = data.answer;
-            answerCost.textContent = `消费: ${data.cost.toFixed(2)} 元`;
+            // 显示答案卡片，解答内容随流式返回逐步追加
+            answerQuestion.textContent = question;
+            answerContent.textContent = '';
+            answerCost.textContent = '生成中...';
             answerCard.classList.remove('d-none');
             
+            await readEventStream(response, {
+                queued: (data) => {
+                    answerCost.textContent = `排队中，前面还有 ${data.position} 个请求...`;
+                },
+                delta: (data) => {
+                    if (!answerContent.textContent) {
+                        answerCost.textContent = '生成中...';
+                    }
+                    answerContent.textContent += data.content;
+                },
+                done: (data) => {
+                    answerCost.textContent = `消费: ${data.cost.toFixed(2)} 元`;
+                },
+                error: (data) => {
+                    showError(questionError, data.detail || '解答生成失败');
+                }
+            });
+            
             // 更新用户余额
             await getUserInfo();
             
@@ -403,24 +469,34 @@ async function askQuestion() {
         }
     } catch (error) {
         console.error('提交题目失败:', error);
-        showError(questionError, '提交请求失败，请稍后再试');
+        showError(questionError, error.name === 'AbortError' ? '解答超时，请稍后再试' : '提交请求失败，请稍后再试');
     } finally {
+        clearTimeout(timer);
         // 恢复按钮状态
         submitBtn.disabled = false;
         submitBtn.innerHTML = originalBtnText;
     }
 }
 
-// 加载问题历史记录
-async function loadQuestionHistory() {
+// 历史记录分页状态
+const HISTORY_PAGE_SIZE = 20;
+let historyCursor = null;
+
+// 加载问题历史记录，reset为true时从第一页重新加载，否则加载下一页
+async function loadQuestionHistory(reset = true) {
     const token = localStorage.getItem('token');
     
     if (!token) {
         return;
     }
     
-    // 清空历史记录列表
-    historyList.innerHTML = '';
+    if (reset) {
+        // 清空历史记录列表
+        historyList.innerHTML = '';
+        historyCursor = null;
+        historyEmpty.classList.add('d-none');
+    }
+    historyLoadMore.classList.add('d-none');
     
     // 显示加载状态
     const loadingSpinner = document.createElement('div');
@@ -429,4 +505,185 @@ async function loadQuestionHistory() {
     historyList.appendChild(loadingSpinner);
     
     try {
-        const response = await fetch(`${API_BASE_URL}/questions/history`, {
\ No newline at end of file
+        const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE });
+        if (historyCursor !== null) {
+            params.set('cursor', historyCursor);
+        }
+        
+        const response = await fetch(`${API_BASE_URL}/questions/history?${params}`, {
+            headers: {
+                'Authorization': `Bearer ${token}`
+            }
+        });
+        
+        loadingSpinner.remove();
+        
+        if (response.ok) {
+            const page = await response.json();
+            
+            if (reset && page.items.length === 0) {
+                historyEmpty.classList.remove('d-none');
+                return;
+            }
+            
+            page.items.forEach(record => {
+                historyList.appendChild(createHistoryItem(record));
+            });
+            
+            // 还有更多记录时显示"加载更多"按钮
+            historyCursor = page.next_cursor;
+            if (historyCursor !== null) {
+                historyLoadMore.classList.remove('d-none');
+            }
+        } else {
+            historyList.innerHTML = '<div class="alert alert-danger">加载历史记录失败</div>';
+        }
+    } catch (error) {
+        console.error('加载历史记录失败:', error);
+        loadingSpinner.remove();
+        historyList.insertAdjacentHTML('beforeend', '<div class="alert alert-danger">加载历史记录失败，请稍后再试</div>');
+    }
+}
+
+// 创建历史记录项，点击后按需加载完整解答
+function createHistoryItem(record) {
+    const item = document.createElement('div');
+    item.className = 'card mb-3 history-item';
+    
+    const body = document.createElement('div');
+    body.className = 'card-body';
+    
+    const header = document.createElement('div');
+    header.className = 'd-flex justify-content-between align-items-center mb-2';
+    header.innerHTML = `
+        <small class="text-muted">${new Date(record.created_at).toLocaleString()}</small>
+        <span class="badge bg-secondary">消费: ${record.cost.toFixed(2)} 元</span>
+    `;
+    
+    const question = document.createElement('p');
+    question.className = 'card-text mb-0';
+    question.textContent = record.question;
+    
+    const detail = document.createElement('div');
+    detail.className = 'history-detail d-none mt-3';
+    
+    body.appendChild(header);
+    body.appendChild(question);
+    body.appendChild(detail);
+    item.appendChild(body);
+    
+    item.addEventListener('click', () => toggleHistoryDetail(record.id, question, detail));
+    
+    return item;
+}
+
+// 展开或收起历史记录详情，首次展开时获取完整记录
+async function toggleHistoryDetail(recordId, questionElement, detailElement) {
+    if (!detailElement.classList.contains('d-none')) {
+        detailElement.classList.add('d-none');
+        return;
+    }
+    
+    detailElement.classList.remove('d-none');
+    if (detailElement.dataset.loaded) {
+        return;
+    }
+    
+    const token = localStorage.getItem('token');
+    detailElement.innerHTML = '<div class="spinner-border spinner-border-sm text-primary" role="status"></div>';
+    
+    try {
+        const response = await fetch(`${API_BASE_URL}/questions/record/${recordId}`, {
+            headers: {
+                'Authorization': `Bearer ${token}`
+            }
+        });
+        
+        if (response.ok) {
+            const record = await response.json();
+            questionElement.textContent = record.question;
+            
+            detailElement.innerHTML = '<h6>解答：</h6>';
+            const answer = document.createElement('div');
+            answer.className = 'p-3 bg-light rounded answer-text';
+            answer.textContent = record.answer;
+            detailElement.appendChild(answer);
+            detailElement.dataset.loaded = 'true';
+        } else {
+            detailElement.innerHTML = '<div class="text-danger">加载解答失败</div>';
+        }
+    } catch (error) {
+        console.error('加载解答失败:', error);
+        detailElement.innerHTML = '<div class="text-danger">加载解答失败，请稍后再试</div>';
+    }
+}
+
+// 退出登录
+function logout(e) {
+    if (e) {
+        e.preventDefault();
+    }
+    localStorage.removeItem('token');
+    showGuestNav();
+    navigateTo('home');
+}
+
+// 判断是否已登录
+function isLoggedIn() {
+    return !!localStorage.getItem('token');
+}
+
+// 显示未登录导航
+function showGuestNav() {
+    guestNav.classList.remove('d-none');
+    userNav.classList.add('d-none');
+}
+
+// 显示已登录导航
+function showUserNav(userData) {
+    guestNav.classList.add('d-none');
+    userNav.classList.remove('d-none');
+    updateBalance(userData.balance);
+}
+
+// 更新个人信息
+function updateUserInfo(userData) {
+    profileUsername.textContent = userData.username;
+    profileEmail.textContent = userData.email;
+    updateBalance(userData.balance);
+}
+
+// 更新余额显示
+function updateBalance(balance) {
+    userBalanceElements.forEach(element => {
+        element.textContent = balance.toFixed(2);
+    });
+    profileBalance.textContent = `${balance.toFixed(2)} 元`;
+}
+
+// 显示错误提示
+function showError(element, message) {
+    element.textContent = message;
+    element.classList.remove('d-none');
+}
+
+// 隐藏错误提示
+function hideError(element) {
+    element.textContent = '';
+    element.classList.add('d-none');
+}
+
+// 显示成功提示
+function showSuccess(element, message) {
+    element.textContent = message;
+    element.classList.remove('d-none');
+}
+
+// 隐藏成功提示
+function hideSuccess(element) {
+    element.textContent = '';
+    element.classList.add('d-none');
+}
+
+// 页面加载完成后初始化应用
+document.addEventListener('DOMContentLoaded', initApp);